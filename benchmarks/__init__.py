@@ -0,0 +1,17 @@
+"""
+Benchmarks of PyChamberFlux on synthetic chamber data
+
+- `benchmarks.synthetic`: generator of synthetic biomet, concentration, and
+  flow rate data files, with the matching chamber schedules and config
+- `benchmarks.run_benchmarks`: timed benchmarks of the processing stages,
+  with results recorded for comparison over time
+- `benchmarks.equivalence`: numerical equivalence of the fitting engines
+  and parallel run options with the frozen reference engine
+
+Run from the root of the repository::
+
+    python -m benchmarks.run_benchmarks --chambers 6 --rate 10
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
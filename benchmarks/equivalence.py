@@ -0,0 +1,403 @@
+"""
+Numerical equivalence of fitting engines and run options
+
+Faster engines and parallel run options must not change the fluxes.  This
+harness runs `flux_calc.py` on a dataset once with the frozen reference
+engine (`chflux.reference`, with the windows, species, and days processed
+one after another), and once with each engine to check.  Then it compares
+the flux and the fitting diagnostics tables (`df_flux`, `df_diag`) column
+by column.  Both tables are read at full precision from the output store
+of each run, with rows matched by `(doy_utc, ch_no)`.
+
+The engines to check are named sets of run options (`ENGINES`), e.g.,
+'fit_processes' to fit the windows of a day in a process pool; options may
+also be set from the command line.  The dataset is either synthetic
+(`benchmarks.synthetic`), or a recorded dataset given by its config file.
+
+For each column, the maximum absolute and relative differences are reported
+against a declared tolerance, `|x - x_ref| <= atol + rtol * |x_ref|`.
+Tolerances are matched to the column names by patterns (`TOLERANCES`);
+the first matching pattern applies.  NaN values must be at the same rows,
+and non-numeric columns must be equal.
+
+Examples::
+
+    python -m benchmarks.equivalence --engines default,fit_processes
+    python -m benchmarks.equivalence --config ./config.yaml \
+        -s 2017-06-01 -e 2017-06-03 --set n_fit_workers=4
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import os
+import sys
+import copy
+import fnmatch
+import shutil
+import argparse
+import tempfile
+import subprocess
+import collections
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from chflux.io.fluxstore import OUTPUT_KEYS, read_output_store
+from chflux.iotools import load_config
+from benchmarks.synthetic import add_dataset_arguments, dataset_kwargs, \
+    generate_dataset
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run options of the reference run
+REFERENCE_OPTIONS = {'fit_engine': 'reference', 'n_workers': 1,
+                     'n_fit_workers': 1, 'n_species_threads': 1}
+
+# engines to check, as run options on top of those of the dataset config
+ENGINES = collections.OrderedDict([
+    ('default', {'fit_engine': 'default'}),
+    ('fit_threads', {'n_fit_workers': 4, 'fit_executor': 'thread'}),
+    ('fit_processes', {'n_fit_workers': 4, 'fit_executor': 'process'}),
+    ('species_threads', {'n_species_threads': 3}),
+    ('day_workers', {'n_workers': 2}),
+    ('by_day', {'load_data_by_day': True}),
+])
+
+# declared tolerances (pattern, atol, rtol) of the output columns; the first
+# matching pattern applies
+TOLERANCES = [
+    # row keys, chamber descriptors, counts, and flags must be equal
+    ('doy_utc', 0., 0.), ('doy_local', 0., 0.), ('ch_no', 0., 0.),
+    ('ch_label', 0., 0.), ('A_ch', 0., 0.), ('V_ch', 0., 0.),
+    ('n_obs_*', 0., 0.), ('qc_*', 0., 0.), ('status_*', 0., 0.),
+    # iterative optimizations converge to their own tolerances; optimized
+    # time lags in seconds
+    ('t_lag_*', 1e-3, 0.), ('*nonlin*', 1e-12, 1e-6),
+    # p-values of tiny magnitudes
+    ('p_*', 1e-15, 1e-6),
+    ('*', 1e-12, 1e-9),
+]
+
+
+def load_tolerances(path=None):
+    """
+    Return the declared tolerances, with those of a YAML file first.
+
+    The file maps column name patterns to `[atol, rtol]`, e.g.,
+    `'fco2_*': [1e-6, 1e-4]`.
+    """
+    if path is None:
+        return list(TOLERANCES)
+    user_tolerances = load_config(path)
+    return [(pattern, float(atol), float(rtol)) for pattern, (atol, rtol)
+            in user_tolerances.items()] + TOLERANCES
+
+
+def column_tolerance(column, tolerances=None):
+    """Return the absolute and relative tolerances of a column."""
+    if tolerances is None:
+        tolerances = TOLERANCES
+    for pattern, atol, rtol in tolerances:
+        if fnmatch.fnmatchcase(column, pattern):
+            return atol, rtol
+    return 0., 0.
+
+
+def compare_columns(x_ref, x, atol, rtol):
+    """
+    Compare a column with its reference.
+
+    Returns
+    -------
+    max_abs_diff, max_rel_diff : float
+        Maximum absolute and relative differences of the finite values.
+    n_failed : int
+        Number of values outside the tolerance, or with NaN values on one
+        side only.
+    """
+    x_ref = np.asarray(x_ref)
+    x = np.asarray(x)
+    if x_ref.dtype.kind not in 'biuf' or x.dtype.kind not in 'biuf':
+        not_equal = x_ref.astype(str) != x.astype(str)
+        return np.nan, np.nan, int(np.sum(not_equal))
+
+    x_ref = x_ref.astype(np.float64)
+    x = x.astype(np.float64)
+    nan_ref = np.isnan(x_ref)
+    nan_mismatch = nan_ref != np.isnan(x)
+    both = ~nan_ref & ~np.isnan(x)
+    # equal infinite values have no difference
+    equal = both & (x == x_ref)
+    abs_diff = np.where(equal, 0., np.abs(x - x_ref))
+    scale = np.maximum(np.abs(x), np.abs(x_ref))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel_diff = np.where(equal, 0., abs_diff / scale)
+        failed = both & ~equal & ~(abs_diff <= atol + rtol * np.abs(x_ref))
+    if np.any(both):
+        max_abs_diff = float(np.max(abs_diff[both]))
+        max_rel_diff = float(np.max(rel_diff[both]))
+    else:
+        max_abs_diff = max_rel_diff = np.nan
+    return max_abs_diff, max_rel_diff, \
+        int(np.sum(failed) + np.sum(nan_mismatch))
+
+
+def compare_tables(df_ref, df, tolerances=None, keys=OUTPUT_KEYS):
+    """
+    Compare an output table with its reference, column by column.
+
+    Parameters
+    ----------
+    df_ref, df : pandas.DataFrame
+        The reference table and the table to check.
+    tolerances : list of tuple, optional
+        Declared tolerances; see `TOLERANCES`.
+    keys : list of str, optional
+        Key columns to match the rows.  Rows found in only one table count
+        as differences in all other columns.
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        One row per column of either table: 'max_abs_diff', 'max_rel_diff',
+        'atol', 'rtol', 'n_values', 'n_failed', and 'passed'.  Columns found
+        in only one table fail.
+    """
+    df_ref = df_ref.reset_index(drop=True)
+    df = df.reset_index(drop=True)
+    merged = pd.merge(df_ref, df, how='outer', on=keys,
+                      suffixes=('__ref', '__test'), indicator=True)
+    matched = (merged['_merge'] == 'both').values
+    columns = list(df_ref.columns) + \
+        [c for c in df.columns if c not in df_ref.columns]
+
+    rows = []
+    for column in columns:
+        atol, rtol = column_tolerance(column, tolerances)
+        if column in keys:
+            n_failed = int(np.sum(~matched))
+            max_abs_diff = max_rel_diff = 0.
+        elif column in df_ref.columns and column in df.columns:
+            max_abs_diff, max_rel_diff, n_failed = compare_columns(
+                merged[column + '__ref'].values,
+                merged[column + '__test'].values, atol, rtol)
+        else:
+            max_abs_diff = max_rel_diff = np.nan
+            n_failed = merged.shape[0]
+        rows.append((column, max_abs_diff, max_rel_diff, atol, rtol,
+                     merged.shape[0], n_failed, n_failed == 0))
+    return pd.DataFrame.from_records(
+        rows, index='column',
+        columns=['column', 'max_abs_diff', 'max_rel_diff', 'atol', 'rtol',
+                 'n_values', 'n_failed', 'passed'])
+
+
+def run_flux_calc(config_path, run_dir, run_options, workdir,
+                  date_start=None, date_end=None):
+    """
+    Run `flux_calc.py` with some run options in a new process, and return
+    the directory of its output store.
+    """
+    config = load_config(config_path)
+    config.setdefault('run_options', {}).update(run_options)
+    config['run_options'].update({
+        'output_decimals': None, 'output_compression': None,
+        'save_fitting_diagnostics': True, 'save_fitting_plots': False,
+        'save_fitting_curves': False, 'save_daily_plots': False})
+    data_dir = config.setdefault('data_dir', {})
+    data_dir['output_dir'] = os.path.join(run_dir, 'output', '')
+    data_dir['output_store'] = os.path.join(run_dir, 'store')
+    data_dir['output_database'] = None
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    run_config_path = os.path.join(run_dir, 'config.yaml')
+    with open(run_config_path, 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    command = [sys.executable, os.path.join(REPO_DIR, 'flux_calc.py'),
+               '-c', run_config_path]
+    if date_start is not None:
+        command += ['-s', date_start]
+    if date_end is not None:
+        command += ['-e', date_end]
+    with open(os.path.join(run_dir, 'flux_calc.log'), 'w') as log:
+        subprocess.run(command, env=env, cwd=workdir, check=True,
+                       stdout=log, stderr=subprocess.STDOUT)
+    return data_dir['output_store']
+
+
+def check_equivalence(config_path, engines, workdir=None, run_root=None,
+                      date_start=None, date_end=None, tolerances=None):
+    """
+    Run the reference engine and other engines on a dataset, and compare
+    their output tables.
+
+    Parameters
+    ----------
+    config_path : str
+        Config file of the dataset.
+    engines : dict
+        Run options of the engines to check, by engine name.
+    workdir : str, optional
+        Working directory of the runs, to which relative paths in the config
+        refer.  Default is the current directory.
+    run_root : str, optional
+        Directory of the outputs of the runs, one subfolder per engine.
+        Default is a temporary directory, removed afterwards.
+    date_start, date_end : str, optional
+        Date range to process; default is that of the config.
+    tolerances : list of tuple, optional
+        Declared tolerances; see `TOLERANCES`.
+
+    Returns
+    -------
+    reports : dict
+        Comparison reports by engine name, each a dict of the reports of
+        the 'flux' and 'diag' tables; see `compare_tables()`.
+    """
+    if workdir is None:
+        workdir = os.getcwd()
+    remove_runs = run_root is None
+    if remove_runs:
+        run_root = tempfile.mkdtemp(prefix='chflux_equiv_')
+    try:
+        print('Running the reference engine...')
+        ref_store = run_flux_calc(
+            config_path, os.path.join(run_root, 'reference'),
+            REFERENCE_OPTIONS, workdir, date_start, date_end)
+        ref_tables = {table: read_output_store(ref_store, table)
+                      for table in ['flux', 'diag']}
+        if ref_tables['flux'] is None:
+            raise RuntimeError('No fluxes from the reference run; see %s' %
+                               os.path.join(run_root, 'reference'))
+
+        reports = collections.OrderedDict()
+        for name, run_options in engines.items():
+            print("Running the engine '%s'..." % name)
+            store = run_flux_calc(
+                config_path, os.path.join(run_root, name), run_options,
+                workdir, date_start, date_end)
+            reports[name] = collections.OrderedDict()
+            for table in ['flux', 'diag']:
+                df = read_output_store(store, table)
+                if df is None:
+                    df = ref_tables[table].iloc[:0]
+                reports[name][table] = compare_tables(
+                    ref_tables[table], df, tolerances)
+    finally:
+        if remove_runs:
+            shutil.rmtree(run_root, ignore_errors=True)
+    return reports
+
+
+def print_report(name, table, report, failed_only=False):
+    """Print the comparison report of a table."""
+    n_failed = int(np.sum(~report['passed'].values))
+    print("\nEngine '%s', table '%s': %d of %d columns %s" %
+          (name, table, report.shape[0] - n_failed, report.shape[0],
+           'within the tolerances'))
+    if failed_only:
+        report = report.loc[~report['passed'].values]
+        if report.shape[0] == 0:
+            return
+    print('%-24s %12s %12s %10s %10s %8s' % (
+        'column', 'max abs', 'max rel', 'atol', 'rtol', 'failed'))
+    for column, row in report.iterrows():
+        print('%-24s %12.4g %12.4g %10.2g %10.2g %8d  %s' % (
+            column, row['max_abs_diff'], row['max_rel_diff'], row['atol'],
+            row['rtol'], row['n_failed'], 'ok' if row['passed'] else 'FAIL'))
+
+
+def parse_option(text):
+    """Parse a run option 'key=value', with the value in YAML."""
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError("Expected 'key=value': %s" % text)
+    return key.strip(), yaml.safe_load(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='PyChamberFlux: Check the numerical equivalence of ' +
+        'fitting engines against the reference engine.')
+    add_dataset_arguments(parser)
+    # two days with gaps and a time lag to optimize, by default
+    parser.set_defaults(n_days=2, gap_fraction=0.02, timelag=15.)
+    parser.add_argument('--config', dest='config', action='store',
+                        help='config file of a recorded dataset; relative ' +
+                        'paths in it refer to the current directory. ' +
+                        'Default is to generate a synthetic dataset')
+    parser.add_argument('-s', '--date-start', dest='date_start',
+                        action='store',
+                        help='first day to process, for a recorded dataset')
+    parser.add_argument('-e', '--date-end', dest='date_end', action='store',
+                        help='last day to process, for a recorded dataset')
+    parser.add_argument('--engines', dest='engines', action='store',
+                        default=','.join(ENGINES),
+                        help='engines to check, separated by commas ' +
+                        '(default: all): ' + ', '.join(ENGINES))
+    parser.add_argument('--set', dest='options', action='append',
+                        type=parse_option, default=[],
+                        metavar='KEY=VALUE',
+                        help='run option of an extra engine to check, ' +
+                        "named 'custom'; may be repeated")
+    parser.add_argument('--tolerances', dest='tolerances', action='store',
+                        help='YAML file of column name patterns and ' +
+                        'their [atol, rtol], before the declared ones')
+    parser.add_argument('--keep', dest='run_root', action='store',
+                        help='directory to keep the outputs of the runs')
+    parser.add_argument('--failed-only', dest='failed_only',
+                        action='store_true',
+                        help='only list the columns out of tolerance')
+    args = parser.parse_args()
+
+    engines = collections.OrderedDict()
+    for name in args.engines.split(','):
+        if not name:
+            continue
+        if name not in ENGINES:
+            raise RuntimeError('Unknown engine: %s' % name)
+        engines[name] = copy.deepcopy(ENGINES[name])
+    if args.options:
+        engines['custom'] = dict(args.options)
+    tolerances = load_tolerances(args.tolerances)
+
+    data_dir = None
+    if args.config is not None:
+        config_path = os.path.abspath(args.config)
+        workdir = os.getcwd()
+    else:
+        data_dir = tempfile.mkdtemp(prefix='chflux_equiv_data_')
+        dataset = generate_dataset(data_dir, **dataset_kwargs(args))
+        print('Synthetic dataset: %d days, %d windows' %
+              (len(dataset['dates']), dataset['truth'].shape[0]))
+        config_path = dataset['config']
+        workdir = data_dir
+    try:
+        reports = check_equivalence(
+            config_path, engines, workdir=workdir, run_root=args.run_root,
+            date_start=args.date_start, date_end=args.date_end,
+            tolerances=tolerances)
+    finally:
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    n_failed = 0
+    for name, tables in reports.items():
+        for table, report in tables.items():
+            print_report(name, table, report, failed_only=args.failed_only)
+            n_failed += int(np.sum(~report['passed'].values))
+    if n_failed:
+        print('\n%d columns out of tolerance.' % n_failed)
+        return 1
+    print('\nAll engines are equivalent to the reference engine.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,382 @@
+"""
+Timed benchmarks of PyChamberFlux on synthetic chamber data
+
+A synthetic dataset is generated (`benchmarks.synthetic`) and the following
+are timed, each a number of times:
+
+- 'load_biomet', 'load_conc', 'load_flow': loading the data files of all
+  days (`chflux.iotools.load_tabulated_data`)
+- 'expand_schedule': expanding the chamber schedule of each day
+- 'fit_lin', 'fit_rlin', 'fit_nonlin': the fitting kernels, per species fit
+  in all windows (`chflux.fitting.fit_window`, timed by the run timer)
+- 'optimize_timelag': time lag optimization of each window
+- 'flux_calc_day': the full flux calculation of the first day with
+  `flux_calc.py`, in a new process; the stage times of its run report are
+  recorded with it
+
+The results are appended as one JSON line per run to a results file, with
+the dataset parameters, the version of the code (the git commit), and the
+machine, and are compared with the last recorded run of the same dataset.
+
+Examples::
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --chambers 6 --rate 10 --lag 15 \
+        --only fit_nonlin,optimize_timelag --repeat 5
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import os
+import io
+import sys
+import copy
+import glob
+import json
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import contextlib
+import subprocess
+import collections
+import timeit
+
+import numpy as np
+import pandas as pd
+import scipy
+import yaml
+
+from chflux.common import expand_chamber_schedule, optimize_timelag
+from chflux.default_config import default_config
+from chflux.fitting import fit_window
+from chflux.iotools import load_config, load_tabulated_data
+from chflux.store import locate_windows
+from chflux.timing import set_run_timer
+from benchmarks.synthetic import add_dataset_arguments, dataset_kwargs, \
+    generate_dataset, load_truth, truth_windows
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS = os.path.join(REPO_DIR, 'benchmarks', 'results',
+                               'benchmarks.jsonl')
+BENCHMARK_NAMES = ['load_biomet', 'load_conc', 'load_flow',
+                   'expand_schedule', 'fit_lin', 'fit_rlin', 'fit_nonlin',
+                   'optimize_timelag', 'flux_calc_day']
+
+
+def load_run_config(config_path):
+    """Return the default config updated with a user config."""
+    config = copy.deepcopy(default_config)
+    user_config = load_config(config_path)
+    for key in config:
+        if key in user_config:
+            config[key].update(user_config[key])
+    return config
+
+
+def time_repeated(func, repeat):
+    """Return the wall times in seconds of repeated calls of a function."""
+    times = []
+    for __ in range(repeat):
+        t_start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - t_start)
+    return times
+
+
+def summarize(times, n_items, unit):
+    """Summarize the times of a benchmark, also per item (file, window...)."""
+    times = np.asarray(times, dtype=np.float64)
+    return collections.OrderedDict([
+        ('min', float(np.min(times))), ('median', float(np.median(times))),
+        ('repeat', int(times.size)), ('n_items', int(n_items)),
+        ('unit', unit), ('per_item', float(np.min(times)) / max(n_items, 1))])
+
+
+def _quiet(func):
+    """Call a function with its printed messages suppressed."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func()
+
+
+def bench_loaders(config, names, repeat):
+    results = collections.OrderedDict()
+    for data_name in ['biomet', 'conc', 'flow']:
+        if 'load_' + data_name not in names:
+            continue
+        n_files = len(glob.glob(config['data_dir'][data_name + '_data']))
+        times = time_repeated(
+            lambda: _quiet(lambda: load_tabulated_data(data_name, config)),
+            repeat)
+        results['load_' + data_name] = summarize(times, n_files, 'file')
+    return results
+
+
+def bench_schedule(chamber_config, dates, repeat):
+    days = [(pd.Timestamp(d).value,
+             (pd.Timestamp(d) + pd.Timedelta(days=1)).value) for d in dates]
+    year_ref = pd.Timestamp(dates[0]).year
+
+    def _expand():
+        for day_start, day_end in days:
+            expand_chamber_schedule(day_start, day_end, chamber_config,
+                                    year_ref)
+
+    return summarize(time_repeated(_expand, repeat), len(days), 'day')
+
+
+def fit_day_data(config, df_conc):
+    """Return the data shared by the windows; see `fit_window()`."""
+    species_settings = config['species_settings']
+    species_list = species_settings['species_list']
+    return {'t_conc': df_conc['time_ns'].values,
+            'conc_arrays': {spc: df_conc[spc].values
+                            for spc in species_list},
+            'species_list': species_list,
+            'conc_factor': [species_settings[spc]['multiplier']
+                            for spc in species_list],
+            'species_settings': species_settings,
+            'spc_optmz_id': 0, 'n_species_threads': 1}
+
+
+def bench_fitting(day_data, windows, names, repeat):
+    """Time the fitting kernels with the stage times of the run timer."""
+    stage_times = collections.defaultdict(list)
+    n_calls = {}
+    for __ in range(repeat):
+        timer = set_run_timer()
+        for window in windows:
+            fit_window(day_data, window)
+        for name, (seconds, calls) in timer.snapshot()['stages'].items():
+            stage_times[name].append(seconds)
+            n_calls[name] = calls
+    set_run_timer()
+    return collections.OrderedDict(
+        (name, summarize(stage_times[name], n_calls[name], 'fit'))
+        for name in ['fit_lin', 'fit_rlin', 'fit_nonlin']
+        if name in names and name in stage_times)
+
+
+def bench_timelag(day_data, truth, repeat):
+    """Time the time lag optimization of the windows, as in `fit_window()`."""
+    t_conc = day_data['t_conc']
+    conc = day_data['conc_arrays'][day_data['species_list'][0]]
+    segments = []
+    for row in truth.itertuples(index=False):
+        upper = 1.5 * row.timelag + 10.
+        i_start, i_end = locate_windows(
+            t_conc, row.ch_o_b, row.ch_end + int(round(upper * 1e9)),
+            closed='neither')
+        ind = slice(int(i_start), int(i_end))
+        segments.append((
+            (t_conc[ind] - row.ch_start) * 1e-9, conc[ind], row.t_turnover,
+            (row.ch_cls - row.ch_o_b) * 1e-9, (row.ch_o_a - row.ch_cls) * 1e-9,
+            (row.ch_end - row.ch_o_a) * 1e-9, (0.5 * row.timelag, upper),
+            row.timelag))
+
+    def _optimize():
+        for time, conc_seg, t_turnover, dt_ob, dt_cls, dt_oa, bounds, \
+                guess in segments:
+            optimize_timelag(time, conc_seg, t_turnover, dt_ob, dt_cls,
+                             dt_oa, closure_period_only=True, bounds=bounds,
+                             guess=guess)
+
+    return summarize(time_repeated(_optimize, repeat), len(segments),
+                     'window')
+
+
+def bench_flux_calc_day(dataset_dir, date, repeat):
+    """
+    Time the flux calculation of a day with `flux_calc.py` in a new process,
+    and return the stage times of its last run report.
+    """
+    config = load_config(os.path.join(dataset_dir, 'config.yaml'))
+    output_dir = os.path.join(dataset_dir, 'output_bench', '')
+    config['data_dir']['output_dir'] = output_dir
+    config['run_options']['save_run_report'] = True
+    config_path = os.path.join(dataset_dir, 'config_bench.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    command = [sys.executable, os.path.join(REPO_DIR, 'flux_calc.py'),
+               '-c', config_path, '-s', date, '-e', date]
+
+    def _run():
+        shutil.rmtree(output_dir, ignore_errors=True)
+        subprocess.run(command, env=env, cwd=dataset_dir, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    result = summarize(time_repeated(_run, repeat), 1, 'day')
+    report_path = sorted(glob.glob(output_dir + 'run_report_*.json'))[-1]
+    with open(report_path) as f:
+        report = json.load(f)
+    result['stages'] = collections.OrderedDict(
+        (name, stage['seconds']) for name, stage in report['stages'].items())
+    result['counters'] = report['counters']
+    result['peak_rss_mb'] = report['peak_rss_mb']['main']
+    return result
+
+
+def run_benchmarks(dataset, names=None, repeat=3):
+    """
+    Run the benchmarks on a synthetic dataset.
+
+    Parameters
+    ----------
+    dataset : dict
+        The dataset; see `benchmarks.synthetic.generate_dataset()`.
+    names : list of str, optional
+        Benchmarks to run.  Default is all in `BENCHMARK_NAMES`.
+    repeat : int, optional
+        Number of times each benchmark is timed.
+
+    Returns
+    -------
+    results : dict
+        Timing summaries of the benchmarks: the minimum and the median time
+        in seconds, and the minimum time per item (file, day, fit, window).
+    """
+    if names is None:
+        names = BENCHMARK_NAMES
+    dataset_dir = os.path.dirname(dataset['config'])
+    config = load_run_config(dataset['config'])
+    chamber_config = load_config(dataset['chamber_config'])
+    results = collections.OrderedDict()
+
+    results.update(bench_loaders(config, names, repeat))
+    if 'expand_schedule' in names:
+        results['expand_schedule'] = bench_schedule(
+            chamber_config, dataset['dates'], repeat)
+
+    if set(names) & {'fit_lin', 'fit_rlin', 'fit_nonlin',
+                     'optimize_timelag'}:
+        df_conc = _quiet(lambda: load_tabulated_data('conc', config))
+        day_data = fit_day_data(config, df_conc)
+        truth = load_truth(dataset_dir)
+        results.update(bench_fitting(day_data, truth_windows(truth), names,
+                                     repeat))
+        if 'optimize_timelag' in names:
+            results['optimize_timelag'] = bench_timelag(day_data, truth,
+                                                        repeat)
+
+    if 'flux_calc_day' in names:
+        results['flux_calc_day'] = bench_flux_calc_day(
+            dataset_dir, dataset['dates'][0], repeat)
+    return results
+
+
+def git_commit():
+    """Return the commit of the working tree, or `None` if unknown."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine_info():
+    return collections.OrderedDict([
+        ('node', platform.node()), ('machine', platform.machine()),
+        ('processor', platform.processor()), ('cpu_count', os.cpu_count()),
+        ('python', platform.python_version()), ('numpy', np.__version__),
+        ('scipy', scipy.__version__), ('pandas', pd.__version__)])
+
+
+def last_record(results_path, dataset_params):
+    """Return the last recorded run of the same dataset, or `None`."""
+    if not os.path.exists(results_path):
+        return None
+    record = None
+    with open(results_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get('dataset') == dataset_params:
+                record = entry
+    return record
+
+
+def print_results(results, previous=None):
+    """Print the benchmark results, and the ratios to a previous run."""
+    header = '%-18s %12s %12s %14s' % ('benchmark', 'min (s)', 'median (s)',
+                                       'per item (ms)')
+    if previous is not None:
+        header += '  vs. %s' % (previous.get('commit') or previous['date'])
+    print(header)
+    for name, result in results.items():
+        line = '%-18s %12.4f %12.4f %14.4f' % (
+            name, result['min'], result['median'], result['per_item'] * 1e3)
+        if previous is not None and name in previous['results']:
+            line += '  %.2fx' % (
+                result['min'] / previous['results'][name]['min'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='PyChamberFlux: Run benchmarks on synthetic data.')
+    add_dataset_arguments(parser)
+    parser.add_argument('--data-dir', dest='data_dir', action='store',
+                        help='directory of the synthetic dataset; default ' +
+                        'is a temporary directory')
+    parser.add_argument('--only', dest='only', action='store',
+                        help='benchmarks to run, separated by commas: ' +
+                        ', '.join(BENCHMARK_NAMES))
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='number of times to time each benchmark ' +
+                        '(default: 3)')
+    parser.add_argument('-o', '--results', dest='results',
+                        default=DEFAULT_RESULTS,
+                        help='file to append the results to (default: ' +
+                        'benchmarks/results/benchmarks.jsonl)')
+    parser.add_argument('--no-record', dest='record', action='store_false',
+                        help='do not record the results')
+    args = parser.parse_args()
+
+    names = BENCHMARK_NAMES
+    if args.only is not None:
+        names = args.only.split(',')
+        unknown = [name for name in names if name not in BENCHMARK_NAMES]
+        if unknown:
+            raise RuntimeError('Unknown benchmarks: %s' % ', '.join(unknown))
+
+    dataset_params = dataset_kwargs(args)
+    data_dir = args.data_dir
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix='chflux_bench_')
+    try:
+        print('Generating synthetic data in %s...' % data_dir)
+        dataset = generate_dataset(data_dir, **dataset_params)
+        print('%d days, %d windows\n' % (len(dataset['dates']),
+                                         dataset['truth'].shape[0]))
+        results = run_benchmarks(dataset, names=names, repeat=args.repeat)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    previous = last_record(args.results, dataset_params)
+    print_results(results, previous)
+
+    if args.record:
+        record = collections.OrderedDict([
+            ('date', datetime.datetime.now().isoformat()),
+            ('commit', git_commit()), ('machine', machine_info()),
+            ('dataset', dataset_params), ('results', results)])
+        results_dir = os.path.dirname(os.path.abspath(args.results))
+        if not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        print('\nResults recorded to %s' % args.results)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+"""
+Synthetic chamber data for benchmarks
+
+The generator writes daily biomet, concentration, and flow rate data files,
+the matching chamber schedule (`chamber.yaml`), and a user config
+(`config.yaml`) to process them with `flux_calc.py`.  Chambers are sampled
+in turn in a cycle; each chamber slot is laid out as
+
+    ch_start (line switched, open) | closed ... | open | end | next slot
+
+and the analyzer sees the chamber air after a time lag.  The chamber is
+open from the line switch, since the time lag optimization counts the
+times of the chamber actions from 'ch_start'.  In the closure
+period, the concentration rises toward its steady state as in the chamber
+model of the flux calculation (`chflux.common.conc_func`), on top of an
+atmospheric background with instrument drift and noise.  Gaps are made by
+dropping blocks of concentration lines.
+
+The true flux of every window is saved in `truth.csv`, with the window
+times and the chamber properties.
+
+Example::
+
+    python -m benchmarks.synthetic ./synthetic --days 2 --chambers 6 \
+        --rate 10 --lag 15
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import os
+import argparse
+import collections
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from chflux.common import conc_func, expand_chamber_schedule, phys_const
+
+
+# background concentration, unit (also the output unit), typical flux, and
+# axis label of the species; the first `n_species` are used
+SPECIES_PRESETS = collections.OrderedDict([
+    ('co2', {'conc_atm': 400., 'unit': 1e-6, 'flux_scale': 2.,
+             'name': 'CO$_2$'}),
+    ('h2o', {'conc_atm': 15., 'unit': 1e-3, 'flux_scale': 1.,
+             'name': 'H$_2$O'}),
+    ('cos', {'conc_atm': 500., 'unit': 1e-12, 'flux_scale': 10.,
+             'name': 'COS'}),
+    ('ch4', {'conc_atm': 1900., 'unit': 1e-9, 'flux_scale': 2.,
+             'name': 'CH$_4$'}),
+    ('n2o', {'conc_atm': 330., 'unit': 1e-9, 'flux_scale': 0.5,
+             'name': 'N$_2$O'}),
+    ('co', {'conc_atm': 120., 'unit': 1e-9, 'flux_scale': 1.,
+            'name': 'CO'}),
+])
+
+# times of opening, closing, reopening, and the end of a window, as
+# fractions of the chamber slot ('ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end')
+SLOT_FRACTIONS = (0., 0.2, 0.8, 0.9)
+
+SITE_PRESSURE = 96.8e3
+# mean length of the gaps in the concentration data, in seconds
+GAP_LENGTH = 30.
+# date format of the data file names
+FILE_DATE_FORMAT = '%Y%m%d'
+
+
+def chamber_properties(n_chambers, seed=0):
+    """
+    Return random areas, volumes, flow rates, and temperatures of the
+    chambers, as a data table indexed by chamber number.
+    """
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'A_ch': np.round(rng.uniform(0.02, 0.08, n_chambers), 5),
+        'V_ch': np.round(rng.uniform(0.004, 0.016, n_chambers), 6),
+        'flow_lpm': np.round(rng.uniform(1., 2., n_chambers), 3),
+        'T_ch': 20. + np.arange(n_chambers) % 10},
+        index=pd.Index(np.arange(1, n_chambers + 1), name='ch_no'))
+
+
+def synthetic_chamber_config(df_ch, cycle_len, ts_start, ts_end, timelag=0.):
+    """
+    Return a chamber configuration of one schedule, in which the chambers
+    are sampled in turn in a cycle.
+
+    Parameters
+    ----------
+    df_ch : pandas.DataFrame
+        Chamber properties; see `chamber_properties()`.
+    cycle_len : float
+        Length of a sampling cycle of all chambers, in minutes.
+    ts_start, ts_end : pandas.Timestamp
+        Start and end of the schedule.
+    timelag : float, optional
+        Time lag of the sampling line, in seconds.  If positive, the time
+        lag is optimized within [0.5, 1.5] times the time lag plus 10 s.
+
+    Returns
+    -------
+    chamber_config : dict
+        The chamber configuration, as parsed from a chamber description file.
+    """
+    n_ch = df_ch.shape[0]
+    slot = cycle_len / n_ch
+    f_o_b, f_cls, f_o_a, f_end = SLOT_FRACTIONS
+    optimize = bool(timelag > 0.)
+    tlag_min = timelag / 60.
+    schedule = collections.OrderedDict([
+        ('schedule_start', ts_start.strftime('%Y-%m-%d %H:%M:%S')),
+        ('schedule_end', ts_end.strftime('%Y-%m-%d %H:%M:%S')),
+        ('n_ch', n_ch),
+        ('ch_no', [int(i) for i in df_ch.index]),
+        ('A_ch', [float(x) for x in df_ch['A_ch']]),
+        ('A_ch_std', [0.] * n_ch),
+        ('V_ch', [float(x) for x in df_ch['V_ch']]),
+        ('ch_label', ['CH%d' % i for i in df_ch.index]),
+        ('is_leaf_chamber', [False] * n_ch),
+        ('flowmeter_no', [int(i) for i in df_ch.index]),
+        ('TC_no', [int(i) for i in df_ch.index]),
+        ('PAR_no', [int(i) for i in df_ch.index]),
+        ('ch_start', [float(k * slot) for k in range(n_ch)]),
+        ('ch_o_b', [f_o_b * slot] * n_ch),
+        ('ch_cls', [f_cls * slot] * n_ch),
+        ('ch_o_a', [f_o_a * slot] * n_ch),
+        ('ch_end', [f_end * slot] * n_ch),
+        ('ch_atm_a', [f_end * slot] * n_ch),
+        ('optimize_timelag', [optimize] * n_ch),
+        ('timelag_nominal', [tlag_min] * n_ch),
+        ('timelag_upper_limit',
+         [1.5 * tlag_min + 10. / 60. if optimize else 0.] * n_ch),
+        ('timelag_lower_limit', [0.5 * tlag_min] * n_ch),
+        ('unit_of_time', 'min'),
+        ('smpl_cycle_len', float(cycle_len)),
+        ('n_cycle_per_day', int(round(1440. / cycle_len)))])
+    return {'schedule_1': schedule}
+
+
+def true_fluxes(df_chlut, df_ch, species_list, seed=0):
+    """
+    Return the windows of the schedule with their true fluxes, flow rates,
+    and turnover times.
+    """
+    rng = np.random.RandomState(seed + 1)
+    truth = pd.DataFrame({'ch_start': df_chlut['ch_start'].values})
+    for key in ['ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end', 'ch_atm_a']:
+        truth[key] = truth['ch_start'].values + df_chlut[key].values
+    truth['ch_no'] = df_chlut['ch_no'].values.astype(np.int64)
+    truth['ch_label'] = df_chlut['ch_label'].values
+    for key in ['A_ch', 'V_ch', 'flow_lpm', 'T_ch']:
+        truth[key] = df_ch.loc[truth['ch_no'].values, key].values
+    truth['pres'] = SITE_PRESSURE
+    # mass flow rate (mol s^-1) and turnover time (s), as in `flux_calc()`
+    air_molar_conc = SITE_PRESSURE / phys_const['R_gas'] / \
+        (truth['T_ch'].values + phys_const['T_0'])
+    truth['flow'] = truth['flow_lpm'].values * 1e-3 / 60. * air_molar_conc
+    truth['t_turnover'] = truth['V_ch'].values * air_molar_conc / \
+        truth['flow'].values
+
+    # fluxes with a diurnal cycle, and random variations between windows
+    hour = (truth['ch_start'].values // 1000000000 % 86400) / 3600.
+    diurnal = 0.2 + np.sin(2. * np.pi * (hour - 6.) / 24.)
+    for spc in species_list:
+        truth['f' + spc] = SPECIES_PRESETS[spc]['flux_scale'] * diurnal * \
+            rng.uniform(0.5, 1.5, truth.shape[0])
+    return truth
+
+
+def _closure_signal(t_ns, truth, spc, timelag_ns):
+    """Return the concentration rise in the closure periods of the windows."""
+    signal = np.zeros(t_ns.size)
+    i_cls = np.searchsorted(t_ns, truth['ch_cls'].values + timelag_ns)
+    i_o_a = np.searchsorted(t_ns, truth['ch_o_a'].values + timelag_ns)
+    # steady-state concentration rise, in the unit of the species
+    amplitude = truth['f' + spc].values * truth['A_ch'].values / \
+        truth['flow'].values
+    for k in np.flatnonzero(i_o_a > i_cls):
+        ind = slice(i_cls[k], i_o_a[k])
+        t_norm = (t_ns[ind] - truth['ch_cls'].values[k] - timelag_ns) * \
+            1e-9 / truth['t_turnover'].values[k]
+        signal[ind] = conc_func([amplitude[k], 0.], t_norm)
+    return signal
+
+
+def _gap_mask(n, sampling_rate, gap_fraction, rng):
+    """Return a mask of the lines to keep, with blocks of lines dropped."""
+    keep = np.ones(n, dtype=bool)
+    gap_len = max(1, int(GAP_LENGTH * sampling_rate))
+    n_gaps = int(round(gap_fraction * n / gap_len))
+    for i, length in zip(rng.randint(0, n, n_gaps),
+                         rng.randint(1, 2 * gap_len, n_gaps)):
+        keep[i:i + length] = False
+    return keep
+
+
+def generate_dataset(out_dir, start='2017-06-01', n_days=1, n_chambers=4,
+                     cycle_len=60., sampling_rate=1., n_species=3,
+                     noise=1e-3, drift=1e-3, gap_fraction=0., timelag=0.,
+                     biomet_interval=10., seed=0):
+    """
+    Generate a synthetic dataset of chamber measurements.
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory of the dataset.  Data files are written to the subfolders
+        'biomet', 'conc', and 'flow', one file per day.
+    start : str, optional
+        First day of the data.
+    n_days : int, optional
+        Number of days.
+    n_chambers : int, optional
+        Number of chambers sampled in turn.
+    cycle_len : float, optional
+        Length of a sampling cycle of all chambers, in minutes.  Must divide
+        a day.
+    sampling_rate : float, optional
+        Sampling rate of the concentration data, 1 to 10 Hz.
+    n_species : int, optional
+        Number of species, taken in order from `SPECIES_PRESETS`.
+    noise : float, optional
+        Standard deviation of the analyzer noise, relative to the background
+        concentration.
+    drift : float, optional
+        Linear instrument drift per hour, relative to the background
+        concentration.
+    gap_fraction : float, optional
+        Fraction of the concentration lines dropped in gaps.
+    timelag : float, optional
+        Time lag of the sampling line, in seconds.
+    biomet_interval : float, optional
+        Interval of the biomet and the flow rate data, in seconds.
+    seed : int, optional
+        Seed of the random numbers.
+
+    Returns
+    -------
+    dataset : dict
+        - 'config', 'chamber_config': paths of the user config and of the
+          chamber schedule
+        - 'truth': windows with their true fluxes; see `load_truth()`
+        - 'species_list': species in the concentration data
+        - 'dates': days of the data
+    """
+    if not 1. <= sampling_rate <= 10.:
+        raise ValueError('Sampling rate must be between 1 and 10 Hz.')
+    if n_species > len(SPECIES_PRESETS):
+        raise ValueError('At most %d species are supported.' %
+                         len(SPECIES_PRESETS))
+    if (1440. / cycle_len) % 1.:
+        raise ValueError('The sampling cycle length must divide a day.')
+    out_dir = os.path.abspath(out_dir)
+    for subdir in ['biomet', 'conc', 'flow']:
+        if not os.path.exists(os.path.join(out_dir, subdir)):
+            os.makedirs(os.path.join(out_dir, subdir))
+
+    rng = np.random.RandomState(seed)
+    species_list = list(SPECIES_PRESETS)[:n_species]
+    ts_start = pd.Timestamp(start).normalize()
+    ts_end = ts_start + pd.Timedelta(days=n_days)
+    timelag_ns = int(round(timelag * 1e9))
+
+    # chamber schedule and the true fluxes of the windows
+    df_ch = chamber_properties(n_chambers, seed)
+    chamber_config = synthetic_chamber_config(df_ch, cycle_len, ts_start,
+                                              ts_end, timelag)
+    df_chlut = expand_chamber_schedule(ts_start.value, ts_end.value,
+                                       chamber_config, ts_start.year)
+    truth = true_fluxes(df_chlut, df_ch, species_list, seed)
+    truth['timelag'] = timelag
+
+    dates = pd.date_range(ts_start, ts_end, freq='D')[:-1]
+    for ts_day in dates:
+        date_str = ts_day.strftime(FILE_DATE_FORMAT)
+        day_start = ts_day.value
+
+        # concentrations
+        n_conc = int(round(86400. * sampling_rate))
+        t_ns = day_start + np.round(
+            np.arange(n_conc) * 1e9 / sampling_rate).astype(np.int64)
+        hours = (t_ns - ts_start.value) / 3600e9
+        df_conc = pd.DataFrame({'time_sec': t_ns * 1e-9})
+        for spc in species_list:
+            conc_atm = SPECIES_PRESETS[spc]['conc_atm']
+            df_conc[spc] = conc_atm * (
+                1. + drift * hours + noise * rng.standard_normal(n_conc)) + \
+                _closure_signal(t_ns, truth, spc, timelag_ns)
+        df_conc = df_conc[_gap_mask(n_conc, sampling_rate, gap_fraction, rng)]
+        df_conc.to_csv(os.path.join(out_dir, 'conc', 'conc_%s.csv' %
+                                    date_str),
+                       index=False, float_format='%.6f')
+
+        # biomet and flow rate data
+        n_biomet = int(round(86400. / biomet_interval))
+        t_biomet = day_start + np.round(
+            np.arange(n_biomet) * biomet_interval * 1e9).astype(np.int64)
+        hour = (t_biomet - day_start) / 3600e9
+        daylight = np.maximum(np.sin(np.pi * (hour - 6.) / 12.), 0.)
+        df_biomet = pd.DataFrame({'time_sec': t_biomet * 1e-9})
+        df_biomet['pres'] = SITE_PRESSURE
+        df_biomet['T_atm'] = 20. + 5. * daylight
+        df_biomet['RH_atm'] = 60. - 20. * daylight
+        df_flow = pd.DataFrame({'time_sec': t_biomet * 1e-9})
+        for ch_no in df_ch.index:
+            df_biomet['T_ch_%d' % ch_no] = df_ch.loc[ch_no, 'T_ch']
+            df_biomet['PAR_ch_%d' % ch_no] = 1500. * daylight
+            df_flow['flow_ch_%d' % ch_no] = df_ch.loc[ch_no, 'flow_lpm']
+        df_biomet.to_csv(os.path.join(out_dir, 'biomet', 'biomet_%s.csv' %
+                                      date_str),
+                         index=False, float_format='%.6f')
+        df_flow.to_csv(os.path.join(out_dir, 'flow', 'flow_%s.csv' %
+                                    date_str),
+                       index=False, float_format='%.6f')
+
+    # chamber schedule, config, and the true fluxes
+    chamber_path = os.path.join(out_dir, 'chamber.yaml')
+    with open(chamber_path, 'w') as f:
+        yaml.safe_dump({key: dict(value) for key, value in
+                        chamber_config.items()}, f, default_flow_style=None)
+    config = synthetic_config(out_dir, chamber_path, species_list)
+    config_path = os.path.join(out_dir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+    truth.to_csv(os.path.join(out_dir, 'truth.csv'), index=False)
+
+    return {'config': config_path, 'chamber_config': chamber_path,
+            'truth': truth, 'species_list': species_list,
+            'dates': [ts.strftime('%Y-%m-%d') for ts in dates]}
+
+
+def synthetic_config(out_dir, chamber_path, species_list):
+    """Return the user config to process a synthetic dataset."""
+    species_settings = {
+        'species_list': species_list,
+        'species_names': [SPECIES_PRESETS[s]['name'] for s in species_list]}
+    for spc in species_list:
+        unit = SPECIES_PRESETS[spc]['unit']
+        species_settings[spc] = {'unit': unit, 'output_unit': unit,
+                                 'multiplier': 1.,
+                                 'baseline_correction': 'median'}
+    # time in seconds since the Unix epoch
+    time_settings = {'time_sec_start': 1970, 'time_in_UTC': True}
+    return {
+        'run_options': {
+            'chamber_config_filepath': chamber_path,
+            'timelag_method': 'optimized',
+            'timelag_optimization_species': species_list[0]},
+        'data_dir': {
+            'biomet_data': os.path.join(out_dir, 'biomet', '*.csv'),
+            'biomet_data.date_format': FILE_DATE_FORMAT,
+            'conc_data': os.path.join(out_dir, 'conc', '*.csv'),
+            'conc_data.date_format': FILE_DATE_FORMAT,
+            'flow_data': os.path.join(out_dir, 'flow', '*.csv'),
+            'flow_data.date_format': FILE_DATE_FORMAT,
+            'separate_conc_data': True,
+            'separate_flow_data': True,
+            'output_dir': os.path.join(out_dir, 'output', ''),
+            'plot_dir': os.path.join(out_dir, 'plots', '')},
+        'biomet_data_settings': dict(time_settings),
+        'conc_data_settings': dict(time_settings),
+        'flow_data_settings': dict(time_settings, flow_rate_in_STP=False),
+        'site_parameters': {'site_pressure': SITE_PRESSURE, 'time_zone': 0},
+        'species_settings': species_settings}
+
+
+def load_truth(out_dir):
+    """
+    Load the true fluxes of a synthetic dataset.
+
+    Returns
+    -------
+    truth : pandas.DataFrame
+        One row per window: the times of the chamber actions ('ch_start',
+        'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end', 'ch_atm_a', int64 ns), the
+        chamber number and label, the chamber area 'A_ch' (m^2), volume
+        'V_ch' (m^3), flow rate 'flow_lpm' (L min^-1) and 'flow'
+        (mol s^-1), temperature 'T_ch' (C), pressure 'pres' (Pa), turnover
+        time 't_turnover' (s), time lag 'timelag' (s), and the true fluxes
+        'f<species>' in the unit of the species per m^2 per s.
+    """
+    return pd.read_csv(os.path.join(out_dir, 'truth.csv'))
+
+
+def truth_windows(truth, optimize_timelag=False):
+    """
+    Return the windows of a synthetic dataset as inputs of
+    `chflux.fitting.fit_window()`.
+    """
+    windows = []
+    for row in truth.itertuples(index=False):
+        timelag = None
+        if optimize_timelag and row.timelag > 0.:
+            timelag = (row.timelag, 1.5 * row.timelag + 10.,
+                       0.5 * row.timelag)
+        windows.append({
+            'ch_start': row.ch_start, 'ch_o_b': row.ch_o_b,
+            'ch_cls': row.ch_cls, 'ch_o_a': row.ch_o_a,
+            'ch_atm_a': row.ch_atm_a, 'ch_end': row.ch_end,
+            'flow': row.flow, 't_turnover': row.t_turnover,
+            'A_ch': row.A_ch, 'pres': row.pres, 'timelag': timelag,
+            'save_curves': False})
+    return windows
+
+
+def add_dataset_arguments(parser):
+    """Add the options of `generate_dataset()` to a command-line parser."""
+    parser.add_argument('--start', dest='start', default='2017-06-01',
+                        help='first day of the data (default: 2017-06-01)')
+    parser.add_argument('--days', dest='n_days', type=int, default=1,
+                        help='number of days (default: 1)')
+    parser.add_argument('--chambers', dest='n_chambers', type=int,
+                        default=4, help='number of chambers (default: 4)')
+    parser.add_argument('--cycle', dest='cycle_len', type=float,
+                        default=60.,
+                        help='sampling cycle length in minutes (default: 60)')
+    parser.add_argument('--rate', dest='sampling_rate', type=float,
+                        default=1.,
+                        help='concentration sampling rate in Hz, 1 to 10 ' +
+                        '(default: 1)')
+    parser.add_argument('--species', dest='n_species', type=int, default=3,
+                        help='number of species (default: 3)')
+    parser.add_argument('--noise', dest='noise', type=float, default=1e-3,
+                        help='relative analyzer noise (default: 0.001)')
+    parser.add_argument('--drift', dest='drift', type=float, default=1e-3,
+                        help='relative instrument drift per hour ' +
+                        '(default: 0.001)')
+    parser.add_argument('--gaps', dest='gap_fraction', type=float,
+                        default=0.,
+                        help='fraction of concentration lines dropped in ' +
+                        'gaps (default: 0)')
+    parser.add_argument('--lag', dest='timelag', type=float, default=0.,
+                        help='time lag of the sampling line in seconds; ' +
+                        'optimized if positive (default: 0)')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='seed of the random numbers (default: 0)')
+
+
+def dataset_kwargs(args):
+    """Return the arguments of `generate_dataset()` from parsed options."""
+    return {key: getattr(args, key) for key in
+            ['start', 'n_days', 'n_chambers', 'cycle_len', 'sampling_rate',
+             'n_species', 'noise', 'drift', 'gap_fraction', 'timelag',
+             'seed']}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='PyChamberFlux: Generate synthetic chamber data.')
+    parser.add_argument('out_dir', help='directory of the dataset')
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+    dataset = generate_dataset(args.out_dir, **dataset_kwargs(args))
+    print('%d days of data with %d windows written to %s' %
+          (len(dataset['dates']), dataset['truth'].shape[0], args.out_dir))
+    print('Process with: python flux_calc.py -c %s' % dataset['config'])
+    return 0
+
+
+if __name__ == '__main__':
+    main()
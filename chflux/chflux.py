@@ -6,12 +6,12 @@ A package for calculating trace gas fluxes from chamber measurements
 import copy
 import argparse
 import datetime
-import timeit
 import importlib
 import pkg_resources
 
 from chflux.default_config import default_config
 from chflux.io.readers import read_yaml, update_dict
+from chflux.timing import set_run_timer
 
 
 class ChFluxProcess(object):
@@ -42,7 +42,9 @@ class ChFluxProcess(object):
         # The function itself does not manipulate the data. This is intended
         # for keeping the main program on top of all actions.
 
-        t_start = timeit.default_timer()  # start a timer for process time
+        # a timer for process time, and the times of the processing stages
+        timer = set_run_timer()
+        stage_run = timer.start('run')
 
         print('PyChamberFlux\nStarting data processing...')
         self.start_timestamp = datetime.datetime.utcnow()
@@ -55,10 +57,13 @@ class ChFluxProcess(object):
         # @TODO: add sanity check for self.config, if not pass, raise Error
         self.make_savedirs()
         self.save_config()
-        self.calc()
+        with timer.stage('calc'):
+            self.calc()
 
-        t_end = timeit.default_timer()
-        print('Done. Finished in %.2f seconds.' % (t_end - t_start))
+        timer.stop(stage_run)
+        print(timer.summary())
+        print('Done. Finished in %.2f seconds.' %
+              timer.snapshot()['stages']['run'][0])
 
     def set_config(self, echo=True):
         """Set the configuration for the run."""
@@ -101,6 +101,223 @@ def chamber_lookup_table_func(doy, chamber_config):
     return chamber_lookup_table
 
 
+def _time_unit_in_seconds(unit_of_time):
+    """Return the length of the time unit of a chamber schedule in seconds."""
+    if unit_of_time in ['second', 'sec', 's']:
+        return 1.
+    elif unit_of_time in ['minute', 'min', 'm']:
+        return 60.
+    elif unit_of_time in ['hour', 'hr', 'h']:
+        return 3600.
+    else:
+        return 86400.
+
+
+def schedule_time_bounds(schedule, year_ref):
+    """
+    Resolve the start and the end of a chamber schedule to absolute times.
+
+    Parameters
+    ----------
+    schedule : dict
+        A chamber schedule from the chamber configuration.  Its
+        `schedule_start` and `schedule_end` are either timestamps (str or
+        datetime), resolved as they are, or day of year numbers (float),
+        resolved against the reference year.  A day of year number may
+        exceed the length of the year to continue into the following year.
+    year_ref : int
+        The reference year for day of year numbers, unless the schedule
+        sets its own `year_ref`.
+
+    Returns
+    -------
+    sch_start, sch_end : int
+        Start and end of the schedule, in nanoseconds since the epoch.
+
+    """
+    year_ref = schedule.get('year_ref', year_ref)
+    ts_year_ref = pd.Timestamp('%d-01-01' % year_ref)
+    bounds = []
+    for key in ['schedule_start', 'schedule_end']:
+        value = schedule[key]
+        if isinstance(value, (int, float, np.number)):
+            bounds.append(ts_year_ref.value + int(round(value * 86400e9)))
+        else:
+            bounds.append(pd.Timestamp(value).value)
+    return bounds[0], bounds[1]
+
+
+def _uncovered_ranges(lo, hi, covered):
+    """
+    Return the parts of the time range `[lo, hi)` not covered by any of the
+    ranges in `covered`, as a sorted list of `(start, end)` tuples.
+    """
+    ranges = [(lo, hi)]
+    for c_start, c_end in covered:
+        clipped = []
+        for r_start, r_end in ranges:
+            if r_start < c_start:
+                clipped.append((r_start, min(r_end, c_start)))
+            if r_end > c_end:
+                clipped.append((max(r_start, c_end), r_end))
+        ranges = [(r_start, r_end) for r_start, r_end in clipped
+                  if r_start < r_end]
+    return sorted(ranges)
+
+
+def expand_chamber_schedule(t_start, t_end, chamber_config, year_ref):
+    """
+    Expand the chamber schedules into a table of sampling windows.
+
+    Sampling cycles are anchored at `t_start`.  A window belongs to the
+    schedule in effect at its starting time.  Where schedules overlap, the
+    first of them in the chamber configuration is in effect, and the later
+    ones only fill the time not covered by earlier schedules.
+
+    Parameters
+    ----------
+    t_start, t_end : int
+        Start (inclusive) and end (exclusive) of the period to expand, in
+        nanoseconds since the epoch.
+    chamber_config : dict
+        Chamber configuration parsed from the chamber description file.
+    year_ref : int
+        The reference year for schedules defined in day of year numbers.
+
+    Returns
+    -------
+    df_chlut : pandas.DataFrame
+        The chamber lookup table, one row per sampling window, sorted by
+        time.  Columns follow the schedule definitions, in which
+        - 'ch_start' is the absolute starting time in int64 nanoseconds;
+        - 'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end', 'ch_atm_a' are int64
+          nanoseconds after 'ch_start';
+        - 'timelag_nominal', 'timelag_upper_limit', 'timelag_lower_limit'
+          are in seconds.
+
+    """
+    lut_keys = ['ch_no', 'A_ch', 'A_ch_std', 'V_ch', 'ch_label',
+                'is_leaf_chamber', 'flowmeter_no', 'TC_no', 'PAR_no',
+                'ch_start', 'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end',
+                'ch_atm_a', 'optimize_timelag', 'timelag_nominal',
+                'timelag_upper_limit', 'timelag_lower_limit']
+    time_keys = ['ch_start', 'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_end',
+                 'ch_atm_a']
+    timelag_keys = ['timelag_nominal', 'timelag_upper_limit',
+                    'timelag_lower_limit']
+
+    chlut_list = []
+    # time ranges covered by the schedules already expanded
+    covered = []
+    for sch_id in chamber_config:
+        schedule = chamber_config[sch_id]
+        sch_start, sch_end = schedule_time_bounds(schedule, year_ref)
+        lo, hi = max(t_start, sch_start), min(t_end, sch_end)
+        if lo >= hi:
+            continue
+        ranges = _uncovered_ranges(lo, hi, covered)
+        covered.append((lo, hi))
+        if not ranges:
+            warnings.warn('Chamber schedule %s is overridden by earlier ' %
+                          sch_id + 'schedules in the period %s to %s.' %
+                          (pd.Timestamp(lo), pd.Timestamp(hi)),
+                          RuntimeWarning)
+            continue
+
+        unit_sec = _time_unit_in_seconds(schedule['unit_of_time'])
+        df_template = pd.DataFrame()
+        for key in lut_keys:
+            df_template[key] = schedule[key]
+        for key in time_keys:
+            df_template[key] = np.round(
+                df_template[key].values.astype(np.float64) * unit_sec *
+                1e9).astype(np.int64)
+        for key in timelag_keys:
+            df_template[key] = \
+                df_template[key].values.astype(np.float64) * unit_sec
+
+        # repeat the cycle over the period, and keep only the windows that
+        # start in the overlap of the schedule and the period
+        cycle_len = int(round(schedule['smpl_cycle_len'] * unit_sec * 1e9))
+        k_first = (lo - t_start) // cycle_len - 1
+        n_cycle = (hi - t_start) // cycle_len - k_first + 1
+        cycle_starts = t_start + (k_first + np.arange(n_cycle)) * cycle_len
+        df_sch = pd.concat([df_template] * n_cycle, ignore_index=True)
+        df_sch['ch_start'] += np.repeat(cycle_starts, df_template.shape[0])
+        ch_start = df_sch['ch_start'].values
+        in_effect = np.zeros(ch_start.size, dtype=bool)
+        for r_start, r_end in ranges:
+            in_effect |= (ch_start >= r_start) & (ch_start < r_end)
+        chlut_list.append(df_sch[in_effect])
+
+    if not chlut_list:
+        warnings.warn('No valid chamber schedule found in the period ' +
+                      '%s to %s.' % (pd.Timestamp(t_start),
+                                     pd.Timestamp(t_end)), RuntimeWarning)
+        return pd.DataFrame(columns=lut_keys)
+
+    df_chlut = pd.concat(chlut_list, ignore_index=True)
+    df_chlut = df_chlut.sort_values(
+        'ch_start', kind='mergesort').reset_index(drop=True)
+    return df_chlut
+
+
+def max_window_length(chamber_config):
+    """
+    Return the maximum length of the sampling windows in the chamber
+    schedules, in nanoseconds.
+
+    A window spans from 'ch_start' to the later of 'ch_end' and 'ch_atm_a',
+    plus the upper limit of the time lag.  This is how far the data needed by
+    a window may extend past the end of the day in which the window starts.
+
+    Parameters
+    ----------
+    chamber_config : dict
+        Chamber configuration parsed from the chamber description file.
+
+    Returns
+    -------
+    length : int
+        The maximum window length in nanoseconds.
+
+    """
+    length = 0
+    for sch_id in chamber_config:
+        schedule = chamber_config[sch_id]
+        unit_sec = _time_unit_in_seconds(schedule['unit_of_time'])
+        t_end = np.maximum(
+            np.asarray(schedule['ch_end'], dtype=np.float64),
+            np.asarray(schedule['ch_atm_a'], dtype=np.float64)) + \
+            np.maximum(np.asarray(schedule['timelag_upper_limit'],
+                                  dtype=np.float64), 0.)
+        length = max(length, int(np.ceil(np.nanmax(t_end) * unit_sec * 1e9)))
+    return length
+
+
+def window_segment(x, ind):
+    """
+    Extract a window segment from a data column in double precision.
+
+    Loaded data columns may be stored in compact data types (e.g., float32).
+    Only the small window segments are upcast for the calculations.
+
+    Parameters
+    ----------
+    x : array_like
+        A data column.
+    ind : array_like or slice
+        Indices or a slice of the window segment.
+
+    Returns
+    -------
+    seg : numpy.ndarray
+        The window segment as a float64 array.
+
+    """
+    return np.asarray(x[ind], dtype=np.float64)
+
+
 def optimize_timelag(time, conc, t_turnover,
                      dt_open_before, dt_close, dt_open_after,
                      dt_left_margin=0., dt_right_margin=0.,
@@ -46,6 +46,32 @@ def extract_date_substr(flist, date_format='%Y%m%d'):
     return date_substr_list, ts_series
 
 
+def filter_dates(date_series, date_start=None, date_end=None):
+    """
+    Select the dates in an absolute date range.
+
+    Parameters
+    ----------
+    date_series : pandas.DatetimeIndex or list of pandas.Timestamp
+        Dates to select from.
+    date_start, date_end : str or pandas.Timestamp, optional
+        First and last dates of the range, both inclusive. `None` means no
+        limit on that side.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        Boolean mask of the selected dates.
+    """
+    dates = pd.DatetimeIndex(date_series).floor('D')
+    mask = np.ones(len(dates), dtype=bool)
+    if date_start is not None:
+        mask &= dates >= pd.Timestamp(date_start).floor('D')
+    if date_end is not None:
+        mask &= dates <= pd.Timestamp(date_end).floor('D')
+    return mask
+
+
 def parse_datetime(ts_input, year=None):
     """
     Parse datetime and convert to pandas.Timestamp.
@@ -16,6 +16,26 @@ default_config = {
         # the size of computer memory, this should be enabled. Otherwise it
         # may take for ever in reading the data.
 
+        'prefetch_days': 1,
+        # Number of days to load ahead on a background thread while fluxes
+        # are being calculated, only used when 'load_data_by_day' is True.
+        # Each prefetched day is held in memory. Set to 0 to load the days
+        # one after another in the main thread.
+
+        'n_read_threads': 1,
+        # Number of threads to read the data files in parallel. Data files
+        # compressed as '.gz', '.bz2', or '.xz' are found along with the plain
+        # files and decompressed in memory while being read; more threads help
+        # to decompress several files at once.
+
+        'split_file_size': None,
+        # File size in MB above which a plain data file is cut at line breaks
+        # into byte ranges of this size, which are parsed in parallel with
+        # 'n_read_threads' threads. Useful for very large single files (e.g.,
+        # monthly concentration files). Default is not to split the files.
+        # Only for files with no more than one header line. Split files are
+        # read one after another; smaller files are still read in parallel.
+
         'process_recent_period': False,
         # If True, process only recent few days' data. This will be useful for
         # online daily processing. If False, process all available data.
@@ -24,6 +44,49 @@ default_config = {
         # Number of days to trace back when processing recent periods
         # only used when 'process_recent_period' is True; must be int type
 
+        'date_start': None,
+        'date_end': None,
+        # Absolute date range to process, e.g., '2017-12-01' and '2018-02-28'.
+        # Both dates are inclusive and may be in different years; all days are
+        # processed in one run. `None` means no limit on that side. Can be
+        # overridden from the command line with `--start` and `--end`.
+        # Ignored when 'process_recent_period' is True.
+
+        'n_workers': 1,
+        # Number of worker processes to calculate fluxes of different days in
+        # parallel. One pool is created for the whole run. Default is 1 to
+        # process the days serially in the main process.
+
+        'n_fit_workers': 1,
+        # Number of workers to fit the chamber windows of a day in parallel.
+        # Default is 1 to fit the windows one after another. Useful when only
+        # a few days are processed, e.g., with 'process_recent_period'.
+
+        'fit_executor': 'thread',
+        # Pool type for fitting the chamber windows, if 'n_fit_workers' > 1:
+        #   - 'thread' (default): a thread pool sharing the data of the day
+        #   - 'process': a process pool, created once for the whole run; the
+        #     concentration data of each day are written once to shared
+        #     files that the workers map. In the worker processes of
+        #     'n_workers', which cannot start child processes, threads are
+        #     used instead.
+
+        'fit_engine': 'default',
+        # Implementation of the curve fitting of the chamber windows:
+        #   - 'default': the fitting in `chflux.fitting`
+        #   - 'reference': the frozen reference engine (`chflux.reference`),
+        #     fitting the windows and species one after another; slow, and
+        #     only meant for checking other engines with the equivalence
+        #     harness (`python -m benchmarks.equivalence`)
+        # Optimized engines are added with `fitting.register_fit_engine()`.
+
+        'n_species_threads': 1,
+        # Number of threads to fit the species of a chamber window
+        # concurrently. Default is 1 to fit the species one after another.
+        # This reduces the latency of each window, e.g., in streaming runs;
+        # the heavy parts of the fits release the GIL. One thread pool is
+        # shared by all windows.
+
         'timelag_method': 'none',
         # NOT FULLY IMPLEMENTED YET
         # Timelag detection methods: 'none', 'optimized', 'prescribed'
@@ -45,6 +108,16 @@ default_config = {
         'save_fitting_diagnostics': True,
         # If True, save fitting diagnostics to files.
 
+        'output_decimals': 6,
+        # Number of decimal places of the floating point values in the output
+        # files. Day of year variables, chamber descriptors, and p-values are
+        # not rounded off. Default is 6, about the accuracy of single-precision
+        # floating point numbers. Set `None` to write full precision.
+
+        'output_compression': None,
+        # Compression of the output files. `None` (default) for plain CSV
+        # files, or 'gzip' for gzip-compressed files ('.csv.gz').
+
         'save_config': False,
         # If True, save the configuration files in a subfolder 'config' in the
         # output directory.
@@ -53,6 +126,26 @@ default_config = {
         # If True, save the curve fitting plots for every chamber sampling
         # period.
 
+        'n_plot_workers': 1,
+        # Number of processes to render the curve fitting plots, off the flux
+        # calculation. The plot inputs of each chamber window are queued to a
+        # process pool with the non-interactive Agg backend. Set 0 to render
+        # the plots in the processing loop. In the worker processes of
+        # `n_workers` > 1, plots are rendered by the worker itself.
+
+        'max_pending_plots': 64,
+        # Maximum number of fitting plots queued but not rendered yet. The
+        # flux calculation waits when the queue is full, which bounds the
+        # memory held by queued plot inputs.
+
+        'save_fitting_curves': False,
+        # If True, save the inputs of the curve fitting plots of each day to
+        # a binary file ('.npz') in a subfolder 'curves' in the output
+        # directory: the concentration series of the sampling intervals, the
+        # baseline points, and the fitted curves of every chamber sampling
+        # period. Plots of chosen periods are rendered later on demand with
+        # the `chflux_plot.py` program.
+
         'save_daily_plots': False,
         # If True, save daily plots of chamber fluxes.
 
@@ -63,6 +156,22 @@ default_config = {
         # 'presentation', seaborn series, etc.
         # see matplotlib guide on plotting style:
         # <http://matplotlib.org/users/style_sheets.html#style-sheets>
+
+        'save_run_report': False,
+        # If True, save a run report ('run_report_<YYYYmmdd_HHMMSS>.json')
+        # in the output directory: the time spent in each processing stage
+        # (file discovery, parsing, schedule expansion, averaging, time lag
+        # optimization, fitting by method, quality control, output, and
+        # plotting), the numbers of days, chamber windows, samples, and fit
+        # iterations, and the peak memory. A summary of the stage times is
+        # printed at the end of every run.
+
+        'profile_stages': None,
+        # Stages of the run to profile with `cProfile`, e.g., ['fit_nonlin',
+        # 'parsing'], or 'all'. The profiles are saved to a subfolder
+        # 'profile' in the output directory, one `<stage>.prof` file per
+        # stage, and per process for the worker processes. Default is no
+        # profiling.
     },
     'data_dir': {  # Input and output directories, and other related settings
         'biomet_data': './biomet/*.csv',
@@ -78,6 +187,13 @@ default_config = {
         'conc_data.date_format': '%Y%m%d',
         # date format string in the file name (not that in the data table)
 
+        'conc_archive': None,
+        # Directory of a memory-mapped concentration data archive. If given,
+        # concentration data are sliced from the archive by day instead of
+        # being read from the files in `conc_data`. An archive is converted
+        # once from the data files with
+        #     python -m chflux.io.archive -c <config> -d conc <archive_dir>
+
         'flow_data': None,
         # Absolute or relative directory to search for flow rate data files.
 
@@ -97,6 +213,21 @@ default_config = {
         'output_filename_prefix': '',
         # A prefix string to append before timestamp for output datafile names.
 
+        'output_store': None,
+        # Directory of a columnar output store. If given, the flux and the
+        # fitting diagnostics rows of each day are also written to typed
+        # column files partitioned by month and day, and a reprocessed day
+        # replaces its stored rows. Read a season with
+        # `chflux.io.fluxstore.read_output_store()`.
+
+        'output_database': None,
+        # Path to a SQLite flux database file. If given, the flux and the
+        # fitting diagnostics rows of each day are also written to the
+        # tables 'flux' and 'diag' of the database, indexed by time and
+        # chamber number, in one transaction per day. Rows of reprocessed
+        # days replace the stored rows of the same day. Query with
+        # `chflux.io.fluxdb.query_fluxes()`.
+
         'plot_dir': './plots/',
         # Directory for saved plots.
 
@@ -121,6 +252,17 @@ default_config = {
         # Read external data for prescribed timelag values.
     },
     'biomet_data_settings': {  # Settings for reading the biomet data
+        'file_format': None,
+        # Native file format of the data files, parsed without converting
+        # them to plain tables first. If `None` (default), the files are read
+        # as delimited text with the settings below. Supported formats:
+        #   - 'toa5': Campbell Scientific TOA5 datalogger files
+        #   - 'licor': LI-COR trace gas analyzer files (e.g., LI-7810)
+        #   - 'aerodyne': Aerodyne TDLWintel concentration files ('.str')
+        # For a native format, the time variable is parsed by the format, and
+        # only 'names', 'usecols', 'dtype', and 'na_values' below are used.
+        # 'names' renames the columns other than the time columns.
+
         'delimiter': ',',
         # Supported table delimiters:
         #   - singe space: ' '
@@ -151,6 +293,16 @@ default_config = {
         # first 3 columns are (double) floating numbers and the last column is
         # of integer type.
 
+        'dtype_policy': None,
+        # Compact data types for the loaded columns, by column kind.
+        # If `None` (default), keep the data types given by `dtype` or
+        # inferred by `pandas.read_csv()`. For example,
+        #     {'float': 'float32', 'int': 'int32', 'str': 'category'}
+        # stores floating numbers in single precision, which roughly halves
+        # the memory footprint of the loaded data. Time variables are always
+        # kept in full precision, and window segments are cast back to double
+        # precision in the flux calculation.
+
         'na_values': None,
         # Modify this if you need specify the missing values.
         # Default is `None` that uses the default options of
@@ -182,10 +334,30 @@ default_config = {
         # must specify a reference year if the time variable is day of year
         # number
 
+        'duplicates': 'first',
+        # Policy for lines of identical timestamps, e.g., from logger restarts
+        # or overlapping data files. The loaded data are sorted by time if
+        # they are out of order. Allowed values:
+        #   - 'first' (default): keep the first line in the file order
+        #   - 'last': keep the last line
+        #   - 'average': average the floating point columns, ignoring NaNs
+        #   - `None`: keep all lines
+
         'time_in_UTC': True,
         # Default is `True` to treat the time variable in UTC time.
     },
     'conc_data_settings': {  # Settings for reading the concentration data
+        'file_format': None,
+        # Native file format of the data files, parsed without converting
+        # them to plain tables first. If `None` (default), the files are read
+        # as delimited text with the settings below. Supported formats:
+        #   - 'toa5': Campbell Scientific TOA5 datalogger files
+        #   - 'licor': LI-COR trace gas analyzer files (e.g., LI-7810)
+        #   - 'aerodyne': Aerodyne TDLWintel concentration files ('.str')
+        # For a native format, the time variable is parsed by the format, and
+        # only 'names', 'usecols', 'dtype', and 'na_values' below are used.
+        # 'names' renames the columns other than the time columns.
+
         'delimiter': ',',
         # Supported table delimiters:
         #   - singe space: ' '
@@ -216,6 +388,16 @@ default_config = {
         # first 3 columns are (double) floating numbers and the last column is
         # of integer type.
 
+        'dtype_policy': None,
+        # Compact data types for the loaded columns, by column kind.
+        # If `None` (default), keep the data types given by `dtype` or
+        # inferred by `pandas.read_csv()`. For example,
+        #     {'float': 'float32', 'int': 'int32', 'str': 'category'}
+        # stores floating numbers in single precision, which roughly halves
+        # the memory footprint of the loaded data. Time variables are always
+        # kept in full precision, and window segments are cast back to double
+        # precision in the flux calculation.
+
         'na_values': None,
         # Modify this if you need specify the missing values.
 
@@ -245,10 +427,30 @@ default_config = {
         # must specify a reference year if the time variable is day of year
         # number
 
+        'duplicates': 'first',
+        # Policy for lines of identical timestamps, e.g., from logger restarts
+        # or overlapping data files. The loaded data are sorted by time if
+        # they are out of order. Allowed values:
+        #   - 'first' (default): keep the first line in the file order
+        #   - 'last': keep the last line
+        #   - 'average': average the floating point columns, ignoring NaNs
+        #   - `None`: keep all lines
+
         'time_in_UTC': True,
         # Default is `True` to treat the time variable in UTC time.
     },
     'flow_data_settings': {  # Settings for reading the flow rate data
+        'file_format': None,
+        # Native file format of the data files, parsed without converting
+        # them to plain tables first. If `None` (default), the files are read
+        # as delimited text with the settings below. Supported formats:
+        #   - 'toa5': Campbell Scientific TOA5 datalogger files
+        #   - 'licor': LI-COR trace gas analyzer files (e.g., LI-7810)
+        #   - 'aerodyne': Aerodyne TDLWintel concentration files ('.str')
+        # For a native format, the time variable is parsed by the format, and
+        # only 'names', 'usecols', 'dtype', and 'na_values' below are used.
+        # 'names' renames the columns other than the time columns.
+
         'delimiter': ',',
         # Supported table delimiters:
         #   - singe space: ' '
@@ -279,6 +481,16 @@ default_config = {
         # first 3 columns are (double) floating numbers and the last column is
         # of integer type.
 
+        'dtype_policy': None,
+        # Compact data types for the loaded columns, by column kind.
+        # If `None` (default), keep the data types given by `dtype` or
+        # inferred by `pandas.read_csv()`. For example,
+        #     {'float': 'float32', 'int': 'int32', 'str': 'category'}
+        # stores floating numbers in single precision, which roughly halves
+        # the memory footprint of the loaded data. Time variables are always
+        # kept in full precision, and window segments are cast back to double
+        # precision in the flux calculation.
+
         'na_values': None,
         # Modify this if you need specify the missing values.
 
@@ -308,6 +520,15 @@ default_config = {
         # must specify a reference year if the time variable is day of year
         # number
 
+        'duplicates': 'first',
+        # Policy for lines of identical timestamps, e.g., from logger restarts
+        # or overlapping data files. The loaded data are sorted by time if
+        # they are out of order. Allowed values:
+        #   - 'first' (default): keep the first line in the file order
+        #   - 'last': keep the last line
+        #   - 'average': average the floating point columns, ignoring NaNs
+        #   - `None`: keep all lines
+
         'time_in_UTC': True,
         # Default is `True` to treat the time variable in UTC time.
 
@@ -323,6 +544,17 @@ default_config = {
         # correspond to those defined in `ch_label` in the chamber schedule
         # configuration
 
+        'file_format': None,
+        # Native file format of the data files, parsed without converting
+        # them to plain tables first. If `None` (default), the files are read
+        # as delimited text with the settings below. Supported formats:
+        #   - 'toa5': Campbell Scientific TOA5 datalogger files
+        #   - 'licor': LI-COR trace gas analyzer files (e.g., LI-7810)
+        #   - 'aerodyne': Aerodyne TDLWintel concentration files ('.str')
+        # For a native format, the time variable is parsed by the format, and
+        # only 'names', 'usecols', 'dtype', and 'na_values' below are used.
+        # 'names' renames the columns other than the time columns.
+
         'delimiter': ',',
         # Supported table delimiters:
         #   - singe space: ' '
@@ -353,6 +585,16 @@ default_config = {
         # first 3 columns are (double) floating numbers and the last column is
         # of integer type.
 
+        'dtype_policy': None,
+        # Compact data types for the loaded columns, by column kind.
+        # If `None` (default), keep the data types given by `dtype` or
+        # inferred by `pandas.read_csv()`. For example,
+        #     {'float': 'float32', 'int': 'int32', 'str': 'category'}
+        # stores floating numbers in single precision, which roughly halves
+        # the memory footprint of the loaded data. Time variables are always
+        # kept in full precision, and window segments are cast back to double
+        # precision in the flux calculation.
+
         'na_values': None,
         # Modify this if you need specify the missing values.
 
@@ -382,6 +624,15 @@ default_config = {
         # must specify a reference year if the time variable is day of year
         # number
 
+        'duplicates': 'first',
+        # Policy for lines of identical timestamps, e.g., from logger restarts
+        # or overlapping data files. The loaded data are sorted by time if
+        # they are out of order. Allowed values:
+        #   - 'first' (default): keep the first line in the file order
+        #   - 'last': keep the last line
+        #   - 'average': average the floating point columns, ignoring NaNs
+        #   - `None`: keep all lines
+
         'time_in_UTC': True,
         # Default is `True` to treat the time variable in UTC time.
     },
@@ -391,6 +642,17 @@ default_config = {
         # in `ch_label` in the chamber schedule configuration;
         # timelag values must be given in seconds
 
+        'file_format': None,
+        # Native file format of the data files, parsed without converting
+        # them to plain tables first. If `None` (default), the files are read
+        # as delimited text with the settings below. Supported formats:
+        #   - 'toa5': Campbell Scientific TOA5 datalogger files
+        #   - 'licor': LI-COR trace gas analyzer files (e.g., LI-7810)
+        #   - 'aerodyne': Aerodyne TDLWintel concentration files ('.str')
+        # For a native format, the time variable is parsed by the format, and
+        # only 'names', 'usecols', 'dtype', and 'na_values' below are used.
+        # 'names' renames the columns other than the time columns.
+
         'delimiter': ',',
         # Supported table delimiters:
         #   - singe space: ' '
@@ -421,6 +683,16 @@ default_config = {
         # first 3 columns are (double) floating numbers and the last column is
         # of integer type.
 
+        'dtype_policy': None,
+        # Compact data types for the loaded columns, by column kind.
+        # If `None` (default), keep the data types given by `dtype` or
+        # inferred by `pandas.read_csv()`. For example,
+        #     {'float': 'float32', 'int': 'int32', 'str': 'category'}
+        # stores floating numbers in single precision, which roughly halves
+        # the memory footprint of the loaded data. Time variables are always
+        # kept in full precision, and window segments are cast back to double
+        # precision in the flux calculation.
+
         'na_values': None,
         # Modify this if you need specify the missing values.
 
@@ -450,6 +722,12 @@ default_config = {
         # must specify a reference year if the time variable is day of year
         # number
 
+        'duplicates': None,
+        # Policy for lines of identical timestamps; see 'biomet_data_settings'.
+        # Default is `None` to keep all lines, since timelag data of different
+        # chambers may share the same timestamps. The loaded data are sorted
+        # by time if they are out of order.
+
         'time_in_UTC': True,
         # Default is `True` to treat the time variable in UTC time.
     },
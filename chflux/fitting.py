@@ -0,0 +1,623 @@
+"""
+Per-window fitting of chamber concentrations
+
+The fitting stage of a day is split into pure tasks, one per chamber window.
+A task optimizes the time lag, averages the concentrations in the sampling
+intervals, and fits the closure period of each species with the linear,
+robust linear, and nonlinear methods.  Tasks only read the time-ordered
+concentration data of the day, so that they can run on a thread or process
+pool, and their results are gathered in window order.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import atexit
+import collections
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+from scipy import stats, optimize
+
+from chflux import reference
+from chflux.common import window_segment, optimize_timelag, conc_func, \
+    resid_conc_func, IQR_func, dew_temp
+from chflux.sharedmem import SharedTables, attach_table
+from chflux.store import locate_windows
+from chflux.timing import get_run_timer
+
+
+def fit_species(day_data, window, spc_id, intervals, dt_lmargin=0):
+    """
+    Fit the closure period of a species in a chamber window.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings of the day; see `fit_window()`.
+    window : dict
+        The chamber window; see `fit_window()`.
+    spc_id : int
+        Index of the species in `day_data['species_list']`.
+    intervals : dict
+        Row slices of the sampling intervals 'chb', 'chc', and 'cha'.
+    dt_lmargin : int, optional
+        Left margin of the closure period, in nanoseconds.
+
+    Returns
+    -------
+    result : dict
+        - 'flux', 'diag': output values by column name
+        - 't_bl': times of the baseline end points, in seconds
+        - 'conc_bl': concentrations of the baseline end points, or `None`
+          if the species has no valid observations
+        - 'fitted': fitted concentrations by method ('lin', 'rlin',
+          'nonlin'), or `None`
+    """
+    timer = get_run_timer()
+    t_conc = day_data['t_conc']
+    spc = day_data['species_list'][spc_id]
+    conc = day_data['conc_arrays'][spc]
+    conc_factor = day_data['conc_factor'][spc_id]
+    spc_settings = day_data['species_settings'][spc]
+    ch_start = window['ch_start']
+    flow = window['flow']
+    A_ch = window['A_ch']
+    t_turnover = window['t_turnover']
+    ind_chb, ind_chc, ind_cha = \
+        intervals['chb'], intervals['chc'], intervals['cha']
+    result = {'flux': collections.OrderedDict(),
+              'diag': collections.OrderedDict(),
+              'conc_bl': None, 'fitted': None}
+    flux = result['flux']
+    diag = result['diag']
+
+    # closure period times in seconds after 'ch_start'
+    chc_time = (t_conc[ind_chc] - ch_start) * 1e-9
+    # conc of the current species
+    chc_conc = window_segment(conc, ind_chc) * conc_factor
+
+    # calculate slopes and intercepts of the zero-flux baselines
+    # baseline end points changed from mean to medians (05/05/2016)
+    # - `t_bl_chb`: median or mean time for chamber open period
+    #   (before closure), in seconds
+    # - `t_bl_cha`: median or mean time for chamber open period
+    #   (after closure), in seconds
+    if spc_settings['baseline_correction'] in ['mean', 'average']:
+        bl_calc_func = np.nanmean
+    else:
+        bl_calc_func = np.nanmedian
+
+    t_bl_chb = bl_calc_func(t_conc[ind_chb] - ch_start) * 1e-9
+    t_bl_cha = bl_calc_func(t_conc[ind_cha] - ch_start) * 1e-9
+    conc_bl_chb = bl_calc_func(window_segment(conc, ind_chb)) * conc_factor
+
+    if spc_settings['baseline_correction'] in ['none', 'None', None]:
+        conc_bl_cha = conc_bl_chb
+    else:
+        conc_bl_cha = bl_calc_func(window_segment(conc, ind_cha)) * \
+            conc_factor
+        # if `conc_bl_cha` is not a finite value, set it equal to
+        # `conc_bl_chb`. Thus `k_bl` will be zero.
+        if np.isnan(conc_bl_cha):
+            conc_bl_cha = conc_bl_chb
+            t_bl_cha = chc_time[-1]
+    result['t_bl'] = (t_bl_chb, t_bl_cha)
+
+    k_bl = (conc_bl_cha - conc_bl_chb) / (t_bl_cha - t_bl_chb)
+    b_bl = conc_bl_chb - k_bl * t_bl_chb
+
+    # subtract the baseline to correct for instrument drift
+    # (assuming linear drift)
+    conc_bl = k_bl * chc_time + b_bl
+
+    # linear fit
+    # -------------------------------------------------------------------------
+    # see the supp. info of Sun et al. (2016) JGR-Biogeosci.
+    y_fit = (chc_conc - conc_bl) * flow / A_ch
+    x_fit = np.exp(- (chc_time - chc_time[0] + dt_lmargin * 1e-9) /
+                   t_turnover)
+
+    # boolean index array for finite concentration values
+    ind_conc_fit = np.isfinite(y_fit)
+
+    # number of valid observations
+    flux['n_obs_%s' % spc] = np.sum(ind_conc_fit)
+
+    # if no finite concentration values, skip the fitting
+    if np.sum(ind_conc_fit) == 0:
+        return result
+
+    with timer.stage('fit_lin'):
+        slope, intercept, r_value, p_value, se_slope = \
+            stats.linregress(x_fit[ind_conc_fit], y_fit[ind_conc_fit])
+
+    # fitted conc values
+    conc_fitted_lin = (slope * x_fit + intercept) * A_ch / flow + conc_bl
+
+    # save the linear fit results and diagnostics
+    flux['f%s_lin' % spc] = -slope
+    flux['se_f%s_lin' % spc] = np.abs(se_slope)
+    diag['k_lin_' + spc] = slope
+    diag['b_lin_' + spc] = intercept
+    diag['r_lin_' + spc] = r_value
+    diag['p_lin_' + spc] = p_value
+    diag['rmse_lin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_lin - chc_conc) ** 2))
+    diag['delta_lin_' + spc] = conc_fitted_lin[-1] - conc_bl[-1] - \
+        (conc_fitted_lin[0] - conc_bl[0])
+
+    # robust linear fit
+    # @TODO: replace Theil-Sen estimator with RANSAC method??
+    # the original algorithm of Theil-Sen method uses numpy.sort()
+    # and is thus time consuming
+    # -------------------------------------------------------------------------
+    with timer.stage('fit_rlin'):
+        medslope, medintercept, lo_slope, up_slope = \
+            stats.theilslopes(y_fit, x_fit, alpha=0.95)
+
+    # fitted conc values
+    conc_fitted_rlin = (medslope * x_fit + medintercept) * A_ch / flow + \
+        conc_bl
+
+    # save the robust linear fit results and diagnostics
+    flux['f%s_rlin' % spc] = -medslope
+    flux['se_f%s_rlin' % spc] = np.abs(up_slope - lo_slope) / 3.92
+    # note: 0.95 C.I. is equivalent to +/- 1.96 sigma
+    diag['k_rlin_' + spc] = medslope
+    diag['b_rlin_' + spc] = medintercept
+    diag['k_lolim_rlin_' + spc] = lo_slope
+    diag['k_uplim_rlin_' + spc] = up_slope
+    diag['rmse_rlin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_rlin - chc_conc) ** 2))
+    diag['delta_rlin_' + spc] = conc_fitted_rlin[-1] - conc_bl[-1] - \
+        (conc_fitted_rlin[0] - conc_bl[0])
+
+    # nonlinear fit
+    # -------------------------------------------------------------------------
+    t_fit = (chc_time - chc_time[0] + dt_lmargin * 1e-9) / t_turnover
+    params_nonlin_guess = [-flux['f%s_lin' % spc], 0.]
+    with timer.stage('fit_nonlin'):
+        params_nonlin = optimize.least_squares(
+            resid_conc_func, params_nonlin_guess,
+            bounds=([-np.inf, -10. / t_turnover],
+                    [np.inf, 10. / t_turnover]),
+            loss='soft_l1', f_scale=0.5,
+            args=(t_fit[ind_conc_fit], y_fit[ind_conc_fit]))
+    timer.count('fit_iterations', params_nonlin.nfev)
+
+    # fitted conc values
+    conc_fitted_nonlin = conc_func(params_nonlin.x, t_fit) * A_ch / flow + \
+        conc_bl
+
+    # standard errors of estimated parameters
+    # `J^T J` is a Gauss-Newton approximation of the negative of
+    # the Hessian of the cost function.
+    # The variance-covariance matrix of the parameter estimates is
+    # the inverse of the negative of Hessian matrix evaluated
+    # at the parameter estimates.
+    neg_hess = np.dot(params_nonlin.jac.T, params_nonlin.jac)
+    try:
+        inv_neg_hess = np.linalg.inv(neg_hess)
+    except np.linalg.LinAlgError:
+        try:
+            inv_neg_hess = np.linalg.pinv(neg_hess)
+        except np.linalg.LinAlgError:
+            inv_neg_hess = neg_hess * np.nan
+    # variance-covariance matrix of parameter estimates
+    MSE = np.nansum(params_nonlin.fun ** 2) / (t_fit.size - 2)
+    pcov = inv_neg_hess * MSE
+    # save the nonlinear fit results and diagnostics
+    flux['f%s_nonlin' % spc] = params_nonlin.x[0]
+    flux['se_f%s_nonlin' % spc] = np.sqrt(pcov[0, 0])
+    diag['p0_nonlin_' + spc] = params_nonlin.x[0]
+    diag['p1_nonlin_' + spc] = params_nonlin.x[1]
+    diag['se_p0_nonlin_' + spc] = np.sqrt(pcov[0, 0])
+    diag['se_p1_nonlin_' + spc] = np.sqrt(pcov[1, 1])
+    diag['rmse_nonlin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_nonlin - chc_conc) ** 2))
+    diag['delta_nonlin_' + spc] = conc_fitted_nonlin[-1] - conc_bl[-1] - \
+        (conc_fitted_nonlin[0] - conc_bl[0])
+
+    # baseline end points changed from mean to medians
+    result['conc_bl'] = (conc_bl_chb, conc_bl_cha)
+    result['fitted'] = {'lin': conc_fitted_lin, 'rlin': conc_fitted_rlin,
+                        'nonlin': conc_fitted_nonlin}
+    return result
+
+
+def fit_window(day_data, window):
+    """
+    Calculate the concentrations and fluxes of a chamber window.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings shared by the windows of a day.
+        - 't_conc': sorted times of the concentration data, int64 ns
+        - 'conc_arrays': concentration columns in time order, by species
+        - 'species_list': list of species
+        - 'conc_factor': unit conversion factors of the species
+        - 'species_settings': species settings in the config
+        - 'spc_optmz_id': index of the species for time lag optimization
+        - 'n_species_threads': optional, number of threads to fit the
+          species concurrently; default is 1
+    window : dict
+        The chamber window.
+        - 'ch_start', 'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_atm_a', 'ch_end':
+          times of the chamber actions, int64 ns
+        - 'flow': flow rate, mol s^-1
+        - 't_turnover': turnover time of the chamber headspace, s
+        - 'A_ch': chamber area, m^2
+        - 'pres': ambient pressure, Pa
+        - 'timelag': nominal value, upper and lower limits of the time lag
+          in seconds if it is to be optimized; `None` for no time lag
+        - 'save_curves': if True, return the fitted curves
+
+    Returns
+    -------
+    result : dict
+        - 'flux', 'diag': output values by column name, for the flux and
+          the fitting diagnostics tables
+        - 'timelag_ns': the time lag, int64 ns
+        - 'intervals': row slices of the sampling intervals in the
+          concentration data, 'full', 'atmb', 'chb', 'chc', 'cha', 'atma'
+        - 'curves': fitted curves and baselines for plotting, or `None`
+    """
+    t_conc = day_data['t_conc']
+    conc_arrays = day_data['conc_arrays']
+    species_list = day_data['species_list']
+    conc_factor = day_data['conc_factor']
+    ch_start = window['ch_start']
+    ch_o_b = window['ch_o_b']
+    ch_cls = window['ch_cls']
+    ch_o_a = window['ch_o_a']
+    ch_atm_a = window['ch_atm_a']
+    ch_end = window['ch_end']
+    result = {'flux': collections.OrderedDict(),
+              'diag': collections.OrderedDict(), 'curves': None}
+    flux = result['flux']
+
+    # timelag optimization
+    # --------------------
+    # (still in active development & testing)
+    # margins and time lag in int64 nanoseconds
+    dt_lmargin = 0
+    dt_rmargin = 0
+    if window['timelag'] is not None:
+        timelag_nominal, timelag_upper_limit, timelag_lower_limit = \
+            window['timelag']
+        spc_optmz_id = day_data['spc_optmz_id']
+
+        i_optmz_start, i_optmz_end = locate_windows(
+            t_conc, ch_o_b, ch_end + int(round(timelag_upper_limit * 1e9)),
+            closed='neither')
+        ind_optmz = slice(int(i_optmz_start), int(i_optmz_end))
+        time_optmz = (t_conc[ind_optmz] - ch_start) * 1e-9
+        conc_optmz = window_segment(
+            conc_arrays[species_list[spc_optmz_id]], ind_optmz) * \
+            conc_factor[spc_optmz_id]
+
+        dt_open_before = (ch_cls - ch_o_b) * 1e-9
+        dt_close = (ch_o_a - ch_cls) * 1e-9
+        dt_open_after = (ch_end - ch_o_a) * 1e-9
+
+        with get_run_timer().stage('timelag'):
+            timelag_optmz_results = optimize_timelag(
+                time_optmz, conc_optmz, window['t_turnover'],
+                dt_open_before, dt_close, dt_open_after,
+                closure_period_only=True,
+                bounds=(timelag_lower_limit, timelag_upper_limit),
+                guess=timelag_nominal)
+        timelag_ns = int(round(timelag_optmz_results[0] * 1e9))
+
+        # the nominal time lag, the optimized time lag, and the status code
+        flux['t_lag_nom'] = timelag_nominal
+        flux['t_lag_optmz'] = timelag_optmz_results[0]
+        flux['status_tlag'] = timelag_optmz_results[1]
+    else:
+        timelag_ns = 0
+    result['timelag_ns'] = timelag_ns
+
+    # extracting indices for sampling intervals
+    # - 'full': the whole sampling interval, only used for plotting
+    # - 'atmb': atmospheric line, before closure
+    # - 'chb': chamber open, before closure
+    # - 'chc': chamber closure
+    # - 'cha': chamber open, after closure
+    # - 'atma': atmospheric line, after closure
+    # note: after the sampling line is switched, regardless of the
+    # time lag, the analyzer will sample the next line.
+    # This is the reason that a time lag is not added to the terminal time.
+    # All intervals are located in one call, as row slices of the time
+    # ordered concentration data; bounds are excluded.
+    lag_start = timelag_ns + dt_lmargin
+    lag_end = timelag_ns - dt_rmargin
+    i_conc_start, i_conc_end = locate_windows(
+        t_conc,
+        [ch_o_b, ch_start + lag_start, ch_o_b + lag_start,
+         ch_cls + lag_start, ch_o_a + lag_start, ch_atm_a + lag_start],
+        [ch_end + timelag_ns, ch_o_b + lag_end, ch_cls + lag_end,
+         ch_o_a + lag_end, ch_atm_a, ch_end],
+        closed='neither')
+    intervals = collections.OrderedDict(
+        (seg_name, slice(int(i), int(j))) for seg_name, i, j in
+        zip(['full', 'atmb', 'chb', 'chc', 'cha', 'atma'],
+            i_conc_start, i_conc_end))
+    result['intervals'] = intervals
+    # concentration samples of the window
+    get_run_timer().count('samples',
+                          intervals['full'].stop - intervals['full'].start)
+
+    n_ind_chc = intervals['chc'].stop - intervals['chc'].start
+
+    # check if there are enough data points for calculating fluxes
+    # note that concentration data might not be sampled every second.
+    # if this is the case, the criterion needs to be modified
+    if n_ind_chc >= 2. * 60. and window['flow'] > 0.:
+        # needs at least 2 min good data in the closure period to proceed
+        # flow rate value needs to be positive, otherwise the chamber
+        # cannot be flushed by the inlet air
+        flag_calc_flux = 1
+    else:
+        flag_calc_flux = 0
+
+    # average the concentrations
+    # --------------------------
+    for spc_id, spc in enumerate(species_list):
+        for seg_name in ['atmb', 'chb', 'cha', 'atma']:
+            conc_seg = window_segment(conc_arrays[spc], intervals[seg_name])
+            flux['%s_%s' % (spc, seg_name)] = \
+                np.nanmean(conc_seg) * conc_factor[spc_id]
+            flux['sd_%s_%s' % (spc, seg_name)] = \
+                np.nanstd(conc_seg, ddof=1) * conc_factor[spc_id]
+
+        flux['%s_chc_iqr' % spc] = \
+            IQR_func(window_segment(conc_arrays[spc], intervals['chc'])) * \
+            conc_factor[spc_id]
+
+    # if the species 'h2o' exist, calculate chamber dew temperature
+    if 'h2o' in species_list:
+        h2o_frac = flux['h2o_chb'] * \
+            day_data['species_settings']['h2o']['output_unit']
+        if flux['h2o_chb'] > 0 and h2o_frac <= 1.:
+            flux['T_dew_ch'] = dew_temp(h2o_frac * window['pres'])
+
+    # calculate fluxes
+    # ----------------
+    if not flag_calc_flux:
+        return result
+
+    # fitted conc and baselines, for plotting purposes
+    # only need two points to draw a line for each species
+    # - `conc_bl_pts`: before and after closure points that mark the
+    #    zero-flux baseline
+    # - `t_bl_pts`: times for the two points that mark the baseline
+    # - `conc_fitted`: fitted concentrations during closure by method, from
+    #    the simple linear ('lin'), the robust linear ('rlin'), and the
+    #    nonlinear ('nonlin') methods
+    n_species = len(species_list)
+    conc_bl_pts = np.zeros((n_species, 2))
+    t_bl_pts = np.zeros(2)
+    conc_fitted = {method: np.zeros((n_species, n_ind_chc))
+                   for method in ['lin', 'rlin', 'nonlin']}
+
+    # species are fitted on a shared thread pool, if enabled; the species
+    # segments are views on the same concentration data, and the results are
+    # returned by each task and accumulated in species order
+    fit_func = functools.partial(fit_species, day_data, window,
+                                 intervals=intervals, dt_lmargin=dt_lmargin)
+    n_threads = day_data.get('n_species_threads', 1)
+    if n_threads is not None and n_threads > 1 and n_species > 1:
+        spc_results = list(
+            get_species_pool(n_threads).map(fit_func, range(n_species)))
+    else:
+        spc_results = [fit_func(spc_id) for spc_id in range(n_species)]
+
+    for spc_id, spc_result in enumerate(spc_results):
+        flux.update(spc_result['flux'])
+        result['diag'].update(spc_result['diag'])
+        if spc_result['conc_bl'] is not None:
+            conc_bl_pts[spc_id, :] = spc_result['conc_bl']
+            for method in conc_fitted:
+                conc_fitted[method][spc_id, :] = \
+                    spc_result['fitted'][method]
+        # the baseline times of the last species are used for plotting
+        t_bl_pts[:] = spc_result['t_bl']
+
+    if window['save_curves']:
+        result['curves'] = {'t_bl_pts': t_bl_pts, 'conc_bl_pts': conc_bl_pts,
+                            'conc_fitted': conc_fitted}
+    return result
+
+
+# thread pool shared by the species fits of all windows in this process
+_species_pool = {'pid': None, 'n_threads': 0, 'pool': None}
+_species_pool_lock = threading.Lock()
+
+
+def get_species_pool(n_threads):
+    """
+    Return the thread pool for fitting species concurrently.  The pool is
+    created once per process and reused by all windows and days; NumPy and
+    SciPy release the GIL in the heavy parts of the fits.
+    """
+    with _species_pool_lock:
+        # threads do not survive a fork; a child process starts its own pool
+        if _species_pool['pid'] != os.getpid() or \
+                _species_pool['n_threads'] != n_threads:
+            if _species_pool['pid'] == os.getpid():
+                _species_pool['pool'].shutdown(wait=False)
+            _species_pool['pool'] = \
+                concurrent.futures.ThreadPoolExecutor(n_threads)
+            _species_pool['pid'] = os.getpid()
+            _species_pool['n_threads'] = n_threads
+        return _species_pool['pool']
+
+
+# process pool fitting the windows of all days in this process
+_fit_pool = {'pid': None, 'n_workers': 0, 'pool': None}
+_fit_pool_lock = threading.Lock()
+
+
+def get_fit_pool(n_workers):
+    """
+    Return the process pool for fitting windows.  The pool is created once
+    per process and reused by all days; call `close_fit_pool()` when done,
+    which is also done at exit.
+    """
+    with _fit_pool_lock:
+        # a forked child process does not own the pool of its parent
+        if _fit_pool['pid'] != os.getpid() or \
+                _fit_pool['n_workers'] != n_workers:
+            if _fit_pool['pid'] == os.getpid():
+                _fit_pool['pool'].terminate()
+                _fit_pool['pool'].join()
+            _fit_pool['pool'] = multiprocessing.Pool(n_workers)
+            _fit_pool['pid'] = os.getpid()
+            _fit_pool['n_workers'] = n_workers
+        return _fit_pool['pool']
+
+
+def close_fit_pool():
+    """Stop the process pool for fitting windows of this process."""
+    with _fit_pool_lock:
+        if _fit_pool['pid'] == os.getpid():
+            pool = _fit_pool['pool']
+            _fit_pool.update({'pid': None, 'n_workers': 0, 'pool': None})
+            pool.close()
+            pool.join()
+
+
+atexit.register(close_fit_pool)
+
+
+# data of the day mapped from shared files in a pool worker, and the key of
+# the day; keys are unique to the days fitted by a process
+_day_data = {'key': None}
+_day_keys = itertools.count()
+
+
+def _fit_window_in_process(task):
+    day_key, day_table, day_settings, window = task
+    if _day_data['key'] != day_key:
+        # the concentration data of a new day, mapped without copying
+        table = attach_table(day_table)
+        _day_data.clear()
+        _day_data.update(day_settings)
+        _day_data['t_conc'] = table['time_ns']
+        _day_data['conc_arrays'] = {spc: table[spc]
+                                    for spc in day_settings['species_list']}
+        _day_data['key'] = day_key
+    # the stage times of the worker are merged into the calling process
+    return fit_window(_day_data, window), \
+        get_run_timer().snapshot(reset=True)
+
+
+def _fit_windows_in_pool(day_data, windows, n_workers):
+    """Fit the windows of a day on the process pool of this process."""
+    species_list = day_data['species_list']
+    day_settings = {key: value for key, value in day_data.items()
+                    if key not in ['t_conc', 'conc_arrays']}
+    conc_table = collections.OrderedDict(
+        [('time_ns', day_data['t_conc'])] +
+        [(spc, day_data['conc_arrays'][spc]) for spc in species_list])
+    pool = get_fit_pool(n_workers)
+    # the concentration data of the day are written once to shared files;
+    # the tasks only carry the small descriptor
+    with SharedTables() as shared:
+        day_table = shared.share(conc_table)
+        day_key = (os.getpid(), next(_day_keys))
+        tasks = [(day_key, day_table, day_settings, window)
+                 for window in windows]
+        # `map` keeps the window order and re-raises errors
+        results = pool.map(
+            _fit_window_in_process, tasks,
+            chunksize=max(1, len(windows) // (4 * n_workers)))
+    timer = get_run_timer()
+    for i, (result, snapshot) in enumerate(results):
+        timer.merge(snapshot)
+        results[i] = result
+    return results
+
+
+def fit_windows(day_data, windows, n_workers=1, executor='thread'):
+    """
+    Fit the chamber windows of a day, optionally in parallel.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings shared by the windows; see `fit_window()`.
+    windows : list of dict
+        The chamber windows; see `fit_window()`.
+    n_workers : int, optional
+        Number of workers.  Default is 1 to fit the windows in order in the
+        calling thread.
+    executor : str, optional
+        - 'thread' (default): a thread pool sharing the data of the day
+        - 'process': a process pool, created once and reused by all days
+          (see `get_fit_pool()`); the concentration data of the day are
+          written once to shared files and mapped by the workers.  In a
+          daemonic worker process, which cannot start child processes, a
+          thread pool is used instead.
+
+    Returns
+    -------
+    results : list of dict
+        Results of the windows in window order; see `fit_window()`.
+    """
+    if n_workers is None or n_workers <= 1 or len(windows) < 2:
+        return [fit_window(day_data, window) for window in windows]
+
+    if executor == 'process' and multiprocessing.current_process().daemon:
+        executor = 'thread'
+
+    if executor == 'thread':
+        with concurrent.futures.ThreadPoolExecutor(n_workers) as pool:
+            return list(pool.map(functools.partial(fit_window, day_data),
+                                 windows))
+    elif executor == 'process':
+        return _fit_windows_in_pool(day_data, windows, n_workers)
+    else:
+        raise RuntimeError("Allowed values of `executor` are " +
+                           "'thread', 'process'.")
+
+
+# fitting engines by name, each a function with the signature and the
+# results of `fit_windows()`
+# - 'default': `fit_windows()`
+# - 'reference': the frozen reference engine, `chflux.reference`
+_fit_engines = collections.OrderedDict([
+    ('default', fit_windows), ('reference', reference.fit_windows)])
+
+
+def register_fit_engine(name, func):
+    """
+    Register a fitting engine, e.g., an optimized implementation of
+    `fit_windows()` to be checked against the reference engine.
+
+    Parameters
+    ----------
+    name : str
+        Name of the engine, the value of the option `fit_engine`.
+    func : callable
+        The engine, with the signature and the results of `fit_windows()`.
+    """
+    if name == 'reference':
+        raise RuntimeError('The reference engine cannot be replaced.')
+    _fit_engines[name] = func
+
+
+def get_fit_engine(name):
+    """Return a fitting engine by name; see `register_fit_engine()`."""
+    if name is None:
+        name = 'default'
+    if name not in _fit_engines:
+        raise RuntimeError('Allowed values of `fit_engine` are ' +
+                           ', '.join("'%s'" % k for k in _fit_engines) + '.')
+    return _fit_engines[name]
@@ -0,0 +1,374 @@
+"""
+PyChamberFlux I/O module for memory-mapped columnar data archives.
+
+An archive is a directory that holds one flat binary file per column and a
+small YAML file describing the columns.  All columns share the same row
+order, sorted by the time column `time_ns` (int64, nanoseconds since the
+epoch).  Columns are opened with `numpy.memmap`, so that slicing an archive by
+a time range returns views on the files and no data are copied into memory.
+
+Layout of an archive directory::
+
+    archive.yaml    metadata: number of rows and column data types
+    time_ns.bin     int64 timestamps in nanoseconds since the epoch
+    <column>.bin    one file per data column
+"""
+import argparse
+import collections
+import os
+
+import yaml
+import numpy as np
+import pandas as pd
+
+from chflux.default_config import default_config
+from chflux.io.parsers import duplicate_groups, reduce_duplicates, \
+    apply_dtype_policy, parse_timestamp, sort_time_index
+from chflux.io.readers import read_yaml, update_dict, search_data_files, \
+    data_read_options, read_data_file, split_file_size
+
+
+ARCHIVE_META_FILE = 'archive.yaml'
+TIME_COLUMN = 'time_ns'
+
+
+def _to_ns(ts):
+    """Convert a timestamp-like value to int64 nanoseconds since the epoch."""
+    if isinstance(ts, (int, np.integer)):
+        return int(ts)
+    return pd.Timestamp(ts).value
+
+
+def _column_path(archive_dir, name):
+    return os.path.join(archive_dir, name + '.bin')
+
+
+def _write_meta(archive_dir, n_rows, columns):
+    """Write the archive metadata.  `columns` is a list of (name, dtype)."""
+    meta = {'n_rows': int(n_rows),
+            'columns': [[name, np.dtype(dt).str] for name, dt in columns]}
+    with open(os.path.join(archive_dir, ARCHIVE_META_FILE), 'w') as f:
+        yaml.safe_dump(meta, f, default_flow_style=False)
+
+
+class MemmapArchive(object):
+    """
+    A time-sorted columnar archive opened with `numpy.memmap`.
+
+    Parameters
+    ----------
+    archive_dir : str
+        Directory of the archive.
+    mode : str, optional
+        File mode passed to `numpy.memmap`; default is read-only ('r').
+    """
+
+    def __init__(self, archive_dir, mode='r'):
+        self.archive_dir = archive_dir
+        self.mode = mode
+        meta = read_yaml(os.path.join(archive_dir, ARCHIVE_META_FILE))
+        if not meta:
+            raise RuntimeError('Cannot read the archive metadata in %s.' %
+                               archive_dir)
+        self.n_rows = meta['n_rows']
+        self.dtypes = collections.OrderedDict(
+            (name, np.dtype(dt)) for name, dt in meta['columns'])
+        self._memmaps = {}
+
+    @property
+    def columns(self):
+        """Names of the data columns, excluding the time column."""
+        return [name for name in self.dtypes if name != TIME_COLUMN]
+
+    def __contains__(self, name):
+        return name in self.dtypes
+
+    def __getitem__(self, name):
+        """Return a column as a read-only memory-mapped array."""
+        if name not in self._memmaps:
+            if name not in self.dtypes:
+                raise KeyError(name)
+            if self.n_rows == 0:
+                # `numpy.memmap` cannot map an empty file
+                self._memmaps[name] = np.empty(0, dtype=self.dtypes[name])
+            else:
+                self._memmaps[name] = np.memmap(
+                    _column_path(self.archive_dir, name),
+                    dtype=self.dtypes[name], mode=self.mode,
+                    shape=(self.n_rows,))
+        return self._memmaps[name]
+
+    @property
+    def time_ns(self):
+        """The time column, in int64 nanoseconds since the epoch."""
+        return self[TIME_COLUMN]
+
+    def time_range(self):
+        """Return the first and the last timestamps in the archive."""
+        if self.n_rows == 0:
+            return None, None
+        return (pd.Timestamp(int(self.time_ns[0])),
+                pd.Timestamp(int(self.time_ns[-1])))
+
+    def locate(self, t_start, t_end):
+        """
+        Return the row range `[i_start, i_end)` of `t_start <= t < t_end`.
+
+        The search is a binary search on the sorted time column and touches
+        only a few pages of the file.
+        """
+        time_ns = self.time_ns
+        i_start = np.searchsorted(time_ns, _to_ns(t_start), side='left')
+        i_end = np.searchsorted(time_ns, _to_ns(t_end), side='left')
+        return int(i_start), int(i_end)
+
+    def slice(self, t_start, t_end, columns=None):
+        """
+        Slice the archive by a time range with zero copies.
+
+        Parameters
+        ----------
+        t_start, t_end : pandas.Timestamp, str, or int
+            Start (inclusive) and end (exclusive) of the time range.  An
+            integer is taken as nanoseconds since the epoch.
+        columns : list of str, optional
+            Columns to return.  Default is to return all columns.
+
+        Returns
+        -------
+        segment : collections.OrderedDict
+            A mapping of column names to array views on the archive files.
+            The time column is always included as `time_ns`.
+        """
+        i_start, i_end = self.locate(t_start, t_end)
+        if columns is None:
+            columns = self.columns
+        segment = collections.OrderedDict()
+        segment[TIME_COLUMN] = self.time_ns[i_start:i_end]
+        for name in columns:
+            segment[name] = self[name][i_start:i_end]
+        return segment
+
+
+def open_archive(archive_dir):
+    """Open a memory-mapped archive in read-only mode."""
+    return MemmapArchive(archive_dir, mode='r')
+
+
+def append_to_archive(df, archive_dir, columns=None, dtype=None):
+    """
+    Append a data table to an archive.  Create the archive if not existing.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data table.  Must contain a parsed `timestamp` column.
+    archive_dir : str
+        Directory of the archive.
+    columns : list of str, optional
+        Numeric columns to store.  Default is all numeric columns in `df`.
+        Ignored when appending to an existing archive, whose columns are
+        fixed at creation.
+    dtype : str or dict, optional
+        Storage data type for all columns (str) or for each column (dict).
+        Default is to keep the data types of `df`.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows in the archive after appending.
+    """
+    meta_path = os.path.join(archive_dir, ARCHIVE_META_FILE)
+    if os.path.exists(meta_path):
+        archive = MemmapArchive(archive_dir)
+        n_rows = archive.n_rows
+        col_dtypes = list(archive.dtypes.items())
+    else:
+        if not os.path.exists(archive_dir):
+            os.makedirs(archive_dir)
+        n_rows = 0
+        if columns is None:
+            # other time variables are redundant with `time_ns`
+            columns = [s for s in df.columns.values
+                       if s not in [TIME_COLUMN, 'time_doy', 'time_sec'] and
+                       np.issubdtype(df[s].dtype, np.number)]
+        col_dtypes = [(TIME_COLUMN, np.dtype('int64'))]
+        for name in columns:
+            if isinstance(dtype, dict):
+                dt = dtype.get(name, df[name].dtype)
+            elif dtype is not None:
+                dt = dtype
+            else:
+                dt = df[name].dtype
+            col_dtypes.append((name, np.dtype(dt)))
+
+    if df.shape[0] > 0:
+        time_ns = df['timestamp'].values.astype(
+            'datetime64[ns]').view('int64')
+        for name, dt in col_dtypes:
+            if name == TIME_COLUMN:
+                values = time_ns
+            elif name in df.columns:
+                values = df[name].values
+            else:
+                # keep rows aligned if a column is missing from this table
+                values = np.full(df.shape[0], np.nan)
+            with open(_column_path(archive_dir, name), 'ab') as f:
+                f.write(np.ascontiguousarray(values, dtype=dt).tobytes())
+
+    n_rows += df.shape[0]
+    _write_meta(archive_dir, n_rows, col_dtypes)
+    return n_rows
+
+
+def sort_archive(archive_dir, duplicates=None):
+    """
+    Sort an archive by time in place, if it is not sorted yet.  Columns are
+    permuted one at a time to limit memory use.
+
+    Parameters
+    ----------
+    archive_dir : str
+        Directory of the archive.
+    duplicates : str, optional
+        Policy for rows of identical timestamps: 'first', 'last', or
+        'average' (see `chflux.io.parsers.reduce_duplicates()`).  The column
+        files are truncated to the unique timestamps.  Default is `None` to
+        keep all rows.
+
+    Returns
+    -------
+    n_unsorted : int
+        Number of rows moved by sorting.
+    n_duplicates : int
+        Number of rows with a duplicated timestamp.
+    """
+    archive = MemmapArchive(archive_dir, mode='r+')
+    time_ns = archive.time_ns
+    n_unsorted = 0
+    if time_ns.size > 1 and not np.all(time_ns[1:] >= time_ns[:-1]):
+        # a stable sort keeps the file order for identical timestamps
+        order = np.argsort(time_ns, kind='mergesort')
+        n_unsorted = int(np.count_nonzero(order != np.arange(order.size)))
+        for name in archive.dtypes:
+            column = archive[name]
+            column[:] = column[order]
+            column.flush()
+        time_ns = archive.time_ns
+
+    n_duplicates = int(np.count_nonzero(time_ns[1:] == time_ns[:-1]))
+    if n_duplicates == 0 or duplicates is None:
+        return n_unsorted, n_duplicates
+
+    i_first, i_last = duplicate_groups(np.asarray(time_ns))
+    n_rows = i_first.size
+    for name in list(archive.dtypes):
+        column = archive[name]
+        column[:n_rows] = reduce_duplicates(column, i_first, i_last,
+                                            duplicates=duplicates)
+        column.flush()
+    col_dtypes = list(archive.dtypes.items())
+    del archive, column, time_ns
+    for name, dt in col_dtypes:
+        with open(_column_path(archive_dir, name), 'r+b') as f:
+            f.truncate(n_rows * dt.itemsize)
+    _write_meta(archive_dir, n_rows, col_dtypes)
+    return n_unsorted, n_duplicates
+
+
+def convert_to_archive(data_name, config, archive_dir, columns=None,
+                       dtype=None):
+    """
+    Convert tabulated data files specified in the config to an archive.
+
+    Files are read and appended one at a time, so that the conversion does
+    not need to hold the whole dataset in memory.  The archive is sorted by
+    time at the end if the files are not in time order, and duplicated
+    timestamps across files are reduced by the `duplicates` policy in the
+    data settings.
+
+    Parameters
+    ----------
+    data_name : str
+        Data name, e.g., 'conc' or 'biomet'.
+    config : dict
+        Configuration dictionary parsed from the YAML config file.
+    archive_dir : str
+        Directory of the output archive.  Must not exist already.
+    columns : list of str, optional
+        Numeric columns to store.  Default is all numeric columns.
+    dtype : str or dict, optional
+        Storage data type; see `append_to_archive()`.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows in the archive.
+    """
+    if os.path.exists(os.path.join(archive_dir, ARCHIVE_META_FILE)):
+        raise RuntimeError('Archive already exists in %s.' % archive_dir)
+
+    data_flist = search_data_files(config['data_dir'][data_name + '_data'])
+    data_settings = config[data_name + '_data_settings']
+    read_csv_options = data_read_options(data_settings)
+    n_rows = 0
+    for entry in data_flist:
+        # each file is parsed directly; sorting and duplicates across files
+        # are handled by `sort_archive()` at the end
+        df = apply_dtype_policy(
+            read_data_file(entry, read_csv_options,
+                           split_size=split_file_size(config),
+                           n_threads=config['run_options']['n_read_threads'],
+                           file_format=data_settings['file_format']),
+            data_settings['dtype_policy'])
+        df = parse_timestamp(df, data_settings)
+        if 'timestamp' not in df.columns.values:
+            print('Skipped %s: no time variable found.' % entry)
+            continue
+        # rows of invalid timestamps are dropped
+        df, _, _, n_invalid = sort_time_index(df, duplicates=None)
+        if n_invalid:
+            print('%d lines with invalid timestamps dropped from %s.' %
+                  (n_invalid, entry))
+        print(entry)
+        n_rows = append_to_archive(df, archive_dir, columns=columns,
+                                   dtype=dtype)
+
+    duplicates = data_settings['duplicates']
+    n_unsorted, n_duplicates = sort_archive(archive_dir, duplicates)
+    if n_unsorted:
+        print('%d lines of the archive sorted by time.' % n_unsorted)
+    if n_duplicates and duplicates is not None:
+        n_rows -= n_duplicates
+        print('%d lines of duplicated timestamps reduced (policy: %s).' %
+              (n_duplicates, duplicates))
+    print('%d lines of %s data archived to %s' %
+          (n_rows, data_name, archive_dir))
+    return n_rows
+
+
+def main(args=None):
+    """Command line tool to convert data files to a memory-mapped archive."""
+    parser = argparse.ArgumentParser(
+        description='PyChamberFlux: convert tabulated data files to a ' +
+        'memory-mapped archive.')
+    parser.add_argument('-c', '--config', dest='config', action='store',
+                        help='set the configuration file for the data')
+    parser.add_argument('-d', '--data', dest='data_name', action='store',
+                        default='conc',
+                        help="data name, e.g., 'conc' (default) or 'biomet'")
+    parser.add_argument('-t', '--dtype', dest='dtype', action='store',
+                        default=None,
+                        help="storage data type, e.g., 'float32'")
+    parser.add_argument('archive_dir', help='directory of the output archive')
+    args = parser.parse_args(args)
+
+    config = default_config
+    if args.config is not None:
+        config = update_dict(config, read_yaml(args.config))
+    convert_to_archive(args.data_name, config, args.archive_dir,
+                       dtype=args.dtype)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+PyChamberFlux I/O module for the SQLite flux database.
+
+The flux database is a single SQLite file holding the flux and the fitting
+diagnostics rows of all processed days, for tools that query fluxes by
+chamber and time range.  Each table has the output columns of `flux_calc`
+plus two key columns:
+
+- `time_ns`: chamber measurement time (UTC) in int64 nanoseconds since the
+  epoch, indexed together with `ch_no`;
+- `run_date`: the processed day as an integer `YYYYMMDD`, indexed.
+
+All rows of a day are written in one transaction.  The rows of a
+reprocessed day first delete the stored rows of that day, so that the
+database never holds duplicated or stale windows.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import collections
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+# key columns added to the output tables
+DB_KEYS = ['time_ns', 'run_date']
+# seconds to wait for the database lock held by another worker
+DB_TIMEOUT = 600.
+
+
+def _sql_type(dtype):
+    """Return the SQLite column type of a NumPy data type."""
+    if dtype.kind in 'biu':
+        return 'INTEGER'
+    elif dtype.kind == 'f':
+        return 'REAL'
+    else:
+        return 'TEXT'
+
+
+def _quote(name):
+    return '"%s"' % str(name).replace('"', '""')
+
+
+def connect(db_path):
+    """Open a connection to the flux database, creating the file if needed."""
+    conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _table_columns(conn, table):
+    """Return an ordered list of `(name, type)` of a table, or `[]`."""
+    return [(row[1], row[2]) for row in
+            conn.execute('PRAGMA table_info(%s)' % _quote(table))]
+
+
+def _prepare_table(conn, table, df):
+    """Create a table and its indexes, or add new columns of the data."""
+    columns = _table_columns(conn, table)
+    if not len(columns):
+        col_defs = ['time_ns INTEGER NOT NULL', 'run_date INTEGER NOT NULL']
+        col_defs += ['%s %s' % (_quote(name), _sql_type(df[name].dtype))
+                     for name in df.columns.values if name not in DB_KEYS]
+        conn.execute('CREATE TABLE %s (%s)' %
+                     (_quote(table), ', '.join(col_defs)))
+        conn.execute('CREATE UNIQUE INDEX %s ON %s (time_ns, ch_no)' %
+                     (_quote('ix_%s_time_ch' % table), _quote(table)))
+        conn.execute('CREATE INDEX %s ON %s (ch_no, time_ns)' %
+                     (_quote('ix_%s_ch_time' % table), _quote(table)))
+        conn.execute('CREATE INDEX %s ON %s (run_date)' %
+                     (_quote('ix_%s_run_date' % table), _quote(table)))
+        return
+
+    # e.g., a species added to the config after the database was created
+    names = [c[0] for c in columns]
+    for name in df.columns.values:
+        if name not in names:
+            conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                _quote(table), _quote(name), _sql_type(df[name].dtype)))
+
+
+def _insert_rows(conn, table, df, time_ns, run_date):
+    """Insert rows of a data table, replacing rows with the same keys."""
+    names = ['time_ns', 'run_date'] + \
+        [name for name in df.columns.values if name not in DB_KEYS]
+    # column-wise conversion to Python scalars; NaN is stored as NULL
+    values = [np.asarray(time_ns, dtype=np.int64).tolist(),
+              [run_date] * df.shape[0]]
+    for name in names[2:]:
+        col = df[name].values
+        if col.dtype.kind == 'f':
+            col = np.where(np.isnan(col), None, col.astype(object))
+        values.append(col.tolist())
+    conn.executemany(
+        'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+            _quote(table), ', '.join(_quote(s) for s in names),
+            ', '.join(['?'] * len(names))),
+        zip(*values))
+
+
+def write_day(db_path, ts_start, time_ns, df_flux, df_diag=None):
+    """
+    Write the output rows of a processed day to the flux database, in one
+    transaction.  Stored rows of the same day are replaced.
+
+    Parameters
+    ----------
+    db_path : str
+        Path to the database file.
+    ts_start : pandas.Timestamp
+        Start of the processed day.
+    time_ns : array_like
+        Chamber measurement times (UTC) of the rows, in int64 nanoseconds.
+    df_flux : pandas.DataFrame
+        Flux rows of the day.
+    df_diag : pandas.DataFrame, optional
+        Fitting diagnostics rows of the day, in the same order.
+
+    Return
+    ------
+    n_rows : int
+        Number of flux rows written.
+    """
+    run_date = int(pd.Timestamp(ts_start).strftime('%Y%m%d'))
+    tables = [('flux', df_flux)]
+    if df_diag is not None:
+        tables.append(('diag', df_diag))
+
+    conn = connect(db_path)
+    try:
+        with conn:  # commits, or rolls back on errors
+            for table, df in tables:
+                _prepare_table(conn, table, df)
+                conn.execute('DELETE FROM %s WHERE run_date = ?' %
+                             _quote(table), (run_date,))
+                _insert_rows(conn, table, df, time_ns, run_date)
+    finally:
+        conn.close()
+
+    return df_flux.shape[0]
+
+
+def query_fluxes(db_path, table='flux', ch_no=None, start=None, end=None,
+                 columns=None, as_arrays=False):
+    """
+    Query rows from the flux database by chamber and time range.
+
+    Parameters
+    ----------
+    db_path : str
+        Path to the database file.
+    table : str, optional
+        Table name, 'flux' (default) or 'diag'.
+    ch_no : int or list of int, optional
+        Chamber number(s) to select.  Default is all chambers.
+    start, end : str or pandas.Timestamp, optional
+        Time range `[start, end)` in UTC.  Default is all rows.
+    columns : list of str, optional
+        Columns to return, e.g., `['fco2_nonlin', 'se_fco2_nonlin']`.  The
+        columns `timestamp` and `ch_no` are always returned.  Default is all
+        columns.
+    as_arrays : bool, optional
+        If `True`, return a dict of NumPy arrays instead of a data table.
+
+    Return
+    ------
+    result : pandas.DataFrame or dict
+        Rows in the order of time and chamber number, with a `timestamp`
+        column in front.  Missing values are NaN.
+    """
+    conn = connect(db_path)
+    try:
+        types = collections.OrderedDict(_table_columns(conn, table))
+        if not len(types):
+            raise KeyError('Table %s not found in %s.' % (table, db_path))
+        if columns is None:
+            columns = [s for s in types if s not in DB_KEYS]
+        else:
+            columns = ['ch_no'] + [s for s in columns if s != 'ch_no']
+        for name in columns:
+            if name not in types:
+                raise KeyError('Column %s not found in table %s.' %
+                               (name, table))
+
+        conditions = []
+        params = []
+        if ch_no is not None:
+            ch_no = np.atleast_1d(ch_no).tolist()
+            conditions.append('ch_no IN (%s)' % ', '.join(['?'] * len(ch_no)))
+            params += ch_no
+        if start is not None:
+            conditions.append('time_ns >= ?')
+            params.append(pd.Timestamp(start).value)
+        if end is not None:
+            conditions.append('time_ns < ?')
+            params.append(pd.Timestamp(end).value)
+        sql = 'SELECT time_ns, %s FROM %s' % (
+            ', '.join(_quote(s) for s in columns), _quote(table))
+        if len(conditions):
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY time_ns, ch_no'
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    result = collections.OrderedDict()
+    result['timestamp'] = pd.to_datetime(
+        np.array([row[0] for row in rows], dtype=np.int64))
+    for k, name in enumerate(columns):
+        col = [row[k + 1] for row in rows]
+        if types[name] == 'REAL':
+            col = np.array(col, dtype=np.float64)  # NULL to NaN
+        elif types[name] == 'INTEGER':
+            try:
+                col = np.array(col, dtype=np.int64)
+            except TypeError:  # NULL in an integer column
+                col = np.array(col, dtype=np.float64)
+        else:
+            col = np.array(col, dtype=object)
+        result[name] = col
+
+    if as_arrays:
+        result['timestamp'] = result['timestamp'].values
+        return result
+    return pd.DataFrame(result, columns=list(result.keys()))
@@ -0,0 +1,227 @@
+"""
+PyChamberFlux I/O module for the columnar output store.
+
+The output store keeps the flux and the fitting diagnostics tables of all
+processed days in typed column files, so that a season of fluxes is read as
+a few column arrays without parsing text.  Each table is partitioned by the
+month of the processed day, and each month holds one partition per day; a
+partition is a directory with one `.npy` file per column and a small YAML
+file of the column order.  Rows of a day are sorted by `doy_utc`, and a
+reprocessed day replaces all the stored rows of that day, so that writing a
+day neither rewrites its month nor depends on matching row keys.
+
+Layout of a store directory::
+
+    flux/<YYYYMM>/<YYYYMMDD>/partition.yaml    number of rows and columns
+    flux/<YYYYMM>/<YYYYMMDD>/<column>.npy      one file per column
+    diag/<YYYYMM>/<YYYYMMDD>/...               the same for diagnostics
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import os
+import shutil
+
+import yaml
+import numpy as np
+import pandas as pd
+
+from chflux.io.readers import read_yaml
+
+
+PARTITION_META_FILE = 'partition.yaml'
+# row keys of the output tables
+OUTPUT_KEYS = ['doy_utc', 'ch_no']
+
+
+def _day_dir(store_dir, table, ts):
+    ts = pd.Timestamp(ts)
+    return os.path.join(store_dir, table, partition_name(ts),
+                        ts.strftime('%Y%m%d'))
+
+
+def partition_name(ts):
+    """Return the partition name of a day, e.g., '201304'."""
+    return pd.Timestamp(ts).strftime('%Y%m')
+
+
+def list_days(store_dir, table, partition):
+    """Return the sorted names of the days in a partition, e.g., '20130401'."""
+    part_dir = os.path.join(store_dir, table, partition)
+    if not os.path.isdir(part_dir):
+        return []
+    # partitions being written are skipped
+    return sorted(
+        name for name in os.listdir(part_dir)
+        if not name.endswith('.tmp') and
+        os.path.exists(os.path.join(part_dir, name, PARTITION_META_FILE)))
+
+
+def list_partitions(store_dir, table):
+    """Return the sorted partition names of a table in the store."""
+    table_dir = os.path.join(store_dir, table)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(name for name in os.listdir(table_dir)
+                  if list_days(store_dir, table, name))
+
+
+def _read_day(day_dir, columns=None):
+    """Read the rows of a day partition, or `None` if it does not exist."""
+    meta = read_yaml(os.path.join(day_dir, PARTITION_META_FILE))
+    if not meta:
+        return None
+    if columns is None:
+        columns = meta['columns']
+    data = {}
+    for name in columns:
+        if name in meta['columns']:
+            data[name] = np.load(os.path.join(day_dir, name + '.npy'),
+                                 mmap_mode='r')
+        else:
+            data[name] = np.full(meta['n_rows'], np.nan)
+    return pd.DataFrame(data, columns=columns)
+
+
+def read_partition(store_dir, table, partition, columns=None):
+    """
+    Read a partition of a table in the store.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the store.
+    table : str
+        Table name, 'flux' or 'diag'.
+    partition : str
+        Partition name, e.g., '201304'.
+    columns : list of str, optional
+        Columns to read.  Default is all columns of the first day.  Columns
+        missing from a day are filled with NaN.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The rows of the days in the partition, in day order, or `None` if the
+        partition does not exist.
+    """
+    frames = []
+    for day in list_days(store_dir, table, partition):
+        df = _read_day(os.path.join(store_dir, table, partition, day),
+                       columns)
+        if df is None:
+            continue
+        if columns is None:
+            columns = list(df.columns.values)
+        frames.append(df)
+    if not len(frames):
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+
+def _write_partition(df, part_dir):
+    """Write a data table to a partition directory, replacing it."""
+    tmp_dir = part_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name in df.columns.values:
+        values = df[name].values
+        if values.dtype.kind == 'O':
+            # typed columns only; strings are stored in fixed width
+            values = values.astype(str)
+        np.save(os.path.join(tmp_dir, name + '.npy'), values,
+                allow_pickle=False)
+    meta = {'n_rows': int(df.shape[0]),
+            'columns': [str(name) for name in df.columns.values]}
+    with open(os.path.join(tmp_dir, PARTITION_META_FILE), 'w') as f:
+        yaml.safe_dump(meta, f, default_flow_style=False)
+    if os.path.exists(part_dir):
+        shutil.rmtree(part_dir)
+    os.rename(tmp_dir, part_dir)
+
+
+def replace_day(store_dir, table, df, ts_start):
+    """
+    Write the rows of a processed day to a table in the store.  Stored rows
+    of the same day are replaced.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the store.
+    table : str
+        Table name, 'flux' or 'diag'.
+    df : pandas.DataFrame
+        Output rows of the day, with the key columns `doy_utc` and `ch_no`.
+    ts_start : pandas.Timestamp
+        Start of the processed day, which selects the partition.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows written.
+    """
+    day_dir = _day_dir(store_dir, table, ts_start)
+    # days of the same month may be written in parallel by several workers
+    os.makedirs(os.path.dirname(day_dir), exist_ok=True)
+    df = df.sort_values('doy_utc', kind='mergesort')
+    _write_partition(df.reset_index(drop=True), day_dir)
+    return df.shape[0]
+
+
+def read_output_store(store_dir, table='flux', columns=None, start=None,
+                      end=None):
+    """
+    Read a table from the output store as one data table.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the store.
+    table : str, optional
+        Table name, 'flux' (default) or 'diag'.
+    columns : list of str, optional
+        Columns to read, e.g., `['ch_no', 'fco2_nonlin']`.  The key columns
+        are always included.  Default is all columns.
+    start, end : str or pandas.Timestamp, optional
+        Time range `[start, end)` of the rows to read.  Default is all rows.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The rows in time order, with a `timestamp` column of the chamber
+        measurement times (UTC) in front.  `None` if no rows are found.
+    """
+    if columns is not None:
+        columns = [s for s in OUTPUT_KEYS if s not in columns] + \
+            list(columns)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    frames = []
+    for partition in list_partitions(store_dir, table):
+        month_start = pd.Timestamp(partition[:4] + '-' + partition[4:])
+        if start is not None and \
+                month_start + pd.offsets.MonthBegin(1) <= start:
+            continue
+        if end is not None and month_start >= end:
+            continue
+        df = read_partition(store_dir, table, partition, columns)
+        # day of year values refer to the year of the partition; round off
+        # the floating point error of day fractions
+        timestamp = (pd.Timestamp('%d-01-01' % month_start.year) +
+                     pd.to_timedelta(df['doy_utc'].values, unit='D')).round(
+                         'us')
+        mask = np.ones(df.shape[0], dtype=bool)
+        if start is not None:
+            mask &= timestamp >= start
+        if end is not None:
+            mask &= timestamp < end
+        df = df.loc[mask].copy()
+        df.insert(0, 'timestamp', timestamp[mask])
+        frames.append(df)
+
+    if not len(frames):
+        return None
+    return pd.concat(frames, ignore_index=True)
@@ -1,6 +1,14 @@
 """PyChamberFlux I/O module containing a collection of data parsers."""
+import bz2
+import gzip
+import lzma
+import warnings
+
+import numpy as np
 import pandas as pd
 
+from chflux.timing import timed
+
 
 # A collection of parsers for timestamps stored in multiple columns.
 # Supports only the ISO 8601 format (year-month-day).
@@ -20,5 +28,411 @@ timestamp_parsers = {
 }
 
 
-def parse_timestamp():
-    pass
+def _open_text(filepath, compression=None, encoding='utf-8'):
+    """Open a possibly compressed data file in text mode."""
+    if compression == 'gzip':
+        return gzip.open(filepath, 'rt', encoding=encoding)
+    elif compression == 'bz2':
+        return bz2.open(filepath, 'rt', encoding=encoding)
+    elif compression == 'xz':
+        return lzma.open(filepath, 'rt', encoding=encoding)
+    return open(filepath, 'r', encoding=encoding)
+
+
+def _format_read_options(read_csv_options, **kwargs):
+    """
+    Keep the user options that apply to a native file format, and override
+    the options fixed by the format.
+    """
+    options = {key: read_csv_options[key] for key in
+               ['usecols', 'dtype', 'na_values', 'encoding']
+               if key in read_csv_options}
+    options['engine'] = 'c'
+    options.update(kwargs)
+    return options
+
+
+def _finish_format_parse(df, timestamp, time_columns, names=None):
+    """
+    Replace the original time columns of a table with the parsed `timestamp`
+    variable.  User-defined column `names`, if given, replace the names of
+    the remaining columns in order.
+    """
+    df = df.drop(columns=[c for c in time_columns if c in df.columns])
+    if names is not None:
+        df.columns = names
+    if timestamp is not None:
+        df['timestamp'] = timestamp.values
+    return df
+
+
+def parse_toa5(filepath, read_csv_options, compression=None):
+    """
+    Parse a Campbell Scientific TOA5 datalogger file.
+
+    A TOA5 file has four header lines: file information, column names,
+    units, and processing types.  Strings and timestamps are quoted, and
+    missing values are written as 'NAN'.  The 'TIMESTAMP' column is parsed
+    as the `timestamp` variable.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the data file.
+    read_csv_options : dict
+        Options of `pandas.read_csv` from the data settings.  Only 'usecols',
+        'dtype', 'na_values', 'encoding', and 'names' are used.  Here,
+        'names' renames the columns other than the time columns.
+    compression : str, optional
+        Compression of the file, e.g., 'gzip'.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        The parsed data table.
+    """
+    na_values = ['NAN', '"NAN"']
+    if read_csv_options.get('na_values') is not None:
+        na_values = na_values + list(np.atleast_1d(
+            read_csv_options['na_values']))
+    options = _format_read_options(
+        read_csv_options, sep=',', header=0, skiprows=[0, 2, 3],
+        quotechar='"', na_values=na_values, compression=compression)
+    df = pd.read_csv(filepath, **options)
+    timestamp = None
+    if 'TIMESTAMP' in df.columns:
+        timestamp = pd.to_datetime(df['TIMESTAMP'], errors='coerce')
+    return _finish_format_parse(df, timestamp, ['TIMESTAMP'],
+                                read_csv_options.get('names'))
+
+
+def parse_licor(filepath, read_csv_options, compression=None):
+    """
+    Parse a LI-COR trace gas analyzer data file (e.g., LI-7810, LI-7820).
+
+    The file starts with instrument information lines, followed by a 'DATAH'
+    line of column names and a 'DATAU' line of units.  Data lines start with
+    'DATA' and are tab-delimited.  The 'DATE' and 'TIME' columns (analyzer
+    clock) are combined as the `timestamp` variable.
+
+    Parameters and return are the same as `parse_toa5()`.
+    """
+    # find the column name line after the instrument information
+    with _open_text(filepath, compression,
+                    read_csv_options.get('encoding', 'utf-8')) as f:
+        n_info = 0
+        for line in f:
+            if line.startswith('DATAH'):
+                break
+            n_info += 1
+        else:
+            raise RuntimeError('No LI-COR data header found in %s.' %
+                               filepath)
+    options = _format_read_options(
+        read_csv_options, sep='\t', header=0,
+        skiprows=list(range(n_info)) + [n_info + 1],
+        compression=compression)
+    df = pd.read_csv(filepath, **options)
+    # the first column only holds the line labels
+    if 'DATAH' in df.columns:
+        df = df.loc[df['DATAH'] == 'DATA', :].drop(columns='DATAH')
+        df.reset_index(drop=True, inplace=True)
+    timestamp = None
+    if 'DATE' in df.columns and 'TIME' in df.columns:
+        timestamp = pd.to_datetime(
+            df['DATE'].astype(str) + ' ' + df['TIME'].astype(str),
+            errors='coerce')
+    return _finish_format_parse(df, timestamp, ['DATE', 'TIME'],
+                                read_csv_options.get('names'))
+
+
+def parse_aerodyne_str(filepath, read_csv_options, compression=None):
+    """
+    Parse an Aerodyne TDLWintel concentration file ('.str').
+
+    The first line lists the species after 'SPEC:', and each data line has
+    the time in seconds since 1904-01-01 (LabVIEW epoch) followed by the
+    mixing ratios, separated by spaces.  The time column is parsed as the
+    `timestamp` variable, and the other columns are named by the species.
+
+    Parameters and return are the same as `parse_toa5()`.
+    """
+    with _open_text(filepath, compression,
+                    read_csv_options.get('encoding', 'utf-8')) as f:
+        first_line = f.readline().strip()
+    if first_line.startswith('SPEC:'):
+        species = [name.strip() for name in
+                   first_line[len('SPEC:'):].replace(',', ' ').split()]
+        skiprows = 1
+    else:
+        # no species line; columns are named by position
+        species = None
+        skiprows = 0
+    options = _format_read_options(
+        read_csv_options, sep='\\s+', header=None, skiprows=skiprows,
+        compression=compression)
+    df = pd.read_csv(filepath, **options)
+    if species is not None and len(species) == df.shape[1] - 1:
+        df.columns = ['time_sec'] + species
+    else:
+        df.columns = ['time_sec'] + \
+            ['col_%d' % i for i in range(1, df.shape[1])]
+    timestamp = pd.Timestamp('1904-01-01') + \
+        df['time_sec'] * pd.Timedelta(seconds=1)
+    return _finish_format_parse(df, timestamp, ['time_sec'],
+                                read_csv_options.get('names'))
+
+
+# Parsers of the native file formats of data loggers and gas analyzers.
+# Selected with the `file_format` option in the data settings; files of other
+# formats are parsed as delimited text with `pandas.read_csv`.  A parser takes
+# the file path, the `read_csv` options, and the compression, and returns a
+# data table with a parsed `timestamp` column.
+file_format_parsers = {
+    # Campbell Scientific TOA5 datalogger files
+    'toa5': parse_toa5,
+
+    # LI-COR trace gas analyzer files
+    'licor': parse_licor,
+
+    # Aerodyne TDLWintel concentration files
+    'aerodyne': parse_aerodyne_str,
+}
+
+
+@timed('parsing')
+def parse_timestamp(df, data_settings):
+    """
+    Parse the time variable of a data table into standardized time variables.
+
+    The time variable is searched for in the following order of priority.
+    - 'timestamp' (or 'datetime'): date and time strings or timestamps
+    - 'time_doy' (or 'doy'): day of year numbers referenced to the year
+      `year_ref` in the data settings
+    - 'time_sec': seconds since 1 Jan of the year `time_sec_start` in the
+      data settings (default 1904, the LabVIEW epoch)
+
+    Two standardized time variables are added to the table.
+    - 'timestamp': `pandas.Timestamp` type
+    - 'time_ns': int64 nanoseconds since the epoch, the internal time axis
+      used for window lookup.  Day of year values are computed only for
+      output.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data table; modified in place.
+    data_settings : dict
+        Settings of the data, e.g., `config['conc_data_settings']`.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        The data table with standardized time variables.
+    """
+    # parse 'doy' as 'time_doy'
+    if 'doy' in df.columns and 'time_doy' not in df.columns:
+        df.rename(columns={'doy': 'time_doy'}, inplace=True)
+
+    # parse 'datetime' as 'timestamp'
+    if 'datetime' in df.columns and 'timestamp' not in df.columns:
+        df.rename(columns={'datetime': 'timestamp'}, inplace=True)
+
+    if 'timestamp' in df.columns.values:
+        if not np.issubdtype(df['timestamp'].dtype, np.datetime64):
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            # note: no need to catch out-of-bound error if set 'coerce'
+    elif 'time_doy' in df.columns.values:
+        # the year must be specified for day of year numbers
+        year_ref = data_settings['year_ref']
+        if year_ref is None:
+            raise RuntimeError('`year_ref` must be specified to parse ' +
+                               'day of year numbers.')
+        df['timestamp'] = pd.Timestamp('%d-01-01' % year_ref) + \
+            df['time_doy'] * pd.Timedelta(days=1.)
+    elif 'time_sec' in df.columns.values:
+        time_sec_start = data_settings['time_sec_start']
+        if time_sec_start is None:
+            time_sec_start = 1904
+        df['timestamp'] = pd.Timestamp('%d-01-01' % time_sec_start) + \
+            df['time_sec'] * pd.Timedelta(seconds=1)
+    else:
+        warnings.warn('No time variable is found!', UserWarning)
+        return df
+
+    # note: NaT is converted to the minimum int64 value (`NAT_NS`); these
+    # rows are dropped by `sort_time_index()`
+    df['time_ns'] = \
+        df['timestamp'].values.astype('datetime64[ns]').view('int64')
+
+    return df
+
+
+# `time_ns` value of NaT timestamps
+NAT_NS = np.iinfo(np.int64).min
+
+# Names of time variables.  They are exempted from the dtype policy and always
+# kept in full precision.
+time_variable_names = ['timestamp', 'datetime', 'time_ns', 'time_doy', 'doy',
+                       'time_sec']
+
+
+def apply_dtype_policy(df, dtype_policy):
+    """
+    Cast the columns of a data table to compact data types by column kind.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data table; modified in place.
+    dtype_policy : dict or None
+        A mapping of column kinds to data types.  Supported kinds are
+        - 'float': floating point columns, e.g., 'float32'
+        - 'int': integer columns, e.g., 'int32'
+        - 'str': string (object) columns, e.g., 'category'
+        If `None` or empty, do nothing.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        The data table with the columns cast.
+    """
+    if not dtype_policy:
+        return df
+
+    for col in df.columns:
+        if col in time_variable_names:
+            continue
+        kind = df[col].dtype.kind
+        if kind == 'f' and 'float' in dtype_policy:
+            df[col] = df[col].astype(dtype_policy['float'])
+        elif kind in 'iu' and 'int' in dtype_policy:
+            df[col] = df[col].astype(dtype_policy['int'])
+        elif kind == 'O' and 'str' in dtype_policy:
+            df[col] = df[col].astype(dtype_policy['str'])
+
+    return df
+
+
+def duplicate_groups(time_ns):
+    """
+    Return the first and the last row positions of the groups of identical
+    timestamps in a sorted time axis.
+    """
+    is_new = np.ones(time_ns.size, dtype=bool)
+    is_new[1:] = time_ns[1:] != time_ns[:-1]
+    i_first = np.flatnonzero(is_new)
+    i_last = np.empty_like(i_first)
+    i_last[:-1] = i_first[1:] - 1
+    i_last[-1:] = time_ns.size - 1
+    return i_first, i_last
+
+
+def _average_duplicates(values, i_first):
+    """Average the groups of rows starting at `i_first`, ignoring NaNs."""
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.), i_first,
+                           dtype=np.float64)
+    counts = np.add.reduceat(valid.astype(np.int64), i_first)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return means.astype(values.dtype)
+
+
+def reduce_duplicates(values, i_first, i_last, duplicates='first'):
+    """
+    Reduce the groups of duplicated timestamps in a time-sorted column.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        A time-sorted data column.
+    i_first, i_last : numpy.ndarray
+        First and last row positions of the groups of identical timestamps.
+    duplicates : str, optional
+        - 'first' (default): keep the first row of each group
+        - 'last': keep the last row of each group
+        - 'average': average floating point columns over each group,
+          ignoring NaNs; other columns keep the first row
+
+    Return
+    ------
+    values : numpy.ndarray
+        The column with one row per unique timestamp.
+    """
+    if duplicates == 'last':
+        return values[i_last]
+    if duplicates == 'average' and values.dtype.kind == 'f':
+        return _average_duplicates(values, i_first)
+    return values[i_first]
+
+
+@timed('parsing')
+def sort_time_index(df, duplicates='first'):
+    """
+    Sort a data table by `time_ns` and remove duplicated timestamps.
+
+    Logger restarts and overlapping data files leave out-of-order and
+    duplicated timestamps in the concatenated table.  The time axis is
+    checked in one pass, and the table is only sorted (with a stable merge
+    sort that keeps the file order of identical timestamps) or deduplicated
+    when needed.  Rows of unparsable (NaT) timestamps are dropped first, so
+    that they are neither sorted to the front nor taken as duplicates.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data table with the `time_ns` variable.
+    duplicates : str or None, optional
+        Policy for rows of identical timestamps: 'first' (default), 'last',
+        or 'average'; see `reduce_duplicates()`.  If `None`, duplicated
+        rows are kept.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        The data table sorted by time.
+    n_unsorted : int
+        Number of rows moved by sorting.
+    n_duplicates : int
+        Number of rows with a duplicated timestamp.
+    n_invalid : int
+        Number of rows dropped for NaT timestamps.
+    """
+    if duplicates not in [None, 'first', 'last', 'average']:
+        raise RuntimeError('Allowed values of `duplicates` are ' +
+                           "None, 'first', 'last', 'average'.")
+    if 'time_ns' not in df.columns.values:
+        return df, 0, 0, 0
+
+    time_ns = df['time_ns'].values
+    is_nat = time_ns == NAT_NS
+    n_invalid = int(np.count_nonzero(is_nat))
+    if n_invalid:
+        df = df.loc[~is_nat].reset_index(drop=True)
+        time_ns = df['time_ns'].values
+    if df.shape[0] < 2:
+        return df, 0, 0, n_invalid
+
+    n_unsorted = 0
+    if not np.all(time_ns[1:] >= time_ns[:-1]):
+        order = np.argsort(time_ns, kind='mergesort')
+        n_unsorted = int(np.count_nonzero(order != np.arange(order.size)))
+        df = df.iloc[order].reset_index(drop=True)
+        time_ns = df['time_ns'].values
+
+    n_duplicates = int(np.count_nonzero(time_ns[1:] == time_ns[:-1]))
+    if n_duplicates == 0 or duplicates is None:
+        return df, n_unsorted, n_duplicates, n_invalid
+
+    i_first, i_last = duplicate_groups(time_ns)
+    i_keep = i_last if duplicates == 'last' else i_first
+    df_reduced = df.iloc[i_keep].reset_index(drop=True)
+    if duplicates == 'average':
+        for col in df.columns:
+            if col not in time_variable_names and \
+                    df[col].dtype.kind == 'f':
+                df_reduced[col] = _average_duplicates(df[col].values,
+                                                      i_first)
+
+    return df_reduced, n_unsorted, n_duplicates, n_invalid
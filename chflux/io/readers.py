@@ -1,12 +1,17 @@
 """PyChamberFlux I/O module for reading config and data files."""
 import collections
+import concurrent.futures
 import copy
 import glob
+import io
+import os
 
 import yaml
 import pandas as pd
 
-from chflux.io.parsers import timestamp_parsers
+from chflux.io.parsers import timestamp_parsers, file_format_parsers, \
+    apply_dtype_policy, parse_timestamp, sort_time_index
+from chflux.timing import timed, get_run_timer
 
 
 def read_yaml(filepath):
@@ -47,6 +52,261 @@ def update_dict(dct, updater):
     return dct_copy
 
 
+# compression formats of data files by file name extension; compressed files
+# are decompressed in memory while being parsed
+compression_extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+
+@timed('discovery')
+def search_data_files(pattern):
+    """
+    Search data files with a glob pattern, including compressed files.
+
+    Compressed files named as the pattern plus a compression extension (e.g.,
+    'conc_180101.csv.gz' for the pattern '*.csv') are also found.  If both
+    the plain and the compressed versions of a file exist, whether found by
+    the pattern itself (e.g., '*') or with an extension, only the plain one
+    is kept.
+
+    Parameters
+    ----------
+    pattern : str
+        Glob pattern of the data files.
+
+    Return
+    ------
+    data_flist : list of str
+        Sorted list of the data files found.
+    """
+    data_flist = set(glob.glob(pattern))
+    for ext in compression_extensions:
+        data_flist.update(glob.glob(pattern + ext))
+    # drop the compressed versions of the plain files found
+    return sorted(
+        f for f in data_flist
+        if not any(f.endswith(ext) and f[:-len(ext)] in data_flist
+                   for ext in compression_extensions))
+
+
+def split_byte_ranges(filepath, range_size):
+    """
+    Split a file into byte ranges of about `range_size` bytes.  Ranges are
+    cut after newline characters, so that no line is broken.
+
+    Return
+    ------
+    byte_ranges : list of tuple
+        List of `(start, end)` byte offsets, `end` exclusive.
+    """
+    file_size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as f:
+        pos = range_size
+        while pos < file_size:
+            f.seek(pos)
+            f.readline()  # move to the start of the next line
+            if f.tell() >= file_size:
+                break
+            bounds.append(f.tell())
+            pos = f.tell() + range_size
+    bounds.append(file_size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _read_byte_range(filepath, byte_range, read_csv_options):
+    """Parse a byte range of a file with `pandas.read_csv`."""
+    with open(filepath, 'rb') as f:
+        f.seek(byte_range[0])
+        buf = io.BytesIO(f.read(byte_range[1] - byte_range[0]))
+    return pd.read_csv(buf, **read_csv_options)
+
+
+def read_large_file(filepath, read_csv_options, range_size, n_threads=1):
+    """
+    Parse a large data file in byte ranges on parallel threads.
+
+    The file is cut at newline boundaries into ranges of about `range_size`
+    bytes.  The first range is parsed with the header; the other ranges are
+    parsed with the column names taken from the header.  The parsed tables
+    are concatenated in the file order.
+
+    Only plain text files with a single header line (or no header) can be
+    split; quoted fields must not contain line breaks.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the data file.
+    read_csv_options : dict
+        Keyword arguments passed to `pandas.read_csv`.
+    range_size : int
+        Approximate size of the byte ranges, in bytes.
+    n_threads : int, optional
+        Number of threads to parse the ranges.  Default is 1.
+
+    Return
+    ------
+    df : pandas.DataFrame
+        The parsed data table.
+    """
+    byte_ranges = split_byte_ranges(filepath, range_size)
+    if len(byte_ranges) < 2:
+        return pd.read_csv(filepath, **read_csv_options)
+
+    # the other ranges use the full list of column names in the header line
+    names = read_csv_options['names']
+    if names is None and read_csv_options['header'] is not None:
+        names = pd.read_csv(
+            filepath, sep=read_csv_options['sep'],
+            header=read_csv_options['header'], nrows=0,
+            encoding=read_csv_options['encoding']).columns.tolist()
+    first_options = dict(read_csv_options)
+    other_options = dict(read_csv_options, header=None, names=names)
+    range_options = [first_options] + \
+        [other_options] * (len(byte_ranges) - 1)
+
+    if n_threads is not None and n_threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(n_threads) as executor:
+            df_ranges = list(executor.map(
+                _read_byte_range, [filepath] * len(byte_ranges),
+                byte_ranges, range_options))
+    else:
+        df_ranges = [_read_byte_range(filepath, r, opts)
+                     for r, opts in zip(byte_ranges, range_options)]
+    return pd.concat(df_ranges, ignore_index=True)
+
+
+def is_split_file(filepath, read_csv_options, split_size=None,
+                  file_format=None):
+    """
+    Return True if a data file is to be parsed in byte ranges: a plain,
+    delimited text file larger than `split_size` bytes, with no more than one
+    header line.
+    """
+    return (split_size is not None and file_format is None and
+            os.path.splitext(filepath)[1] not in compression_extensions and
+            (read_csv_options['header'] in ['infer', None] or
+             isinstance(read_csv_options['header'], int)) and
+            os.path.getsize(filepath) > split_size)
+
+
+def read_data_file(filepath, read_csv_options, split_size=None,
+                   n_threads=1, file_format=None):
+    """
+    Read a data file with `pandas.read_csv`.
+
+    A compressed file is detected by its extension and decompressed while
+    streaming; no decompressed copy is written to the disk.  A plain file
+    larger than `split_size` bytes is parsed in byte ranges on `n_threads`
+    threads; see `read_large_file()`.  A file of a native data logger or
+    analyzer format is parsed with the parser registered for `file_format`
+    in `chflux.io.parsers.file_format_parsers`.
+    """
+    compression = compression_extensions.get(os.path.splitext(filepath)[1])
+    if file_format is not None:
+        if file_format not in file_format_parsers:
+            raise RuntimeError('Unknown file format: %s.  Allowed values ' %
+                               file_format + 'are %s.' %
+                               ', '.join(sorted(file_format_parsers)))
+        return file_format_parsers[file_format](
+            filepath, read_csv_options, compression=compression)
+    if is_split_file(filepath, read_csv_options, split_size):
+        return read_large_file(filepath, read_csv_options, split_size,
+                               n_threads=n_threads)
+    return pd.read_csv(filepath, compression=compression, **read_csv_options)
+
+
+@timed('parsing')
+def read_data_files(data_flist, read_csv_options, dtype_policy=None,
+                    n_threads=1, split_size=None, file_format=None):
+    """
+    Read a list of data files into a list of data tables.
+
+    Parameters
+    ----------
+    data_flist : list of str
+        Data files to read.
+    read_csv_options : dict
+        Keyword arguments passed to `pandas.read_csv`.
+    dtype_policy : dict, optional
+        Compact data type policy applied to each table; see
+        `chflux.io.parsers.apply_dtype_policy`.
+    n_threads : int, optional
+        Number of threads to read the files in parallel.  Decompression and
+        parsing mostly run outside the interpreter lock.  Default is 1.
+    split_size : int, optional
+        Plain files larger than this size in bytes are parsed in byte ranges
+        of this size in parallel (see `is_split_file()`).  Default is not to
+        split files.  The split files are read one after another, each using
+        all `n_threads` threads; the other files are still read in parallel.
+    file_format : str, optional
+        Native file format of the data files, e.g., 'toa5'; see
+        `chflux.io.parsers.file_format_parsers`.  Default is delimited text.
+
+    Return
+    ------
+    df_loaded : list of pandas.DataFrame
+        Data tables in the order of `data_flist`.
+    """
+    def _read(entry):
+        # compact data types are applied file by file to limit peak memory
+        return apply_dtype_policy(
+            read_data_file(entry, read_csv_options, split_size=split_size,
+                           n_threads=n_threads, file_format=file_format),
+            dtype_policy)
+
+    if n_threads is None or n_threads <= 1 or len(data_flist) < 2:
+        return [_read(entry) for entry in data_flist]
+
+    # large files split into byte ranges are read one at a time, each using
+    # all the threads; the other files are read in parallel
+    is_split = [is_split_file(entry, read_csv_options, split_size,
+                              file_format) for entry in data_flist]
+    df_loaded = [None] * len(data_flist)
+    i_whole = [i for i, split in enumerate(is_split) if not split]
+    with concurrent.futures.ThreadPoolExecutor(n_threads) as executor:
+        for i, df in zip(i_whole, executor.map(
+                _read, [data_flist[i] for i in i_whole])):
+            df_loaded[i] = df
+    for i in range(len(data_flist)):
+        if is_split[i]:
+            df_loaded[i] = _read(data_flist[i])
+    return df_loaded
+
+
+def split_file_size(config):
+    """Return the file size in bytes above which data files are split."""
+    size_mb = config['run_options']['split_file_size']
+    if size_mb is None:
+        return None
+    return int(size_mb * 1024 * 1024)
+
+
+def data_read_options(data_settings):
+    """
+    Return the keyword arguments of `pandas.read_csv` for the data files of
+    a data type, from its data settings.
+    """
+    # check date parser: if legit, use it; if not, set it to `None`
+    if data_settings['date_parser'] in timestamp_parsers:
+        date_parser = timestamp_parsers[data_settings['date_parser']]
+    else:
+        date_parser = None
+
+    return {
+        'sep': data_settings['delimiter'],
+        'header': data_settings['header'],
+        'names': data_settings['names'],
+        'usecols': data_settings['usecols'],
+        'dtype': data_settings['dtype'],
+        'na_values': data_settings['na_values'],
+        'parse_dates': data_settings['parse_dates'],
+        'date_parser': date_parser,
+        'infer_datetime_format': True,
+        'engine': 'c',
+        'encoding': 'utf-8'}
+
+
 def read_tabulated_data(data_name, config, query=None):
     """
     A generalized function to read tabulated data specified in the config.
@@ -75,8 +335,8 @@ def read_tabulated_data(data_name, config, query=None):
     if data_name not in ['biomet', 'conc', 'flow', 'leaf', 'timelag']:
         raise RuntimeError('Wrong data name.  Allowed values are ' +
                            "'biomet', 'conc', 'flow', 'leaf', 'timelag'.")
-    # get file list
-    data_flist = glob.glob(config['data_dir'][data_name + '_data'])
+    # get file list, including compressed files
+    data_flist = search_data_files(config['data_dir'][data_name + '_data'])
     # get the data settings
     data_settings = config[data_name + '_data_settings']
 
@@ -97,26 +357,13 @@ def read_tabulated_data(data_name, config, query=None):
         print('%d %s data files are found. ' % (len(data_flist), data_name) +
               'Loading...')
 
-    # check date parser: if legit, use it; if not, set it to `None`
-    if data_settings['date_parser'] in timestamp_parsers:
-        date_parser = timestamp_parsers[data_settings['date_parser']]
-    else:
-        date_parser = None
-
-    read_csv_options = {
-        'sep': data_settings['delimiter'],
-        'header': data_settings['header'],
-        'names': data_settings['names'],
-        'usecols': data_settings['usecols'],
-        'dtype': data_settings['dtype'],
-        'na_values': data_settings['na_values'],
-        'parse_dates': data_settings['parse_dates'],
-        'date_parser': date_parser,
-        'infer_datetime_format': True,
-        'engine': 'c',
-        'encoding': 'utf-8'}
-    df_loaded = \
-        [pd.read_csv(entry, **read_csv_options) for entry in data_flist]
+    read_csv_options = data_read_options(data_settings)
+    dtype_policy = data_settings['dtype_policy']
+    df_loaded = read_data_files(
+        data_flist, read_csv_options, dtype_policy=dtype_policy,
+        n_threads=config['run_options']['n_read_threads'],
+        split_size=split_file_size(config),
+        file_format=data_settings['file_format'])
 
     # echo the list of data files
     for entry in data_flist:
@@ -131,7 +378,28 @@ def read_tabulated_data(data_name, config, query=None):
 
     del df_loaded
 
+    # categories that differ between files are concatenated as objects
+    df = apply_dtype_policy(df, dtype_policy)
+
     # echo data status
     print('%d lines read from %s data.' % (df.shape[0], data_name))
+    get_run_timer().count('%s_rows' % data_name, df.shape[0])
+
+    # parse time variables into `timestamp` and `time_ns`
+    df = parse_timestamp(df, data_settings)
+
+    # sort by time and remove duplicated timestamps, only if needed
+    duplicates = data_settings['duplicates']
+    df, n_unsorted, n_duplicates, n_invalid = \
+        sort_time_index(df, duplicates)
+    if n_invalid:
+        print('%d lines of %s data with invalid timestamps dropped.' %
+              (n_invalid, data_name))
+    if n_unsorted:
+        print('%d lines of %s data sorted by time.' % (n_unsorted, data_name))
+    if n_duplicates:
+        print('%d lines of %s data have duplicated timestamps (%s).' %
+              (n_duplicates, data_name,
+               'kept' if duplicates is None else 'policy: ' + duplicates))
 
     return df
@@ -0,0 +1,138 @@
+"""
+PyChamberFlux I/O module for writing output data tables.
+
+The output tables are formatted column by column: values are rounded to the
+precision of their column while being converted to strings, so that no
+rounded copy of the whole table is made.  The rows are written through a
+buffered (and optionally gzip-compressed) stream.  With the default
+settings, the files are the same as those written by
+`DataFrame.round(...).to_csv(na_rep='NaN', index=False)`.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import csv
+import gzip
+import io
+import os
+
+import numpy as np
+
+
+# buffer size of the output stream in bytes
+WRITE_BUFFER_SIZE = 1 << 20
+# number of rows formatted at a time
+WRITE_CHUNK_ROWS = 4096
+
+
+def format_column(values, decimals=None, na_rep='NaN'):
+    """
+    Format the values of a column as strings.
+
+    Parameters
+    ----------
+    values : array_like
+        Column values.
+    decimals : int, optional
+        Number of decimal places to round off floating point values.  Default
+        is no rounding.
+    na_rep : str, optional
+        String representation of missing floating point values.
+
+    Return
+    ------
+    strings : list of str
+        Formatted values.  Non-numeric values are returned as is, to be
+        formatted (and quoted) by the CSV writer.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        if decimals is not None:
+            # one column at a time; the data table is not copied
+            values = np.round(values, decimals)
+        if values.dtype == np.float64:
+            strings = [repr(x) for x in values.tolist()]
+        else:
+            # shortest representation at the precision of the column, e.g.,
+            # of float32 values, not of their float64 upcasts
+            strings = [str(x) for x in values]
+        for i in np.flatnonzero(np.isnan(values)):
+            strings[i] = na_rep
+        return strings
+    elif values.dtype.kind in 'biu':
+        return [str(x) for x in values.tolist()]
+    return [na_rep if x is None or (isinstance(x, float) and x != x) else x
+            for x in values.tolist()]
+
+
+def open_output(path, compression=None):
+    """
+    Open a buffered text stream to write an output file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file.
+    compression : str, optional
+        'gzip' to compress the output; `'.gz'` is appended to the path if
+        missing.  Default is no compression.
+
+    Return
+    ------
+    stream : file object
+        The opened text stream.
+    path : str
+        Path to the output file.
+    """
+    if compression is None:
+        return open(path, 'w', newline='', buffering=WRITE_BUFFER_SIZE), path
+    elif compression == 'gzip':
+        if not path.endswith('.gz'):
+            path += '.gz'
+        raw = io.BufferedWriter(gzip.open(path, 'wb', compresslevel=6),
+                                buffer_size=WRITE_BUFFER_SIZE)
+        return io.TextIOWrapper(raw, newline=''), path
+    else:
+        raise ValueError('Unknown output compression: %s' % compression)
+
+
+def write_table(df, path, decimals=None, na_rep='NaN', compression=None):
+    """
+    Write a data table to a CSV file, rounding off columns while formatting.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data table.  The row index is not written.
+    path : str
+        Path to the output file.
+    decimals : dict, optional
+        Number of decimal places to round off each column, e.g.,
+        `{'fco2_lin': 6}`.  Columns not in the dict are not rounded.
+    na_rep : str, optional
+        String representation of missing values.  Default is 'NaN'.
+    compression : str, optional
+        'gzip' to compress the output.  Default is no compression.
+
+    Return
+    ------
+    path : str
+        Path to the written file.
+    """
+    if decimals is None:
+        decimals = {}
+    names = df.columns.values
+    arrays = [df[name].values for name in names]
+
+    stream, path = open_output(path, compression)
+    with stream:
+        writer = csv.writer(stream, lineterminator=os.linesep)
+        writer.writerow(names)
+        # format a chunk of rows at a time to bound the memory of strings
+        for i in range(0, df.shape[0], WRITE_CHUNK_ROWS):
+            ind = slice(i, i + WRITE_CHUNK_ROWS)
+            writer.writerows(zip(*[
+                format_column(values[ind], decimals.get(name), na_rep)
+                for name, values in zip(names, arrays)]))
+
+    return path
@@ -5,10 +5,10 @@ A collection of input/output tools for PyChamberFlux
 
 """
 import yaml
-import glob
-import warnings
 import pandas as pd
 
+from chflux.io.readers import read_tabulated_data
+
 
 # a collection of date parsers for timestamps stored in multiple columns
 # This does not support month-first (American) or day-first (European) format,
@@ -65,111 +65,5 @@ def load_tabulated_data(data_name, config, query=None):
     df : pandas.DataFrame
         The loaded tabulated data.
     """
-    # check the validity of `data_name` parameter
-    if data_name not in ['biomet', 'conc', 'flow', 'leaf', 'timelag']:
-        raise RuntimeError('Wrong data name. Allowed values are ' +
-                           "'biomet', 'conc', 'flow', 'leaf', 'timelag'.")
-    # search file list
-    data_flist = glob.glob(config['data_dir'][data_name + '_data'])
-    data_flist = sorted(data_flist)  # HOTFIX: must sort by name
-    # get the data settings
-    data_settings = config[data_name + '_data_settings']
-
-    if type(query) is str:
-        # `query` must be a list
-        query = [query]
-
-    if query is not None:
-        data_flist = [f for f in data_flist if any(q in f for q in query)]
-        data_flist = sorted(data_flist)  # ensure the list is sorted by name
-
-    # check data existence
-    if not len(data_flist):
-        print('Cannot find the %s data file!' % data_name)
-        return None
-    else:
-        print('%d %s data files are found. ' % (len(data_flist), data_name) +
-              'Loading...')
-
-    # check date parser: if legit, extract it, and if not, set it to `None`
-    if data_settings['date_parser'] in date_parsers_dict:
-        date_parser = date_parsers_dict[data_settings['date_parser']]
-    else:
-        date_parser = None
-
-    read_csv_options = {
-        'sep': data_settings['delimiter'],
-        'header': data_settings['header'],
-        'names': data_settings['names'],
-        'usecols': data_settings['usecols'],
-        'dtype': data_settings['dtype'],
-        'na_values': data_settings['na_values'],
-        'parse_dates': data_settings['parse_dates'],
-        'date_parser': date_parser,
-        'infer_datetime_format': True,
-        'engine': 'c',
-        'encoding': 'utf-8', }
-    df_loaded = \
-        [pd.read_csv(entry, **read_csv_options) for entry in data_flist]
-
-    for entry in data_flist:
-        print(entry)
-
-    try:
-        df = pd.concat(df_loaded, ignore_index=True)
-    except ValueError:
-        # if the list to concatenate is empty
-        return None
-
-    del df_loaded
-
-    # parse 'doy' as 'time_doy'
-    if 'doy' in df.columns and 'time_doy' not in df.columns:
-        df.rename(columns={'doy': 'time_doy'}, inplace=True)
-
-    # parse 'datetime' as 'timestamp'
-    if 'datetime' in df.columns and 'timestamp' not in df.columns:
-        df.rename(columns={'datetime': 'timestamp'}, inplace=True)
-
-    # echo data status
-    print('%d lines read from %s data.' % (df.shape[0], data_name))
-
-    # the year number to which the day of year values are referenced
-    year_ref = config['%s_data_settings' % data_name]['year_ref']
-
-    # parse time variables if not already exist
-    if 'timestamp' in df.columns.values:
-        if type(df.loc[0, 'timestamp']) is not pd.Timestamp:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            # note: no need to catch out-of-bound error if set 'coerce'
-        if 'time_doy' not in df.columns.values:
-            # add a time variable in days of year (float) if not already there
-            year_start = year_ref if year_ref is not None else \
-                df.loc[0, 'timestamp'].year
-            df['time_doy'] = (df['timestamp'] -
-                              pd.Timestamp('%d-01-01' % year_start)) / \
-                pd.Timedelta(days=1)
-    elif 'time_doy' in df.columns.values:
-        # starting year must be specified for day of year
-        year_start = year_ref
-        df['timestamp'] = pd.Timestamp('%d-01-01' % year_start) + \
-            df['time_doy'] * pd.Timedelta(days=1.)
-    elif 'time_sec' in df.columns.values:
-        time_sec_start = config[
-            '%s_data_settings' % data_name]['time_sec_start']
-        if time_sec_start is None:
-            time_sec_start = 1904
-        df['timestamp'] = pd.Timestamp('%d-01-01' % time_sec_start) + \
-            df['time_sec'] * pd.Timedelta(seconds=1)
-        # add a time variable in days of year (float)
-        year_start = year_ref if year_ref is not None else \
-            df.loc[0, 'timestamp'].year
-        year_start_in_sec = (
-            pd.Timestamp('%d-01-01' % year_start) -
-            pd.Timestamp('%d-01-01' % time_sec_start)) / \
-            pd.Timedelta(seconds=1)
-        df['time_doy'] = (df['time_sec'] - year_start_in_sec) / 86400.
-    else:
-        warnings.warn('No time variable is found!', UserWarning)
-
-    return df
+    # one implementation of the loader, shared with the new `chflux` program
+    return read_tabulated_data(data_name, config, query=query)
@@ -0,0 +1,219 @@
+"""
+Multi-day overview plots of chamber fluxes
+
+An overview figure shows the fluxes of a date range from the columnar output
+store (`chflux.io.fluxstore`), one panel per species and chamber.  A season
+has far more flux values than a panel has pixels, so the series are
+decimated before drawing: each pixel column keeps only its minimum and
+maximum values, which draws the same envelope as the full series.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+
+from chflux.io.fluxstore import read_output_store
+
+
+# figure resolution in dots per inch, and size of a panel in inches
+OVERVIEW_DPI = 100
+OVERVIEW_PANEL_SIZE = (4., 2.)
+
+
+def minmax_decimate(x, y, n_bins):
+    """
+    Decimate a series to the minimum and maximum values in each bin of x.
+
+    Parameters
+    ----------
+    x : array_like
+        Sorted x values, e.g., int64 nanosecond times.
+    y : array_like
+        y values.  NaN values are dropped.
+    n_bins : int
+        Number of equal-width bins over the range of x, e.g., the width of
+        the panel in pixels.
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        The decimated series in the order of x, with at most `2 * n_bins`
+        points.  Series of no more points are returned without NaN values.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(y)
+    x = x[finite]
+    y = y[finite]
+    if x.size <= 2 * n_bins:
+        return x, y
+
+    x_float = x.astype(np.float64)
+    x_range = x_float[-1] - x_float[0]
+    bins = np.minimum(((x_float - x_float[0]) / x_range * n_bins).astype(int),
+                      n_bins - 1)
+    # sort by bin, then by y; the first and last of each bin are its
+    # minimum and maximum
+    order = np.lexsort((y, bins))
+    bin_sorted = bins[order]
+    i_first = np.flatnonzero(np.r_[True, bin_sorted[1:] != bin_sorted[:-1]])
+    i_last = np.r_[i_first[1:] - 1, bin_sorted.size - 1]
+    keep = np.unique(np.concatenate((order[i_first], order[i_last])))
+    return x[keep], y[keep]
+
+
+def _flux_species(columns, method):
+    """Return the species of the flux columns of a fitting method."""
+    suffix = '_' + method
+    return [name[1:-len(suffix)] for name in columns
+            if name.startswith('f') and name.endswith(suffix) and
+            not name.startswith('flow')]
+
+
+def render_flux_overview(store_dir, path, start=None, end=None,
+                         species_list=None, method='nonlin', ylabels=None):
+    """
+    Render an overview figure of the fluxes in a date range from the output
+    store.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the output store.
+    path : str
+        Path of the plot file.
+    start, end : str or pandas.Timestamp, optional
+        Time range `[start, end)` to plot.  Default is all stored rows.
+    species_list : list of str, optional
+        Species to plot.  Default is all species in the store.
+    method : str, optional
+        Fitting method of the fluxes, 'lin', 'rlin', or 'nonlin' (default).
+    ylabels : list of str, optional
+        Axis labels of the species, e.g., with the flux units.
+
+    Returns
+    -------
+    path : str
+        Path of the saved plot, or `None` if no flux is found in the range.
+    """
+    if species_list is not None:
+        columns = ['ch_label'] + ['f%s_%s' % (s, method)
+                                  for s in species_list]
+    else:
+        columns = None
+    df = read_output_store(store_dir, 'flux', columns=columns, start=start,
+                           end=end)
+    if df is None or df.shape[0] == 0:
+        return None
+    if species_list is None:
+        species_list = _flux_species(df.columns.values, method)
+    if ylabels is None:
+        ylabels = ['F%s' % s for s in species_list]
+    if 'ch_label' in df.columns and df['ch_label'].dtype.kind != 'f':
+        ch_labels = df['ch_label'].values.astype(str)
+    else:  # not in the store
+        ch_labels = df['ch_no'].values.astype(str)
+    unique_ch_labels = np.unique(ch_labels)
+    n_species = len(species_list)
+    n_chambers = unique_ch_labels.size
+
+    fig = Figure(figsize=(OVERVIEW_PANEL_SIZE[0] * n_chambers + 1.,
+                          OVERVIEW_PANEL_SIZE[1] * n_species + 0.5),
+                 dpi=OVERVIEW_DPI)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows=n_species, ncols=n_chambers, sharex=True,
+                        squeeze=False)
+    # one bin per pixel column of a panel
+    n_bins = int(OVERVIEW_PANEL_SIZE[0] * OVERVIEW_DPI)
+
+    time_ns = df['timestamp'].values.astype(np.int64)
+    for k, lb_ch in enumerate(unique_ch_labels):
+        ch_mask = ch_labels == lb_ch
+        for j, spc in enumerate(species_list):
+            flux = df['f%s_%s' % (spc, method)].values
+            x, y = minmax_decimate(time_ns[ch_mask], flux[ch_mask], n_bins)
+            x = mdates.date2num(pd.to_datetime(x).to_pydatetime())
+            axes[j, k].plot(x, y, '-', c='#1f77b4', lw=0.75)
+            axes[j, k].axhline(0., c='gray', lw=0.5)
+            axes[j, k].tick_params(labelsize=9)
+        axes[0, k].set_title(lb_ch, fontsize=9)
+
+    for j in range(n_species):
+        axes[j, 0].set_ylabel(ylabels[j], fontsize=9)
+    for ax in axes[-1, :]:
+        # the same time axis for all periods of a range
+        if start is not None and end is not None:
+            ax.set_xlim(mdates.date2num([pd.Timestamp(start).to_pydatetime(),
+                                         pd.Timestamp(end).to_pydatetime()]))
+        locator = mdates.AutoDateLocator(maxticks=6)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+        for label in ax.get_xticklabels():
+            label.set_rotation(30)
+            label.set_ha('right')
+
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def _render_flux_overview_task(args):
+    store_dir, path, start, end, kwargs = args
+    return render_flux_overview(store_dir, path, start, end, **kwargs)
+
+
+def render_flux_overviews(store_dir, path_format, start, end, freq='MS',
+                          n_workers=1, **kwargs):
+    """
+    Render overview figures of consecutive periods, in parallel.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the output store.
+    path_format : str
+        Format of the plot file paths with the period start, e.g.,
+        './plots/overview_%Y%m%d.png'.
+    start, end : str or pandas.Timestamp
+        Time range `[start, end)` to plot.
+    freq : str, optional
+        Pandas frequency string of the periods, e.g., 'MS' (default) for
+        months, 'W-MON' for weeks.  `None` for one figure of the range.
+    n_workers : int, optional
+        Number of rendering processes.  Default is 1 to render in the
+        calling process.
+    **kwargs
+        Other arguments of `render_flux_overview()`.
+
+    Returns
+    -------
+    paths : list of str
+        Paths of the saved plots; `None` for periods without fluxes.
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    edges = [start, end]
+    if freq is not None:
+        edges[1:1] = [ts for ts in pd.date_range(start, end, freq=freq)
+                      if start < ts < end]
+    tasks = [(store_dir, edges[i].strftime(path_format), edges[i],
+              edges[i + 1], kwargs) for i in range(len(edges) - 1)]
+    if n_workers is None or n_workers <= 1 or len(tasks) < 2:
+        return [_render_flux_overview_task(task) for task in tasks]
+
+    pool = multiprocessing.Pool(n_workers)
+    try:
+        paths = pool.map(_render_flux_overview_task, tasks, chunksize=1)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return paths
@@ -0,0 +1,463 @@
+"""
+Fitting plots of the chamber windows
+
+Rendering the fitting plot of a chamber window costs much more than fitting
+the window.  A plot is therefore described by its inputs alone: the
+concentration segments of the sampling intervals, the baselines, the fitted
+curves, and the titles.  The inputs are small and picklable, and are
+rendered on a separate process pool with the non-interactive Agg backend,
+so that the flux calculation does not wait for PNG encoding.
+
+Each rendering process keeps a figure template per species layout, whose
+artists are updated for each window instead of creating a new figure.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import atexit
+import collections
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# sampling intervals of a chamber window, in the order of
+# `fitting.fit_window()` results
+SEGMENT_NAMES = ['full', 'atmb', 'chb', 'chc', 'cha', 'atma']
+FIT_METHODS = ['lin', 'rlin', 'nonlin']
+
+
+def fitting_plot_filename(ch_start):
+    """Return the file name of the fitting plot of a chamber window."""
+    return 'chfit_%s.png' % pd.Timestamp(ch_start).strftime('%Y%m%d_%H%M')
+
+
+def fitting_plot_inputs(day_data, window, fit_res, fluxes, ch_no, ch_label,
+                        species_names, conc_unit_names, path=None):
+    """
+    Collect the inputs of the fitting plot of a chamber window.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings of the day; see `fitting.fit_window()`.
+    window : dict
+        The chamber window; see `fitting.fit_window()`.
+    fit_res : dict
+        Fitting result of the window, with curves.
+    fluxes : array_like
+        Fluxes of the species (rows) by the linear, robust linear, and
+        nonlinear methods (columns), for the panel titles.
+    ch_no : int
+        Chamber number.
+    ch_label : str
+        Chamber label.
+    species_names : list of str
+        Species names for the axis labels.
+    conc_unit_names : list of str
+        Concentration unit names for the axis labels.
+    path : str, optional
+        Path of the plot file.  Not needed to save the inputs only.
+
+    Returns
+    -------
+    inputs : dict
+        Plot inputs, to be passed to `render_fitting_plot()`.
+        - 'time': times of the concentration series of the window in
+          seconds after 'ch_start', covering all sampling intervals
+        - 'conc': concentrations of the series in output units, a 2-D
+          array of (species, time)
+        - 'segments': row bounds `(start, stop)` of the sampling intervals
+          in the series, by interval name
+        - 't_bl_pts', 'conc_bl_pts': baseline points
+        - 'conc_fitted': fitted concentrations during closure, by method
+        - 'timelag': time lag in seconds
+        - 'ch_start': start of the window, int64 ns
+        - 'fluxes', 'ch_no', 'ch_label', 'species_names', 'conc_unit_names',
+          'path'
+    """
+    t_conc = day_data['t_conc']
+    ch_start = window['ch_start']
+    intervals = list(fit_res['intervals'].values())
+    # one series for all sampling intervals, which overlap
+    i_start = min(ind.start for ind in intervals)
+    i_stop = max(ind.stop for ind in intervals)
+    series = slice(i_start, i_stop)
+    time = (t_conc[series] - ch_start) * 1e-9
+    conc = np.array([
+        day_data['conc_arrays'][s][series] * day_data['conc_factor'][i]
+        for i, s in enumerate(day_data['species_list'])])
+    segments = collections.OrderedDict(
+        (name, (ind.start - i_start, max(ind.start, ind.stop) - i_start))
+        for name, ind in zip(SEGMENT_NAMES, intervals))
+
+    return {'time': time, 'conc': conc, 'segments': segments,
+            't_bl_pts': fit_res['curves']['t_bl_pts'],
+            'conc_bl_pts': fit_res['curves']['conc_bl_pts'],
+            'conc_fitted': fit_res['curves']['conc_fitted'],
+            'timelag': fit_res['timelag_ns'] * 1e-9,
+            'ch_start': ch_start,
+            'fluxes': np.asarray(fluxes, dtype=np.float64),
+            'ch_no': ch_no, 'ch_label': ch_label,
+            'species_names': list(species_names),
+            'conc_unit_names': list(conc_unit_names),
+            'path': path}
+
+
+def save_fitting_curves(path, plot_inputs):
+    """
+    Save the fitting plot inputs of the chamber windows of a day to a file,
+    to be rendered later (see `load_fitting_curves()`).
+
+    The concentration series and the fitted curves of all windows are
+    concatenated, with the row offsets of each window, in an uncompressed
+    `.npz` file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file.
+    plot_inputs : list of dict
+        Plot inputs of the windows; see `fitting_plot_inputs()`.  The
+        windows must have the same species.
+
+    Returns
+    -------
+    path : str
+        Path of the saved file, or `None` if there is no window to save.
+    """
+    if not len(plot_inputs):
+        return None
+    first = plot_inputs[0]
+    arrays = {
+        'species_names': np.array(first['species_names']),
+        'conc_unit_names': np.array(first['conc_unit_names']),
+        'ch_start': np.array([inp['ch_start'] for inp in plot_inputs],
+                             dtype=np.int64),
+        'ch_no': np.array([inp['ch_no'] for inp in plot_inputs]),
+        'ch_label': np.array([inp['ch_label'] for inp in plot_inputs]),
+        'timelag': np.array([inp['timelag'] for inp in plot_inputs]),
+        'fluxes': np.array([inp['fluxes'] for inp in plot_inputs]),
+        't_bl_pts': np.array([inp['t_bl_pts'] for inp in plot_inputs]),
+        'conc_bl_pts': np.array([inp['conc_bl_pts'] for inp in plot_inputs]),
+    }
+    arrays['offsets'] = np.cumsum(
+        [0] + [inp['time'].size for inp in plot_inputs])
+    arrays['time'] = np.concatenate([inp['time'] for inp in plot_inputs])
+    arrays['conc'] = np.concatenate([inp['conc'] for inp in plot_inputs],
+                                    axis=1)
+    arrays['segments'] = np.array(
+        [list(inp['segments'].values()) for inp in plot_inputs],
+        dtype=np.int64)
+    # fitted curves are on the times of the closure interval
+    arrays['offsets_fitted'] = np.cumsum(
+        [0] + [inp['conc_fitted']['lin'].shape[1] for inp in plot_inputs])
+    for method in FIT_METHODS:
+        arrays['fitted_' + method] = np.concatenate(
+            [inp['conc_fitted'][method] for inp in plot_inputs], axis=1)
+
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+    return path
+
+
+def load_fitting_curves(path, ch_no=None, start=None, end=None):
+    """
+    Load the fitting plot inputs of chamber windows from a saved file.
+
+    Parameters
+    ----------
+    path : str
+        Path of a file saved by `save_fitting_curves()`.
+    ch_no : list, optional
+        Chamber numbers or labels of the windows to load.  Default is all.
+    start, end : str or pandas.Timestamp, optional
+        Range `[start, end)` of the window start times to load.  Default is
+        all windows.
+
+    Returns
+    -------
+    plot_inputs : list of dict
+        Plot inputs of the selected windows, without the plot file paths;
+        see `fitting_plot_inputs()`.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        data = dict(data.items())
+
+    mask = np.ones(data['ch_start'].size, dtype=bool)
+    if ch_no is not None:
+        ch_no = [str(s) for s in ch_no]
+        mask &= np.isin(data['ch_no'].astype(str), ch_no) | \
+            np.isin(data['ch_label'].astype(str), ch_no)
+    if start is not None:
+        mask &= data['ch_start'] >= pd.Timestamp(start).value
+    if end is not None:
+        mask &= data['ch_start'] < pd.Timestamp(end).value
+
+    plot_inputs = []
+    for k in np.flatnonzero(mask):
+        series = slice(*data['offsets'][k:k + 2])
+        fitted = slice(*data['offsets_fitted'][k:k + 2])
+        plot_inputs.append({
+            'time': data['time'][series], 'conc': data['conc'][:, series],
+            'segments': collections.OrderedDict(
+                (name, tuple(data['segments'][k, j].tolist()))
+                for j, name in enumerate(SEGMENT_NAMES)),
+            't_bl_pts': data['t_bl_pts'][k],
+            'conc_bl_pts': data['conc_bl_pts'][k],
+            'conc_fitted': {method: data['fitted_' + method][:, fitted]
+                            for method in FIT_METHODS},
+            'timelag': float(data['timelag'][k]),
+            'ch_start': int(data['ch_start'][k]),
+            'fluxes': data['fluxes'][k],
+            'ch_no': data['ch_no'][k].item(),
+            'ch_label': str(data['ch_label'][k]),
+            'species_names': data['species_names'].tolist(),
+            'conc_unit_names': data['conc_unit_names'].tolist(),
+            'path': None})
+    return plot_inputs
+
+
+class FittingPlotTemplate(object):
+    """
+    A reusable figure for the fitting plots of one species layout.
+
+    The figure, its axes, line artists, legend, and annotation are created
+    once.  Rendering a chamber window only updates the data of the artists,
+    the titles, and the axis limits before saving, which is several times
+    faster than creating and destroying a figure for each window.
+
+    Parameters
+    ----------
+    species_names : list of str
+        Species names for the axis labels, one panel per species.
+    conc_unit_names : list of str
+        Concentration unit names for the axis labels.
+    """
+
+    def __init__(self, species_names, conc_unit_names):
+        n_species = len(species_names)
+        # not managed by pyplot; the figure is kept for the whole run
+        self.fig = Figure(figsize=(8, 3 * n_species))
+        FigureCanvasAgg(self.fig)
+        self.axes = self.fig.subplots(nrows=n_species, sharex=True,
+                                      squeeze=False)[:, 0]
+        self.lines = []
+        for i, ax in enumerate(self.axes):
+            lines = {}
+            # color different time segments
+            lines['full'], = ax.plot([], [], 'k.')
+            lines['atmb'], = ax.plot([], [], '.-', color='#0571b0')
+            lines['chb'], = ax.plot([], [], '.-', color='#ca0020')
+            lines['chc'], = ax.plot([], [], '.-', color='#33a02c')
+            lines['cha'], = ax.plot([], [], '.-', color='#ca0020')
+            lines['atma'], = ax.plot([], [], '.-', color='#0571b0')
+            # baselines
+            lines['baseline'], = ax.plot([], [], 'x--', c='gray',
+                                         linewidth=1.5, markeredgewidth=1.25)
+            # timelag lines
+            lines['timelag'] = ax.axvline(x=0., linestyle='dashed', c='k')
+            # fitted lines
+            lines['lin'], = ax.plot([], [], '-', c='k', lw=1.5,
+                                    label='linear')
+            lines['rlin'], = ax.plot([], [], '--', c='firebrick', lw=2,
+                                     label='robust linear')
+            lines['nonlin'], = ax.plot([], [], '-.', c='darkblue', lw=2,
+                                       label='nonlinear')
+            ax.set_ylabel(species_names[i] + ' (%s)' % conc_unit_names[i])
+            self.lines.append(lines)
+        self.axes[-1].set_xlabel('Time (s)')
+
+        # figure legend
+        self.fig.legend(self.axes[0].lines[-3:],
+                        ['linear', 'robust linear', 'nonlinear'],
+                        loc='upper right', ncol=3, fontsize=12,
+                        handlelength=3,
+                        frameon=False, framealpha=0.5)
+
+        # figure annotation, on the last panel as with `pyplot.annotate()`
+        self.annotation = self.axes[-1].annotate(
+            '', xy=(0.025, 0.985), xycoords='figure fraction',
+            ha='left', va='top', fontsize=12)
+
+    def render(self, inputs):
+        """
+        Render the fitting plot of a chamber window and save it to a file.
+
+        Parameters
+        ----------
+        inputs : dict
+            Plot inputs; see `fitting_plot_inputs()`.
+        """
+        time = {}
+        conc = {}
+        for name, bounds in inputs['segments'].items():
+            time[name] = inputs['time'][slice(*bounds)]
+            conc[name] = inputs['conc'][:, slice(*bounds)]
+        for i, ax in enumerate(self.axes):
+            lines = self.lines[i]
+            for name in SEGMENT_NAMES:
+                lines[name].set_data(time[name], conc[name][i])
+            lines['baseline'].set_data(inputs['t_bl_pts'],
+                                       inputs['conc_bl_pts'][i, :])
+            lines['timelag'].set_xdata([inputs['timelag']] * 2)
+            for method in FIT_METHODS:
+                lines[method].set_data(time['chc'],
+                                       inputs['conc_fitted'][method][i, :])
+            # y limits of the new data; x limits are set below
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+            # for the top panel, add an additional linebreak before it
+            ax.set_title(
+                (i == 0) * '\n' +
+                'flux: %.3f (linear), ' % inputs['fluxes'][i, 0] +
+                '%.3f (robust linear), ' % inputs['fluxes'][i, 1] +
+                '%.3f (nonlinear)' % inputs['fluxes'][i, 2])
+
+        # set the common x axis
+        t_min = np.floor(np.nanmin(np.append(time['atmb'], time['full'])) /
+                         60. - 0.5) * 60.
+        t_max = np.ceil(np.nanmax(time['full']) / 60. + 0.5) * 60.
+        self.axes[-1].set_xlim([t_min, t_max])
+        self.axes[-1].set_xticks(np.arange(t_min, t_max + 60., 60.))
+
+        self.annotation.set_text(inputs['ch_label'])
+
+        self.fig.tight_layout()
+        self.fig.savefig(inputs['path'])
+
+
+# figure templates of this process, by species layout
+_plot_templates = {}
+
+
+def render_fitting_plot(inputs):
+    """
+    Render the fitting plot of a chamber window and save it to a file, with
+    the figure template of its species layout.
+
+    Parameters
+    ----------
+    inputs : dict
+        Plot inputs; see `fitting_plot_inputs()`.
+
+    Returns
+    -------
+    path : str
+        Path of the saved plot.
+    """
+    layout = (tuple(inputs['species_names']),
+              tuple(inputs['conc_unit_names']))
+    if layout not in _plot_templates:
+        _plot_templates[layout] = FittingPlotTemplate(*layout)
+    _plot_templates[layout].render(inputs)
+    return inputs['path']
+
+
+def _init_plot_worker(plot_style):
+    """Set up the non-interactive backend; the process pool initializer."""
+    plt.switch_backend('Agg')
+    if plot_style is not None:
+        plt.style.use(plot_style)
+
+
+class PlotRenderer(object):
+    """
+    Render fitting plots on a process pool, off the flux calculation.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        Number of rendering processes.  With 0, or in a daemonic worker
+        process that cannot start child processes, plots are rendered in
+        the calling process when submitted.
+    max_pending : int, optional
+        Maximum number of plots submitted but not rendered.  Submitting
+        more plots waits for the oldest one, which bounds the memory held
+        by queued plot inputs.
+    plot_style : str, optional
+        Matplotlib style of the rendering processes.
+    """
+
+    def __init__(self, n_workers=1, max_pending=64, plot_style=None):
+        if multiprocessing.current_process().daemon:
+            n_workers = 0
+        self.n_workers = n_workers
+        self.max_pending = max(1, max_pending)
+        self._pending = collections.deque()
+        if n_workers > 0:
+            self._pool = multiprocessing.Pool(
+                n_workers, initializer=_init_plot_worker,
+                initargs=(plot_style,))
+        else:
+            self._pool = None
+
+    def submit(self, inputs):
+        """Submit the inputs of a plot to be rendered."""
+        if self._pool is None:
+            render_fitting_plot(inputs)
+            return
+        while len(self._pending) >= self.max_pending:
+            # re-raises errors of the rendering process
+            self._pending.popleft().get()
+        self._pending.append(
+            self._pool.apply_async(render_fitting_plot, (inputs,)))
+
+    def wait(self):
+        """Wait for all submitted plots to be rendered."""
+        while len(self._pending):
+            self._pending.popleft().get()
+
+    def close(self):
+        """Wait for the submitted plots and stop the rendering processes."""
+        if self._pool is None:
+            return
+        try:
+            self.wait()
+            self._pool.close()
+        except BaseException:
+            self._pool.terminate()
+            raise
+        finally:
+            self._pool.join()
+            self._pool = None
+
+
+# plot renderer shared by all days processed in this process
+_plot_renderer = {'pid': None, 'renderer': None}
+_plot_renderer_lock = threading.Lock()
+
+
+def get_plot_renderer(n_workers=1, max_pending=64, plot_style=None):
+    """
+    Return the plot renderer of this process.  The renderer is created once
+    per process and reused by all days, so that plots of a day are rendered
+    while the next days are processed.  Call `close_plot_renderer()` to wait
+    for the plots; this is also done at exit.
+    """
+    with _plot_renderer_lock:
+        # a forked child process does not own the pool of its parent
+        if _plot_renderer['pid'] != os.getpid():
+            _plot_renderer['renderer'] = PlotRenderer(
+                n_workers, max_pending, plot_style)
+            _plot_renderer['pid'] = os.getpid()
+        return _plot_renderer['renderer']
+
+
+def close_plot_renderer():
+    """Wait for all submitted plots and stop the renderer of this process."""
+    with _plot_renderer_lock:
+        if _plot_renderer['pid'] == os.getpid():
+            renderer = _plot_renderer['renderer']
+            _plot_renderer['pid'] = None
+            _plot_renderer['renderer'] = None
+            renderer.close()
+
+
+atexit.register(close_plot_renderer)
@@ -0,0 +1,429 @@
+"""
+Frozen reference engine of the per-window fitting
+
+A copy of the per-window fitting of `chflux.fitting` (`fit_species()` and
+`fit_window()`), frozen when fitting engines were made selectable, that fits
+the windows and the species one after another.  It is the reference against
+which faster fitting engines are checked for numerically equivalent fluxes
+and diagnostics (see `benchmarks.equivalence`), and is selected in a run
+with the option `fit_engine: 'reference'`.
+
+Do not optimize or otherwise change this module.  Changes of the fitting
+methods are made in `chflux.fitting` and show up as differences from the
+reference; the reference is updated only after such differences have been
+reviewed, in a change of its own.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import collections
+
+import numpy as np
+from scipy import stats, optimize
+
+from chflux.common import window_segment, optimize_timelag, conc_func, \
+    resid_conc_func, IQR_func, dew_temp
+from chflux.store import locate_windows
+
+
+def fit_species(day_data, window, spc_id, intervals, dt_lmargin=0):
+    """
+    Fit the closure period of a species in a chamber window.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings of the day; see `fit_window()`.
+    window : dict
+        The chamber window; see `fit_window()`.
+    spc_id : int
+        Index of the species in `day_data['species_list']`.
+    intervals : dict
+        Row slices of the sampling intervals 'chb', 'chc', and 'cha'.
+    dt_lmargin : int, optional
+        Left margin of the closure period, in nanoseconds.
+
+    Returns
+    -------
+    result : dict
+        - 'flux', 'diag': output values by column name
+        - 't_bl': times of the baseline end points, in seconds
+        - 'conc_bl': concentrations of the baseline end points, or `None`
+          if the species has no valid observations
+        - 'fitted': fitted concentrations by method ('lin', 'rlin',
+          'nonlin'), or `None`
+    """
+    t_conc = day_data['t_conc']
+    spc = day_data['species_list'][spc_id]
+    conc = day_data['conc_arrays'][spc]
+    conc_factor = day_data['conc_factor'][spc_id]
+    spc_settings = day_data['species_settings'][spc]
+    ch_start = window['ch_start']
+    flow = window['flow']
+    A_ch = window['A_ch']
+    t_turnover = window['t_turnover']
+    ind_chb, ind_chc, ind_cha = \
+        intervals['chb'], intervals['chc'], intervals['cha']
+    result = {'flux': collections.OrderedDict(),
+              'diag': collections.OrderedDict(),
+              'conc_bl': None, 'fitted': None}
+    flux = result['flux']
+    diag = result['diag']
+
+    # closure period times in seconds after 'ch_start'
+    chc_time = (t_conc[ind_chc] - ch_start) * 1e-9
+    # conc of the current species
+    chc_conc = window_segment(conc, ind_chc) * conc_factor
+
+    # calculate slopes and intercepts of the zero-flux baselines
+    # baseline end points changed from mean to medians (05/05/2016)
+    # - `t_bl_chb`: median or mean time for chamber open period
+    #   (before closure), in seconds
+    # - `t_bl_cha`: median or mean time for chamber open period
+    #   (after closure), in seconds
+    if spc_settings['baseline_correction'] in ['mean', 'average']:
+        bl_calc_func = np.nanmean
+    else:
+        bl_calc_func = np.nanmedian
+
+    t_bl_chb = bl_calc_func(t_conc[ind_chb] - ch_start) * 1e-9
+    t_bl_cha = bl_calc_func(t_conc[ind_cha] - ch_start) * 1e-9
+    conc_bl_chb = bl_calc_func(window_segment(conc, ind_chb)) * conc_factor
+
+    if spc_settings['baseline_correction'] in ['none', 'None', None]:
+        conc_bl_cha = conc_bl_chb
+    else:
+        conc_bl_cha = bl_calc_func(window_segment(conc, ind_cha)) * \
+            conc_factor
+        # if `conc_bl_cha` is not a finite value, set it equal to
+        # `conc_bl_chb`. Thus `k_bl` will be zero.
+        if np.isnan(conc_bl_cha):
+            conc_bl_cha = conc_bl_chb
+            t_bl_cha = chc_time[-1]
+    result['t_bl'] = (t_bl_chb, t_bl_cha)
+
+    k_bl = (conc_bl_cha - conc_bl_chb) / (t_bl_cha - t_bl_chb)
+    b_bl = conc_bl_chb - k_bl * t_bl_chb
+
+    # subtract the baseline to correct for instrument drift
+    # (assuming linear drift)
+    conc_bl = k_bl * chc_time + b_bl
+
+    # linear fit
+    # -------------------------------------------------------------------------
+    # see the supp. info of Sun et al. (2016) JGR-Biogeosci.
+    y_fit = (chc_conc - conc_bl) * flow / A_ch
+    x_fit = np.exp(- (chc_time - chc_time[0] + dt_lmargin * 1e-9) /
+                   t_turnover)
+
+    # boolean index array for finite concentration values
+    ind_conc_fit = np.isfinite(y_fit)
+
+    # number of valid observations
+    flux['n_obs_%s' % spc] = np.sum(ind_conc_fit)
+
+    # if no finite concentration values, skip the fitting
+    if np.sum(ind_conc_fit) == 0:
+        return result
+
+    slope, intercept, r_value, p_value, se_slope = \
+        stats.linregress(x_fit[ind_conc_fit], y_fit[ind_conc_fit])
+
+    # fitted conc values
+    conc_fitted_lin = (slope * x_fit + intercept) * A_ch / flow + conc_bl
+
+    # save the linear fit results and diagnostics
+    flux['f%s_lin' % spc] = -slope
+    flux['se_f%s_lin' % spc] = np.abs(se_slope)
+    diag['k_lin_' + spc] = slope
+    diag['b_lin_' + spc] = intercept
+    diag['r_lin_' + spc] = r_value
+    diag['p_lin_' + spc] = p_value
+    diag['rmse_lin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_lin - chc_conc) ** 2))
+    diag['delta_lin_' + spc] = conc_fitted_lin[-1] - conc_bl[-1] - \
+        (conc_fitted_lin[0] - conc_bl[0])
+
+    # robust linear fit
+    # @TODO: replace Theil-Sen estimator with RANSAC method??
+    # the original algorithm of Theil-Sen method uses numpy.sort()
+    # and is thus time consuming
+    # -------------------------------------------------------------------------
+    medslope, medintercept, lo_slope, up_slope = \
+        stats.theilslopes(y_fit, x_fit, alpha=0.95)
+
+    # fitted conc values
+    conc_fitted_rlin = (medslope * x_fit + medintercept) * A_ch / flow + \
+        conc_bl
+
+    # save the robust linear fit results and diagnostics
+    flux['f%s_rlin' % spc] = -medslope
+    flux['se_f%s_rlin' % spc] = np.abs(up_slope - lo_slope) / 3.92
+    # note: 0.95 C.I. is equivalent to +/- 1.96 sigma
+    diag['k_rlin_' + spc] = medslope
+    diag['b_rlin_' + spc] = medintercept
+    diag['k_lolim_rlin_' + spc] = lo_slope
+    diag['k_uplim_rlin_' + spc] = up_slope
+    diag['rmse_rlin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_rlin - chc_conc) ** 2))
+    diag['delta_rlin_' + spc] = conc_fitted_rlin[-1] - conc_bl[-1] - \
+        (conc_fitted_rlin[0] - conc_bl[0])
+
+    # nonlinear fit
+    # -------------------------------------------------------------------------
+    t_fit = (chc_time - chc_time[0] + dt_lmargin * 1e-9) / t_turnover
+    params_nonlin_guess = [-flux['f%s_lin' % spc], 0.]
+    params_nonlin = optimize.least_squares(
+        resid_conc_func, params_nonlin_guess,
+        bounds=([-np.inf, -10. / t_turnover], [np.inf, 10. / t_turnover]),
+        loss='soft_l1', f_scale=0.5,
+        args=(t_fit[ind_conc_fit], y_fit[ind_conc_fit]))
+
+    # fitted conc values
+    conc_fitted_nonlin = conc_func(params_nonlin.x, t_fit) * A_ch / flow + \
+        conc_bl
+
+    # standard errors of estimated parameters
+    # `J^T J` is a Gauss-Newton approximation of the negative of
+    # the Hessian of the cost function.
+    # The variance-covariance matrix of the parameter estimates is
+    # the inverse of the negative of Hessian matrix evaluated
+    # at the parameter estimates.
+    neg_hess = np.dot(params_nonlin.jac.T, params_nonlin.jac)
+    try:
+        inv_neg_hess = np.linalg.inv(neg_hess)
+    except np.linalg.LinAlgError:
+        try:
+            inv_neg_hess = np.linalg.pinv(neg_hess)
+        except np.linalg.LinAlgError:
+            inv_neg_hess = neg_hess * np.nan
+    # variance-covariance matrix of parameter estimates
+    MSE = np.nansum(params_nonlin.fun ** 2) / (t_fit.size - 2)
+    pcov = inv_neg_hess * MSE
+    # save the nonlinear fit results and diagnostics
+    flux['f%s_nonlin' % spc] = params_nonlin.x[0]
+    flux['se_f%s_nonlin' % spc] = np.sqrt(pcov[0, 0])
+    diag['p0_nonlin_' + spc] = params_nonlin.x[0]
+    diag['p1_nonlin_' + spc] = params_nonlin.x[1]
+    diag['se_p0_nonlin_' + spc] = np.sqrt(pcov[0, 0])
+    diag['se_p1_nonlin_' + spc] = np.sqrt(pcov[1, 1])
+    diag['rmse_nonlin_' + spc] = \
+        np.sqrt(np.nanmean((conc_fitted_nonlin - chc_conc) ** 2))
+    diag['delta_nonlin_' + spc] = conc_fitted_nonlin[-1] - conc_bl[-1] - \
+        (conc_fitted_nonlin[0] - conc_bl[0])
+
+    # baseline end points changed from mean to medians
+    result['conc_bl'] = (conc_bl_chb, conc_bl_cha)
+    result['fitted'] = {'lin': conc_fitted_lin, 'rlin': conc_fitted_rlin,
+                        'nonlin': conc_fitted_nonlin}
+    return result
+
+
+def fit_window(day_data, window):
+    """
+    Calculate the concentrations and fluxes of a chamber window.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings shared by the windows of a day.
+        - 't_conc': sorted times of the concentration data, int64 ns
+        - 'conc_arrays': concentration columns in time order, by species
+        - 'species_list': list of species
+        - 'conc_factor': unit conversion factors of the species
+        - 'species_settings': species settings in the config
+        - 'spc_optmz_id': index of the species for time lag optimization
+    window : dict
+        The chamber window.
+        - 'ch_start', 'ch_o_b', 'ch_cls', 'ch_o_a', 'ch_atm_a', 'ch_end':
+          times of the chamber actions, int64 ns
+        - 'flow': flow rate, mol s^-1
+        - 't_turnover': turnover time of the chamber headspace, s
+        - 'A_ch': chamber area, m^2
+        - 'pres': ambient pressure, Pa
+        - 'timelag': nominal value, upper and lower limits of the time lag
+          in seconds if it is to be optimized; `None` for no time lag
+        - 'save_curves': if True, return the fitted curves
+
+    Returns
+    -------
+    result : dict
+        - 'flux', 'diag': output values by column name, for the flux and
+          the fitting diagnostics tables
+        - 'timelag_ns': the time lag, int64 ns
+        - 'intervals': row slices of the sampling intervals in the
+          concentration data, 'full', 'atmb', 'chb', 'chc', 'cha', 'atma'
+        - 'curves': fitted curves and baselines for plotting, or `None`
+    """
+    t_conc = day_data['t_conc']
+    conc_arrays = day_data['conc_arrays']
+    species_list = day_data['species_list']
+    conc_factor = day_data['conc_factor']
+    ch_start = window['ch_start']
+    ch_o_b = window['ch_o_b']
+    ch_cls = window['ch_cls']
+    ch_o_a = window['ch_o_a']
+    ch_atm_a = window['ch_atm_a']
+    ch_end = window['ch_end']
+    result = {'flux': collections.OrderedDict(),
+              'diag': collections.OrderedDict(), 'curves': None}
+    flux = result['flux']
+
+    # timelag optimization
+    # --------------------
+    # (still in active development & testing)
+    # margins and time lag in int64 nanoseconds
+    dt_lmargin = 0
+    dt_rmargin = 0
+    if window['timelag'] is not None:
+        timelag_nominal, timelag_upper_limit, timelag_lower_limit = \
+            window['timelag']
+        spc_optmz_id = day_data['spc_optmz_id']
+
+        i_optmz_start, i_optmz_end = locate_windows(
+            t_conc, ch_o_b, ch_end + int(round(timelag_upper_limit * 1e9)),
+            closed='neither')
+        ind_optmz = slice(int(i_optmz_start), int(i_optmz_end))
+        time_optmz = (t_conc[ind_optmz] - ch_start) * 1e-9
+        conc_optmz = window_segment(
+            conc_arrays[species_list[spc_optmz_id]], ind_optmz) * \
+            conc_factor[spc_optmz_id]
+
+        dt_open_before = (ch_cls - ch_o_b) * 1e-9
+        dt_close = (ch_o_a - ch_cls) * 1e-9
+        dt_open_after = (ch_end - ch_o_a) * 1e-9
+
+        timelag_optmz_results = optimize_timelag(
+            time_optmz, conc_optmz, window['t_turnover'],
+            dt_open_before, dt_close, dt_open_after,
+            closure_period_only=True,
+            bounds=(timelag_lower_limit, timelag_upper_limit),
+            guess=timelag_nominal)
+        timelag_ns = int(round(timelag_optmz_results[0] * 1e9))
+
+        # the nominal time lag, the optimized time lag, and the status code
+        flux['t_lag_nom'] = timelag_nominal
+        flux['t_lag_optmz'] = timelag_optmz_results[0]
+        flux['status_tlag'] = timelag_optmz_results[1]
+    else:
+        timelag_ns = 0
+    result['timelag_ns'] = timelag_ns
+
+    # extracting indices for sampling intervals
+    # - 'full': the whole sampling interval, only used for plotting
+    # - 'atmb': atmospheric line, before closure
+    # - 'chb': chamber open, before closure
+    # - 'chc': chamber closure
+    # - 'cha': chamber open, after closure
+    # - 'atma': atmospheric line, after closure
+    # note: after the sampling line is switched, regardless of the
+    # time lag, the analyzer will sample the next line.
+    # This is the reason that a time lag is not added to the terminal time.
+    # All intervals are located in one call, as row slices of the time
+    # ordered concentration data; bounds are excluded.
+    lag_start = timelag_ns + dt_lmargin
+    lag_end = timelag_ns - dt_rmargin
+    i_conc_start, i_conc_end = locate_windows(
+        t_conc,
+        [ch_o_b, ch_start + lag_start, ch_o_b + lag_start,
+         ch_cls + lag_start, ch_o_a + lag_start, ch_atm_a + lag_start],
+        [ch_end + timelag_ns, ch_o_b + lag_end, ch_cls + lag_end,
+         ch_o_a + lag_end, ch_atm_a, ch_end],
+        closed='neither')
+    intervals = collections.OrderedDict(
+        (seg_name, slice(int(i), int(j))) for seg_name, i, j in
+        zip(['full', 'atmb', 'chb', 'chc', 'cha', 'atma'],
+            i_conc_start, i_conc_end))
+    result['intervals'] = intervals
+
+    n_ind_chc = intervals['chc'].stop - intervals['chc'].start
+
+    # check if there are enough data points for calculating fluxes
+    # note that concentration data might not be sampled every second.
+    # if this is the case, the criterion needs to be modified
+    if n_ind_chc >= 2. * 60. and window['flow'] > 0.:
+        # needs at least 2 min good data in the closure period to proceed
+        # flow rate value needs to be positive, otherwise the chamber
+        # cannot be flushed by the inlet air
+        flag_calc_flux = 1
+    else:
+        flag_calc_flux = 0
+
+    # average the concentrations
+    # --------------------------
+    for spc_id, spc in enumerate(species_list):
+        for seg_name in ['atmb', 'chb', 'cha', 'atma']:
+            conc_seg = window_segment(conc_arrays[spc], intervals[seg_name])
+            flux['%s_%s' % (spc, seg_name)] = \
+                np.nanmean(conc_seg) * conc_factor[spc_id]
+            flux['sd_%s_%s' % (spc, seg_name)] = \
+                np.nanstd(conc_seg, ddof=1) * conc_factor[spc_id]
+
+        flux['%s_chc_iqr' % spc] = \
+            IQR_func(window_segment(conc_arrays[spc], intervals['chc'])) * \
+            conc_factor[spc_id]
+
+    # if the species 'h2o' exist, calculate chamber dew temperature
+    if 'h2o' in species_list:
+        h2o_frac = flux['h2o_chb'] * \
+            day_data['species_settings']['h2o']['output_unit']
+        if flux['h2o_chb'] > 0 and h2o_frac <= 1.:
+            flux['T_dew_ch'] = dew_temp(h2o_frac * window['pres'])
+
+    # calculate fluxes
+    # ----------------
+    if not flag_calc_flux:
+        return result
+
+    # fitted conc and baselines, for plotting purposes
+    # only need two points to draw a line for each species
+    # - `conc_bl_pts`: before and after closure points that mark the
+    #    zero-flux baseline
+    # - `t_bl_pts`: times for the two points that mark the baseline
+    # - `conc_fitted`: fitted concentrations during closure by method, from
+    #    the simple linear ('lin'), the robust linear ('rlin'), and the
+    #    nonlinear ('nonlin') methods
+    n_species = len(species_list)
+    conc_bl_pts = np.zeros((n_species, 2))
+    t_bl_pts = np.zeros(2)
+    conc_fitted = {method: np.zeros((n_species, n_ind_chc))
+                   for method in ['lin', 'rlin', 'nonlin']}
+
+    for spc_id in range(n_species):
+        spc_result = fit_species(day_data, window, spc_id, intervals,
+                                 dt_lmargin=dt_lmargin)
+        flux.update(spc_result['flux'])
+        result['diag'].update(spc_result['diag'])
+        if spc_result['conc_bl'] is not None:
+            conc_bl_pts[spc_id, :] = spc_result['conc_bl']
+            for method in conc_fitted:
+                conc_fitted[method][spc_id, :] = \
+                    spc_result['fitted'][method]
+        # the baseline times of the last species are used for plotting
+        t_bl_pts[:] = spc_result['t_bl']
+
+    if window['save_curves']:
+        result['curves'] = {'t_bl_pts': t_bl_pts, 'conc_bl_pts': conc_bl_pts,
+                            'conc_fitted': conc_fitted}
+    return result
+
+
+def fit_windows(day_data, windows, n_workers=1, executor='thread'):
+    """
+    Fit the chamber windows of a day in order with the reference engine.
+
+    Parameters
+    ----------
+    day_data : dict
+        Data and settings shared by the windows; see `fit_window()`.
+    windows : list of dict
+        The chamber windows; see `fit_window()`.
+    n_workers, executor
+        Ignored; accepted for the signature of the fitting engines.
+
+    Returns
+    -------
+    results : list of dict
+        Results of the windows in window order; see `fit_window()`.
+    """
+    return [fit_window(day_data, window) for window in windows]
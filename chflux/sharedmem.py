@@ -0,0 +1,246 @@
+"""
+Shared-memory transport of data tables to worker processes
+
+Pickling the loaded data tables to each worker process costs more than the
+flux calculation of a day.  Instead, the column arrays of a table are written
+once to memory-mapped files in a temporary directory, on the memory-backed
+file system `/dev/shm` where available.  Workers receive only small table
+descriptors and the row bounds of their days, and map the columns as
+read-only views without copying.
+
+The temporary directory is removed when the tables are closed, and also when
+the main process exits or an error is raised, so that no shared files are
+left behind if a worker crashes.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import collections
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+
+# data types that are stored in shared files; other columns (e.g., strings)
+# are pickled with the descriptor
+_shared_kinds = 'biufcmM'
+
+
+class TableDescriptor(object):
+    """
+    A picklable description of a shared data table.
+
+    Attributes
+    ----------
+    n_rows : int
+        Number of rows.
+    columns : collections.OrderedDict
+        A mapping of column names to ('file', path, dtype) for columns in
+        shared files, or to ('inline', values) for columns pickled with the
+        descriptor.
+    """
+    __slots__ = ('n_rows', 'columns')
+
+    def __init__(self, n_rows, columns):
+        self.n_rows = n_rows
+        self.columns = columns
+
+    def __getstate__(self):
+        return self.n_rows, self.columns
+
+    def __setstate__(self, state):
+        self.n_rows, self.columns = state
+
+
+def _shared_dir():
+    """Return the parent directory for shared files."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None  # the default temporary directory
+
+
+class SharedTables(object):
+    """
+    Data tables shared with worker processes through memory-mapped files.
+
+    Use as a context manager, or call `close()` when done.
+
+    Parameters
+    ----------
+    base_dir : str, optional
+        Parent directory of the temporary directory.  Default is `/dev/shm`
+        if writable, or the system temporary directory.
+    """
+
+    def __init__(self, base_dir=None):
+        if base_dir is None:
+            base_dir = _shared_dir()
+        self.shared_dir = tempfile.mkdtemp(prefix='chflux-shm-',
+                                           dir=base_dir)
+        # tables shared so far, by identity; a table shared again (e.g., the
+        # biomet table that also holds concentrations) gives the same
+        # descriptor
+        self._tables = {}
+        self._n_tables = 0
+        # remove the files on exit or garbage collection, even on errors
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self.shared_dir, True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def share(self, data):
+        """
+        Write a data table to shared files.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame or mapping
+            The data table, or a mapping of column names to arrays.  `None`
+            is passed through.
+
+        Returns
+        -------
+        descriptor : TableDescriptor
+            Descriptor of the shared table, to be passed to the workers.
+        """
+        if data is None:
+            return None
+        if id(data) in self._tables:
+            return self._tables[id(data)][1]
+
+        table_dir = os.path.join(self.shared_dir, 'table%d' % self._n_tables)
+        os.mkdir(table_dir)
+        self._n_tables += 1
+        n_rows = None
+        columns = collections.OrderedDict()
+        for k, name in enumerate(data.keys()):
+            values = np.asarray(data[name])
+            n_rows = values.shape[0]
+            if values.dtype.kind in _shared_kinds and n_rows > 0:
+                path = os.path.join(table_dir, 'col%d.bin' % k)
+                np.ascontiguousarray(values).tofile(path)
+                columns[name] = ('file', path, values.dtype.str)
+            else:
+                columns[name] = ('inline', values)
+
+        descriptor = TableDescriptor(n_rows or 0, columns)
+        # hold a reference so that the identity is not reused
+        self._tables[id(data)] = (data, descriptor)
+        return descriptor
+
+    def release(self, descriptor):
+        """Remove the shared files of a table no longer used by workers."""
+        for key, (data, desc) in list(self._tables.items()):
+            if desc is descriptor:
+                del self._tables[key]
+        paths = [col[1] for col in descriptor.columns.values()
+                 if col[0] == 'file']
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if len(paths):
+            shutil.rmtree(os.path.dirname(paths[0]), ignore_errors=True)
+
+    def close(self):
+        """Remove all shared files."""
+        self._tables.clear()
+        self._finalizer()
+
+
+def table_bounds(data, t_start, t_end):
+    """
+    Return the row bounds `[i_start, i_end)` of `t_start <= t < t_end` in a
+    data table sorted by its `time_ns` column.  Return `None` for no table.
+    """
+    if data is None:
+        return None
+    time_ns = np.asarray(data['time_ns'])
+    return (int(np.searchsorted(time_ns, t_start, side='left')),
+            int(np.searchsorted(time_ns, t_end, side='left')))
+
+
+def attach_table(descriptor, bounds=None):
+    """
+    Map a shared table in a worker process.
+
+    Parameters
+    ----------
+    descriptor : TableDescriptor
+        Descriptor of the shared table.
+    bounds : tuple of int, optional
+        Row bounds `(i_start, i_end)` to take.  Default is all rows.
+
+    Returns
+    -------
+    table : collections.OrderedDict
+        A mapping of column names to read-only array views.
+    """
+    if bounds is None:
+        bounds = (0, descriptor.n_rows)
+    ind = slice(*bounds)
+    table = collections.OrderedDict()
+    for name, col in descriptor.columns.items():
+        if col[0] == 'file':
+            values = np.memmap(col[1], dtype=np.dtype(col[2]), mode='r',
+                               shape=(descriptor.n_rows,))
+        else:
+            values = col[1]
+        table[name] = values[ind]
+    return table
+
+
+def slice_table(data, bounds=None):
+    """
+    Return the rows `[i_start, i_end)` of a data table, or of a mapping of
+    column names to arrays, without copying the columns.
+    """
+    if data is None or bounds is None:
+        return data
+    ind = slice(*bounds)
+    if hasattr(data, 'iloc'):
+        return data.iloc[ind]
+    return collections.OrderedDict(
+        (name, values[ind]) for name, values in data.items())
+
+
+def attach_tables(tables, bounds=None):
+    """
+    Map shared tables in a worker process.  Tables that are not descriptors
+    are sliced by their row bounds, and descriptors or tables of the same
+    data (aliases) give the same mapping.
+
+    Parameters
+    ----------
+    tables : list
+        Table descriptors, data tables, or `None`.
+    bounds : list, optional
+        Row bounds of each table; see `attach_table()`.
+
+    Returns
+    -------
+    tables : list
+        The mapped tables.
+    """
+    if bounds is None:
+        bounds = [None] * len(tables)
+    attached = []
+    for k, table in enumerate(tables):
+        # an alias of a table mapped already
+        for j in range(k):
+            if table is not None and tables[j] is table:
+                table = attached[j]
+                break
+        else:
+            if isinstance(table, TableDescriptor):
+                table = attach_table(table, bounds[k])
+            else:
+                table = slice_table(table, bounds[k])
+        attached.append(table)
+    return attached
@@ -0,0 +1,393 @@
+"""
+A time-aligned store of the data sources used in flux calculation
+
+Biomet, concentration, and flow rate data are sampled at their own rates.
+The store holds all sources on the common time axis of int64 nanoseconds
+since the epoch, each with its native sampling times, and answers window
+and alignment queries for all sources with binary searches on the sorted
+time axes.  A column registry resolves the sensor variables of a dataset
+schema once, and maps the sensor numbers in the chamber schedules to column
+positions.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import collections
+
+import numpy as np
+
+
+def locate_windows(time, t_start, t_end, closed='left'):
+    """
+    Locate windows in a sorted time axis by binary searches.
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        Sorted time axis, in int64 nanoseconds.
+    t_start, t_end : int or array_like
+        Start and end of the windows.  Arrays locate many windows at once.
+    closed : str, optional
+        Which bounds are included: 'left' (default) for
+        `t_start <= t < t_end`, or 'neither' for `t_start < t < t_end`.
+
+    Returns
+    -------
+    i_start, i_end : int or numpy.ndarray
+        Row positions of the windows, `i_end` exclusive.
+    """
+    side_start = 'left' if closed == 'left' else 'right'
+    i_start = np.searchsorted(time, t_start, side=side_start)
+    i_end = np.searchsorted(time, t_end, side='left')
+    # an empty window if the end precedes the start
+    i_end = np.maximum(i_start, i_end)
+    return i_start, i_end
+
+
+class TimeAlignedStore(object):
+    """
+    A store of data sources on the int64 nanosecond time axis.
+
+    A source is a table with a time column (`pandas.DataFrame`, or a mapping
+    of column names to arrays such as a memory-mapped archive slice).  Rows
+    are kept in time order: a source already sorted by time is stored as
+    views without copying; otherwise a stable sort order is applied to the
+    columns when they are accessed.  A table added under several names
+    (e.g., concentration data stored in the biomet data table) is stored
+    once and shared.
+
+    Parameters
+    ----------
+    time_column : str, optional
+        Name of the time column in the sources.  Default is 'time_ns'.
+    """
+
+    def __init__(self, time_column='time_ns'):
+        self.time_column = time_column
+        self._sources = collections.OrderedDict()
+
+    def add_source(self, name, data):
+        """
+        Add a data source to the store.
+
+        Parameters
+        ----------
+        name : str
+            Name of the source, e.g., 'biomet', 'conc', or 'flow'.
+        data : pandas.DataFrame or mapping
+            The data table, which must have the time column.
+        """
+        for source in self._sources.values():
+            if source['data'] is data:
+                # an alias of a source already in the store
+                self._sources[name] = source
+                return
+
+        if self.time_column not in data:
+            raise RuntimeError('No time variable found in the %s data.' %
+                               name)
+        time = np.asarray(data[self.time_column])
+        if time.size < 2 or np.all(time[1:] >= time[:-1]):
+            order = None
+        else:
+            # a stable sort keeps the file order for identical timestamps
+            order = np.argsort(time, kind='mergesort')
+            time = time[order]
+        self._sources[name] = {'data': data, 'time': time, 'order': order,
+                               'columns': {}, 'blocks': {}}
+
+    def __contains__(self, name):
+        return name in self._sources
+
+    @property
+    def source_names(self):
+        """Names of the sources in the store."""
+        return list(self._sources.keys())
+
+    def column_names(self, name):
+        """Return the column names of a source."""
+        data = self._sources[name]['data']
+        if hasattr(data, 'columns'):
+            return list(data.columns.values)
+        return list(data.keys())
+
+    def has_column(self, name, column):
+        """Return True if the source `name` has the column."""
+        return column in self._sources[name]['data']
+
+    def time(self, name):
+        """Return the sorted time axis of a source."""
+        return self._sources[name]['time']
+
+    def column(self, name, column):
+        """Return a column of a source in time order."""
+        source = self._sources[name]
+        if column not in source['columns']:
+            values = np.asarray(source['data'][column])
+            if source['order'] is not None:
+                values = values[source['order']]
+            source['columns'][column] = values
+        return source['columns'][column]
+
+    def block(self, name, columns):
+        """
+        Return columns of a source as a 2-D double precision array in time
+        order, with one array column per name in `columns`.  The array is
+        in column-major order so that each column is contiguous, and
+        columns are gathered by integer positions in window reductions.
+        """
+        source = self._sources[name]
+        key = tuple(columns)
+        if key not in source['blocks']:
+            values = np.empty((source['time'].size, len(columns)),
+                              dtype=np.float64, order='F')
+            for k, col in enumerate(columns):
+                values[:, k] = self.column(name, col)
+            source['blocks'][key] = values
+        return source['blocks'][key]
+
+    def locate(self, name, t_start, t_end, closed='left'):
+        """
+        Locate windows in the time axis of a source.
+
+        Parameters
+        ----------
+        name : str
+            Name of the source.
+        t_start, t_end : int or array_like
+            Start and end of the windows, in int64 nanoseconds.  Arrays
+            locate many windows at once.
+        closed : str, optional
+            Which bounds are included: 'left' (default) for
+            `t_start <= t < t_end`, or 'neither' for `t_start < t < t_end`.
+
+        Returns
+        -------
+        i_start, i_end : int or numpy.ndarray
+            Row positions of the windows, `i_end` exclusive.
+        """
+        return locate_windows(self._sources[name]['time'], t_start, t_end,
+                              closed=closed)
+
+    def window(self, name, t_start, t_end, closed='left'):
+        """Return the row slice of a window in a source."""
+        i_start, i_end = self.locate(name, t_start, t_end, closed=closed)
+        return slice(int(i_start), int(i_end))
+
+    def segments(self, t_start, t_end, columns, closed='left'):
+        """
+        Extract the segments of a window from several sources in one call.
+
+        Parameters
+        ----------
+        t_start, t_end : int
+            Start and end of the window, in int64 nanoseconds.
+        columns : dict
+            A mapping of source names to lists of column names.
+        closed : str, optional
+            Which bounds are included; see `locate()`.
+
+        Returns
+        -------
+        segments : dict
+            A mapping of source names to dicts of column segments.  The time
+            segment of each source is included under the time column name.
+        """
+        segments = {}
+        for name, cols in columns.items():
+            ind = self.window(name, t_start, t_end, closed=closed)
+            seg = {self.time_column: self.time(name)[ind]}
+            for col in cols:
+                seg[col] = self.column(name, col)[ind]
+            segments[name] = seg
+        return segments
+
+    def window_mean(self, name, columns, ind):
+        """
+        Average the columns of a source over a window, ignoring NaNs.
+
+        Parameters
+        ----------
+        name : str
+            Name of the source.
+        columns : list of str
+            Column names.
+        ind : slice
+            Row slice of the window, e.g., from `window()`.
+
+        Returns
+        -------
+        means : numpy.ndarray
+            Means of the columns in double precision.
+        """
+        return np.array([np.nanmean(self.column(name, col)[ind],
+                                    dtype=np.float64) for col in columns])
+
+    def asof(self, name, t, columns, direction='backward', tolerance=None):
+        """
+        Align the columns of a source to given times.
+
+        Parameters
+        ----------
+        name : str
+            Name of the source.
+        t : int or array_like
+            Times to align to, in int64 nanoseconds.
+        columns : list of str
+            Column names.
+        direction : str, optional
+            'backward' (default) takes the last sample at or before `t`,
+            'forward' the first sample at or after `t`, and 'nearest' the
+            closest sample.
+        tolerance : int, optional
+            Maximum time distance in nanoseconds; samples further away give
+            NaN.  Default is no limit.
+
+        Returns
+        -------
+        aligned : dict
+            A mapping of column names to values aligned to `t`.
+        """
+        time = self._sources[name]['time']
+        t = np.atleast_1d(np.asarray(t, dtype=np.int64))
+        n = time.size
+        if n == 0:
+            return {col: np.full(t.size, np.nan) for col in columns}
+
+        if direction == 'backward':
+            pos = np.searchsorted(time, t, side='right') - 1
+        elif direction == 'forward':
+            pos = np.searchsorted(time, t, side='left')
+        elif direction == 'nearest':
+            right = np.minimum(np.searchsorted(time, t, side='left'), n - 1)
+            left = np.maximum(right - 1, 0)
+            pos = np.where(np.abs(t - time[left]) <= np.abs(time[right] - t),
+                           left, right)
+        else:
+            raise RuntimeError("Allowed values of `direction` are " +
+                               "'backward', 'forward', 'nearest'.")
+
+        # samples out of the time axis, or too far away, give NaN
+        valid = (pos >= 0) & (pos < n)
+        pos = np.clip(pos, 0, n - 1)
+        if tolerance is not None:
+            valid &= np.abs(time[pos] - t) <= tolerance
+
+        aligned = {}
+        for col in columns:
+            out = np.full(t.size, np.nan)
+            out[valid] = self.column(name, col)[pos[valid]]
+            aligned[col] = out
+        return aligned
+
+
+def build_store(df_biomet, df_conc, df_flow):
+    """
+    Build a time-aligned store of the biomet, concentration, and flow data.
+    Aliases among the data tables are stored once.
+    """
+    store = TimeAlignedStore()
+    store.add_source('biomet', df_biomet)
+    store.add_source('conc', df_conc)
+    store.add_source('flow', df_flow)
+    return store
+
+
+class ColumnRegistry(object):
+    """
+    Sensor variables resolved from the column names of a dataset.
+
+    Biomet variables are recognized by substrings of their names, e.g.,
+    'T_ch_1' is a chamber temperature, and flow rates by 'flow_ch'.  The
+    names are scanned once per schema, and the sensor numbers `TC_no`,
+    `PAR_no`, and `flowmeter_no` in the chamber schedules are mapped to
+    integer positions in the name lists.
+
+    Parameters
+    ----------
+    biomet_columns : list of str
+        Column names of the biomet data.
+    flow_columns : list of str
+        Column names of the flow rate data.
+    """
+
+    def __init__(self, biomet_columns, flow_columns):
+        biomet_columns = list(biomet_columns)
+        self.T_atm_names = [s for s in biomet_columns if 'T_atm' in s]
+        self.RH_atm_names = [s for s in biomet_columns if 'RH_atm' in s]
+        self.T_ch_names = [s for s in biomet_columns if 'T_ch' in s]
+        self.PAR_names = [s for s in biomet_columns
+                          if 'PAR' in s and 'PAR_ch' not in s]
+        self.PAR_ch_names = [s for s in biomet_columns if 'PAR_ch' in s]
+        self.T_leaf_names = [s for s in biomet_columns if 'T_leaf' in s]
+        self.T_soil_names = [s for s in biomet_columns if 'T_soil' in s]
+        self.w_soil_names = [s for s in biomet_columns if 'w_soil' in s]
+        self.flow_ch_names = [s for s in flow_columns if 'flow_ch' in s]
+
+        # all biomet variables in the output, in the order of output columns
+        self.biomet_var_list = \
+            self.T_atm_names + self.RH_atm_names + self.T_ch_names + \
+            ['T_dew_ch'] + self.T_leaf_names + self.T_soil_names + \
+            self.w_soil_names + self.PAR_names + self.PAR_ch_names
+        # dew temperature is calculated from water measurements, not averaged
+        self.biomet_avg_list = list(self.biomet_var_list)
+        self.biomet_avg_list.remove('T_dew_ch')
+
+        self._sensor_positions = {}
+
+    def sensor_positions(self, TC_no, PAR_no, flowmeter_no):
+        """
+        Map the sensor numbers of a chamber to positions in `T_ch_names`,
+        `PAR_ch_names`, and `flow_ch_names`.  A sensor not found is -1.
+        """
+        key = (int(TC_no), int(PAR_no), int(flowmeter_no))
+        if key not in self._sensor_positions:
+            # sensor numbers count from 1
+            i_T_ch = key[0] - 1 if 0 < key[0] <= len(self.T_ch_names) else -1
+            i_PAR_ch = \
+                key[1] - 1 if 0 < key[1] <= len(self.PAR_ch_names) else -1
+            # the flow meter is the first flow variable labeled by its number
+            flow_loc = [k for k, s in enumerate(self.flow_ch_names)
+                        if 'ch_%d' % key[2] in s]
+            i_flow_ch = flow_loc[0] if len(flow_loc) > 0 else -1
+            self._sensor_positions[key] = (i_T_ch, i_PAR_ch, i_flow_ch)
+        return self._sensor_positions[key]
+
+    def chamber_positions(self, df_chlut):
+        """
+        Map the sensor numbers of all chamber windows in a schedule table.
+
+        Parameters
+        ----------
+        df_chlut : pandas.DataFrame
+            The expanded chamber schedule, with the columns 'TC_no',
+            'PAR_no', and 'flowmeter_no'.
+
+        Returns
+        -------
+        positions : dict
+            Integer arrays 'T_ch', 'PAR_ch', and 'flow_ch' of the positions
+            of each window's sensors in the name lists; -1 if not found.
+        """
+        positions = np.array(
+            [self.sensor_positions(*sensors) for sensors in
+             zip(df_chlut['TC_no'].values, df_chlut['PAR_no'].values,
+                 df_chlut['flowmeter_no'].values)],
+            dtype=np.int64).reshape(-1, 3)
+        return {'T_ch': positions[:, 0], 'PAR_ch': positions[:, 1],
+                'flow_ch': positions[:, 2]}
+
+
+# registries of the dataset schemas seen in this process, reused across days
+_column_registries = {}
+
+
+def get_column_registry(biomet_columns, flow_columns):
+    """
+    Return the column registry of the biomet and flow rate data.  A registry
+    is created once per schema (the column names of both tables) and reused.
+    """
+    key = (tuple(biomet_columns), tuple(flow_columns))
+    if key not in _column_registries:
+        _column_registries[key] = ColumnRegistry(*key)
+    return _column_registries[key]
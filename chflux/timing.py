@@ -0,0 +1,255 @@
+"""
+Per-stage timing and profiling of a run
+
+The processing stages (file discovery, parsing, schedule expansion,
+averaging, time lag optimization, curve fitting by method, quality control,
+output writing, and plotting) are timed with a process-wide run timer,
+which also keeps counters such as the number of chamber windows and fit
+iterations.  The overhead is one clock reading at the start and the end of
+a stage.  Stages may be nested; the time of a stage includes the time of the
+stages within it, and stages run by several threads add up the time of all
+threads.
+
+Worker processes time their own stages and hand their timer snapshots back
+to the main process, which merges them into a JSON run report along with
+the peak resident memory.  Optionally, chosen stages are profiled with
+`cProfile` to `.prof` files.
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import collections
+import cProfile
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import timeit
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb(children=False):
+    """
+    Return the peak resident memory in MB of this process, or of its
+    terminated child processes (the largest one).  `None` if unknown.
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return maxrss / 1048576.
+    return maxrss / 1024.
+
+
+class RunTimer(object):
+    """
+    Timer of the processing stages of a run.
+
+    Parameters
+    ----------
+    profile_stages : list of str, optional
+        Stages to profile with `cProfile`.  'all' for all stages.
+    profile_dir : str, optional
+        Directory of the profile files, one `<stage>.prof` per stage.
+    """
+
+    def __init__(self, profile_stages=None, profile_dir=None):
+        self.profile_stages = profile_stages or []
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        # stage name: [seconds, calls]
+        self._stages = collections.OrderedDict()
+        self._counters = collections.OrderedDict()
+        self._profiles = {}
+        # one profiler may be active in a thread at a time
+        self._local = threading.local()
+
+    def _profiled(self, name):
+        return (self.profile_stages == 'all' or
+                name in self.profile_stages) and \
+            not getattr(self._local, 'profiling', False)
+
+    def start(self, name):
+        """
+        Start timing a stage of the run, for a block of code that is not
+        easily wrapped in `stage()`.  Return a token to pass to `stop()`.
+        """
+        profiler = None
+        if self.profile_stages and self._profiled(name):
+            with self._lock:
+                profiler = self._profiles.setdefault(name, cProfile.Profile())
+            self._local.profiling = True
+            profiler.enable()
+        return name, profiler, timeit.default_timer()
+
+    def stop(self, token):
+        """Stop timing a stage started by `start()`."""
+        name, profiler, t_start = token
+        elapsed = timeit.default_timer() - t_start
+        if profiler is not None:
+            profiler.disable()
+            self._local.profiling = False
+        self.add_time(name, elapsed)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage of the run, as a context manager."""
+        token = self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(token)
+
+    def add_time(self, name, seconds, calls=1):
+        """Add the time and the number of calls of a stage."""
+        with self._lock:
+            entry = self._stages.setdefault(name, [0., 0])
+            entry[0] += seconds
+            entry[1] += calls
+
+    def count(self, name, n=1):
+        """Add to a counter, e.g., the number of chamber windows."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self, reset=False):
+        """
+        Return the stage times and the counters as a picklable dict, to be
+        merged into the timer of the main process.
+        """
+        with self._lock:
+            snapshot = {
+                'stages': collections.OrderedDict(
+                    (name, list(entry))
+                    for name, entry in self._stages.items()),
+                'counters': collections.OrderedDict(self._counters),
+                'peak_rss_mb': peak_rss_mb()}
+            if reset:
+                self._stages.clear()
+                self._counters.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Merge a snapshot of the timer of a worker process."""
+        if snapshot is None:
+            return
+        for name, (seconds, calls) in snapshot['stages'].items():
+            self.add_time(name, seconds, calls)
+        for name, n in snapshot['counters'].items():
+            self.count(name, n)
+        rss = snapshot.get('peak_rss_mb')
+        if rss is not None:
+            self.count('_worker_peak_rss_mb', 0)
+            with self._lock:
+                self._counters['_worker_peak_rss_mb'] = max(
+                    self._counters['_worker_peak_rss_mb'], rss)
+
+    def dump_profiles(self):
+        """Write the profiles of the profiled stages to files."""
+        if not self._profiles or self.profile_dir is None:
+            return []
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir, exist_ok=True)
+        # worker processes write their own files
+        suffix = '' if os.getpid() == _main_pid else '_%d' % os.getpid()
+        paths = []
+        with self._lock:
+            for name, profiler in self._profiles.items():
+                path = os.path.join(self.profile_dir,
+                                    '%s%s.prof' % (name, suffix))
+                profiler.dump_stats(path)
+                paths.append(path)
+        return paths
+
+    def report(self, **info):
+        """
+        Return the run report as a dict.
+
+        Parameters
+        ----------
+        **info
+            Other entries of the report, e.g., the config file and the
+            elapsed time.
+        """
+        snapshot = self.snapshot()
+        counters = snapshot['counters']
+        report = collections.OrderedDict(info)
+        report['stages'] = collections.OrderedDict(
+            (name, {'seconds': round(seconds, 6), 'calls': calls})
+            for name, (seconds, calls) in sorted(
+                snapshot['stages'].items(), key=lambda kv: -kv[1][0]))
+        report['counters'] = collections.OrderedDict(
+            (name, n) for name, n in counters.items()
+            if not name.startswith('_'))
+        report['peak_rss_mb'] = {
+            'main': snapshot['peak_rss_mb'],
+            'workers': counters.get('_worker_peak_rss_mb'),
+            'children': peak_rss_mb(children=True)}
+        return report
+
+    def write_report(self, path, **info):
+        """Write the run report to a JSON file; see `report()`."""
+        with open(path, 'w') as f:
+            json.dump(self.report(**info), f, indent=2)
+        return path
+
+    def summary(self, n_stages=None):
+        """Return a printable table of the stage times."""
+        stages = sorted(self.snapshot()['stages'].items(),
+                        key=lambda kv: -kv[1][0])
+        if n_stages is not None:
+            stages = stages[:n_stages]
+        lines = ['%-20s %12s %10s' % ('stage', 'seconds', 'calls')]
+        for name, (seconds, calls) in stages:
+            lines.append('%-20s %12.3f %10d' % (name, seconds, calls))
+        return '\n'.join(lines)
+
+
+# run timer of this process
+_main_pid = os.getpid()
+_run_timer = {'pid': None, 'timer': None}
+_run_timer_lock = threading.Lock()
+
+
+def get_run_timer():
+    """
+    Return the run timer of this process.  A forked child process starts a
+    new timer with the profiling settings of its parent.
+    """
+    with _run_timer_lock:
+        if _run_timer['pid'] != os.getpid():
+            parent = _run_timer['timer']
+            if parent is not None:
+                timer = RunTimer(parent.profile_stages, parent.profile_dir)
+            else:
+                timer = RunTimer()
+            _run_timer['timer'] = timer
+            _run_timer['pid'] = os.getpid()
+        return _run_timer['timer']
+
+
+def set_run_timer(profile_stages=None, profile_dir=None):
+    """Start a new run timer of this process, with profiling settings."""
+    with _run_timer_lock:
+        _run_timer['timer'] = RunTimer(profile_stages, profile_dir)
+        _run_timer['pid'] = os.getpid()
+        return _run_timer['timer']
+
+
+def timed(name):
+    """Decorate a function to time its calls as a stage of the run."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_run_timer().stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,207 @@
+"""
+Program for rendering curve fitting plots from saved fitting curves
+
+The flux calculation program saves the inputs of the curve fitting plots of
+each day with the option `save_fitting_curves`.  This program renders the
+plots of chosen days, chambers, or sampling periods on demand, in parallel.
+With `--overview`, it renders multi-day overview plots of the fluxes in the
+columnar output store (option `output_store`) instead.
+
+Examples::
+
+    python chflux_plot.py -c user_config.yaml -s 2017-12-01 -e 2017-12-02
+    python chflux_plot.py ./output/curves/ --chamber 1,LC2 -n 4
+    python chflux_plot.py -c user_config.yaml --overview \
+        -s 2017-06-01 -e 2017-09-30 --period W-MON -n 4
+
+(c) 2016-2017 Wu Sun <wu.sun@ucla.edu>
+
+"""
+import os
+import glob
+import datetime
+import argparse
+
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from chflux.default_config import default_config
+from chflux.helpers import convert_unit_names
+from chflux.iotools import load_config
+from chflux.overview import render_flux_overviews
+from chflux.plotting import PlotRenderer, fitting_plot_filename, \
+    load_fitting_curves
+
+
+# Command-line argument parser
+# =============================================================================
+parser = argparse.ArgumentParser(
+    description='PyChamberFlux: Render curve fitting plots from saved ' +
+    'fitting curves.')
+parser.add_argument('curves', nargs='*',
+                    help='fitting curve files or directories; default is ' +
+                    'the subfolder `curves` in the output directory')
+parser.add_argument('-c', '--config', dest='config',
+                    action='store', help='set the config file')
+parser.add_argument('-s', '--start', dest='start', action='store',
+                    help='first date or time to plot, e.g., 2017-12-01 ' +
+                    'or "2017-12-01 06:00"')
+parser.add_argument('-e', '--end', dest='end', action='store',
+                    help='last date to plot (inclusive), or end time ' +
+                    '(exclusive), e.g., "2017-12-01 18:00"')
+parser.add_argument('--chamber', dest='chamber', action='store',
+                    help='chamber numbers or labels to plot, separated ' +
+                    'by commas, e.g., 1,3,LC2')
+parser.add_argument('-n', '--workers', dest='n_workers', action='store',
+                    type=int, default=1,
+                    help='number of rendering processes (default: 1)')
+parser.add_argument('-o', '--plot-dir', dest='plot_dir', action='store',
+                    help='directory for the plots; default is `plot_dir` ' +
+                    'in the config')
+parser.add_argument('--overview', dest='overview', action='store_true',
+                    help='render overview plots of the fluxes in the ' +
+                    'output store')
+parser.add_argument('--store', dest='store', action='store',
+                    help='directory of the output store for overview ' +
+                    'plots; default is `output_store` in the config')
+parser.add_argument('--period', dest='period', action='store',
+                    help='period of each overview plot as a pandas ' +
+                    'frequency, e.g., MS (months) or W-MON (weeks); ' +
+                    'default is one plot of the range')
+parser.add_argument('--method', dest='method', action='store',
+                    default='nonlin',
+                    help='fitting method of the fluxes in overview plots: ' +
+                    'lin, rlin, or nonlin (default)')
+
+
+def parse_end_time(end):
+    """Parse the end of the range; a date alone includes the whole day."""
+    if end is None:
+        return None
+    ts_end = pd.Timestamp(end)
+    if ':' not in end and ts_end == ts_end.normalize():
+        ts_end += pd.Timedelta(days=1)
+    return ts_end
+
+
+def find_curve_files(paths):
+    """Return the sorted fitting curve files in the given paths."""
+    flist = []
+    for path in paths:
+        if os.path.isdir(path):
+            flist += sorted(glob.glob(os.path.join(path, '*.npz')))
+        else:
+            flist += sorted(glob.glob(path))
+    return flist
+
+
+def echo_ending(dt_start):
+    dt_end = datetime.datetime.now()
+    print('\n%s' % datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
+    print('Done. Finished in %.2f seconds.' %
+          (dt_end - dt_start).total_seconds())
+
+
+def plot_overview(args, config, plot_dir, dt_start):
+    """Render overview plots of the fluxes in the output store."""
+    store_dir = args.store
+    if store_dir is None:
+        store_dir = config['data_dir']['output_store']
+    if store_dir is None:
+        raise RuntimeError('No output store is set for overview plots.')
+    if args.start is None or args.end is None:
+        raise RuntimeError('Set the date range of overview plots with ' +
+                           '`-s` and `-e`.')
+
+    # species and flux units for the axis labels
+    species_settings = config['species_settings']
+    species_list = species_settings['species_list']
+    __, flux_unit_names = convert_unit_names(
+        [species_settings[s]['output_unit'] for s in species_list])
+    ylabels = ['$F$' + species_settings['species_names'][j] +
+               ' (%s)' % flux_unit_names[j] for j in range(len(species_list))]
+
+    overview_dir = plot_dir + '/overview/'
+    if not os.path.exists(overview_dir):
+        os.makedirs(overview_dir)
+    paths = render_flux_overviews(
+        store_dir, overview_dir + 'flux_overview_%Y%m%d.png',
+        pd.Timestamp(args.start), parse_end_time(args.end),
+        freq=args.period, n_workers=args.n_workers,
+        species_list=species_list, method=args.method, ylabels=ylabels)
+    paths = [path for path in paths if path is not None]
+
+    print('%d overview plots rendered to %s' % (len(paths), overview_dir))
+    echo_ending(dt_start)
+    return 0
+
+
+def main():
+    args = parser.parse_args()
+
+    print('Starting plot rendering...')
+    dt_start = datetime.datetime.now()
+    print(datetime.datetime.strftime(dt_start, '%Y-%m-%d %X'))
+
+    # Load config files
+    # =========================================================================
+    config = default_config
+    if args.config is not None:
+        user_config = load_config(args.config)
+        for key in config:
+            if key in user_config:
+                config[key].update(user_config[key])
+    run_options = config['run_options']
+
+    # customize matplotlib plotting style
+    if run_options['plot_style'] is not None:
+        plt.style.use(run_options['plot_style'])
+
+    plot_dir = args.plot_dir
+    if plot_dir is None:
+        plot_dir = config['data_dir']['plot_dir']
+    if args.overview:
+        return plot_overview(args, config, plot_dir, dt_start)
+    curve_paths = args.curves
+    if not len(curve_paths):
+        curve_paths = [config['data_dir']['output_dir'] + '/curves']
+    curve_flist = find_curve_files(curve_paths)
+    if not len(curve_flist):
+        raise RuntimeError('No fitting curve file is found.')
+
+    ts_start = pd.Timestamp(args.start) if args.start is not None else None
+    ts_end = parse_end_time(args.end)
+    chambers = args.chamber.split(',') if args.chamber is not None else None
+
+    # Render the plots of the selected windows
+    # =========================================================================
+    renderer = PlotRenderer(n_workers=args.n_workers,
+                            max_pending=run_options['max_pending_plots'],
+                            plot_style=run_options['plot_style'])
+    n_plots = 0
+    try:
+        for curve_fname in curve_flist:
+            for plot_inputs in load_fitting_curves(
+                    curve_fname, ch_no=chambers, start=ts_start, end=ts_end):
+                fitting_plots_path = plot_dir + '/fitting/%s/' % \
+                    pd.Timestamp(plot_inputs['ch_start']).strftime('%Y%m%d')
+                if not os.path.exists(fitting_plots_path):
+                    os.makedirs(fitting_plots_path)
+                plot_inputs['path'] = fitting_plots_path + \
+                    fitting_plot_filename(plot_inputs['ch_start'])
+                renderer.submit(plot_inputs)
+                n_plots += 1
+    finally:
+        renderer.close()
+
+    # Echo program ending
+    # =========================================================================
+    print('%d plots rendered from %d fitting curve files to %s' %
+          (n_plots, len(curve_flist), plot_dir))
+    echo_ending(dt_start)
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
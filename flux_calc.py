@@ -5,26 +5,39 @@ Main program for flux calculation
 
 """
 import os
-import glob
-import copy
 import datetime
+import platform
 import argparse
 import warnings
+import collections
+import multiprocessing
+import concurrent.futures
 import yaml
 from distutils.version import LooseVersion
 
 import numpy as np
+import scipy
 import pandas as pd
-from scipy import stats, optimize
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib import ticker
 
 from chflux.common import *
 from chflux.default_config import default_config
-from chflux.datetools import extract_date_substr
+from chflux.datetools import extract_date_substr, filter_dates
 from chflux.iotools import *
 from chflux.helpers import *
+from chflux.io.archive import open_archive
+from chflux.io.fluxdb import write_day
+from chflux.io.fluxstore import replace_day
+from chflux.io.readers import search_data_files
+from chflux.io.writers import write_table
+from chflux.fitting import get_fit_engine, close_fit_pool
+from chflux.plotting import fitting_plot_inputs, fitting_plot_filename, \
+    get_plot_renderer, close_plot_renderer, save_fitting_curves
+from chflux.sharedmem import SharedTables, attach_tables, table_bounds
+from chflux.store import build_store, get_column_registry
+from chflux.timing import get_run_timer, set_run_timer
 
 
 # Command-line argument parser
@@ -33,8 +46,10 @@ parser = argparse.ArgumentParser(
     description='PyChamberFlux: Main program for flux calculation.')
 parser.add_argument('-c', '--config', dest='config',
                     action='store', help='set the config file')
-
-args = parser.parse_args()
+parser.add_argument('-s', '--start', dest='date_start', action='store',
+                    help='first date to process, e.g., 2017-12-01')
+parser.add_argument('-e', '--end', dest='date_end', action='store',
+                    help='last date to process (inclusive), e.g., 2018-02-28')
 
 
 # Global settings (not from the config file)
@@ -55,28 +70,29 @@ for msg in warnings_to_ignore:
 
 
 def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
-              doy, year, config, chamber_config):
+              ts_start, year_ref, config, chamber_config):
     """
     Calculate fluxes and generate plots.
 
     Parameters
     ----------
-    df_biomet : pandas.DataFrame
-        The biometeorological data.
-    df_conc : pandas.DataFrame
-        The concentration data.
-    df_flow : pandas.DataFrame
+    df_biomet : pandas.DataFrame or dict
+        The biometeorological data.  Can also be a mapping of column names to
+        arrays, such as a table shared with worker processes.
+    df_conc : pandas.DataFrame or dict
+        The concentration data.  Can also be a mapping of column names to
+        arrays, such as a time slice of a memory-mapped archive.
+    df_flow : pandas.DataFrame or dict
 
     df_leaf : pandas.DataFrame
 
     df_timelag : pandas.DataFrame
 
-    doy : float
-        Day of year number of the current function call. Note that `doy`
-        here is the fractional DOY, always smaller than the integer DOY
-        (Julian day number).
-    year : int
-        Current year in four digits.
+    ts_start : pandas.Timestamp
+        Start of the day to process (midnight).
+    year_ref : int
+        Reference year in four digits, to which the chamber schedules given
+        in day of year numbers are referenced.
     config : dict
         Configuration dictionary parsed from the YAML config file.
     chamber_config : dict
@@ -94,6 +110,8 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     data_dir = config['data_dir']
     site_parameters = config['site_parameters']
     species_settings = config['species_settings']
+    # stage times and counters of the run in this process
+    timer = get_run_timer()
 
     # extract species settings
     # ------------------------
@@ -116,8 +134,7 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # ------------------
     output_dir = data_dir['output_dir']
     # a date string for current run; used in echo and in output file names
-    run_date_str = (datetime.datetime(year, 1, 1) +
-                    datetime.timedelta(doy + 0.5)).strftime('%Y%m%d')
+    run_date_str = ts_start.strftime('%Y%m%d')
     # create directories for curve-fitting plots
     if run_options['save_fitting_plots']:
         fitting_plots_path = data_dir['plot_dir'] + \
@@ -132,67 +149,37 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
 
     # Determine chamber schedule of the day
     # =========================================================================
-    timer = 0.
-    df_chlut = pd.DataFrame(columns=[])
-    while timer < 1.:
-        chlut_current = chamber_lookup_table_func(doy + timer, chamber_config)
-        df_chlut_current = chlut_current.df
-        df_chlut_current['ch_start'] += doy + timer
-        smpl_cycle_len = chlut_current.smpl_cycle_len
-        schedule_end = chlut_current.schedule_end
-
-        df_chlut = df_chlut.append(df_chlut_current, ignore_index=True)
-        timer += smpl_cycle_len
-        if doy + timer > schedule_end:
-            # if the schedule is switched
-            df_chlut = df_chlut[df_chlut['ch_start'] < schedule_end]
-            # apply the switched schedule
-            chlut_current = \
-                chamber_lookup_table_func(doy + timer, chamber_config)
-            df_chlut_current = chlut_current.df
-            smpl_cycle_len = chlut_current.smpl_cycle_len
-            schedule_start = chlut_current.schedule_start
-            schedule_end = chlut_current.schedule_end
-            timer = np.floor(timer / smpl_cycle_len - 1) * smpl_cycle_len
-            df_chlut_current['ch_start'] += doy + timer
-            # remove duplicate segment
-            df_chlut_current = df_chlut_current[
-                df_chlut_current['ch_start'] > schedule_start]
-
-            df_chlut = df_chlut.append(df_chlut_current, ignore_index=True)
-            df_chlut = df_chlut.reset_index()
-            timer += smpl_cycle_len
-
-    df_chlut = df_chlut[df_chlut['ch_start'] < doy + 1.]
+    # internal times are int64 nanoseconds since the epoch; day of year
+    # values are computed only for output
+    day_start = ts_start.value
+    day_end = (ts_start + pd.Timedelta(days=1)).value
+    year_start = pd.Timestamp('%d-01-01' % ts_start.year).value
+    with timer.stage('schedule'):
+        df_chlut = expand_chamber_schedule(day_start, day_end, chamber_config,
+                                           year_ref)
     # note: 'ch_no' in `df_chlut` are the nominal chamber numbers
     # it may need to be updated with the actual chamber numbers, if such
     # variable is recorded in the biomet data table
 
     n_smpl_per_day = df_chlut.shape[0]
+    timer.count('days')
+    timer.count('windows', n_smpl_per_day)
 
-    # unpack time variables
+    # time-aligned store of the data sources
     # =========================================================================
-    # @TODO: switch from day of year based subsetting to timestamp subsetting?
-    if 'time_doy' in df_biomet.columns.values:
-        doy_biomet = df_biomet['time_doy'].values
-    else:
-        raise RuntimeError('No time variable found in the biomet data.')
-
-    if 'time_doy' in df_conc.columns.values:
-        doy_conc = df_conc['time_doy'].values
-    else:
-        raise RuntimeError(
-            'No time variable found in the concentration data.')
+    # all sources are kept in time order on the int64 nanosecond time axis,
+    # and windows are located by binary searches; an alias of a data table
+    # (e.g., concentration data in the biomet table) is stored only once
+    store = build_store(df_biomet, df_conc, df_flow)
+    t_conc = store.time('conc')
 
-    if 'time_doy' in df_flow.columns.values:
-        doy_flow = df_flow['time_doy'].values
-    else:
-        raise RuntimeError(
-            'No time variable found in the flow rate data.')
+    # concentration columns as arrays; these are views on the loaded data (or
+    # on the memory-mapped archive), and only window segments are copied
+    conc_arrays = {spc: store.column('conc', spc) for spc in species_list}
 
     if data_dir['separate_leaf_data']:
-        if 'time_doy' in df_leaf.columns.values:
-            doy_leaf = df_leaf['time_doy'].values
+        if 'time_ns' in df_leaf.columns.values:
+            t_leaf = df_leaf['time_ns'].values
         else:
             raise RuntimeError(
                 'No time variable found in the leaf area data.')
@@ -242,7 +229,7 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # - 'T_inst': gas analyzer instrument temperature
     # - 'T_dew_ch': dew temperature in the chamber (for detecting condensation)
 
-    # biomet variable name lists
+    # biomet variable name lists, resolved by the column registry
     # - `T_atm_names`: T_atm variable names
     # - `RH_atm_names`: RH_atm variable names
     # - `T_ch_names`: T_ch variable names
@@ -252,21 +239,14 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # - `T_soil_names`: T_soil variable names
     # - `w_soil_names`: w_soil variable names
     # - `flow_ch_names`: flow_ch variable names
-    T_atm_names = [s for s in df_biomet.columns.values if 'T_atm' in s]
-    RH_atm_names = [s for s in df_biomet.columns.values if 'RH_atm' in s]
-    T_ch_names = [s for s in df_biomet.columns.values if 'T_ch' in s]
-    PAR_names = [s for s in df_biomet.columns.values
-                 if 'PAR' in s and 'PAR_ch' not in s]
-    PAR_ch_names = [s for s in df_biomet.columns.values if 'PAR_ch' in s]
-    T_leaf_names = [s for s in df_biomet.columns.values if 'T_leaf' in s]
-    T_soil_names = [s for s in df_biomet.columns.values if 'T_soil' in s]
-    w_soil_names = [s for s in df_biomet.columns.values if 'w_soil' in s]
-    flow_ch_names = [s for s in df_flow.columns.values if 'flow_ch' in s]
+    # the names are resolved once per dataset schema by the column registry
+    registry = get_column_registry(store.column_names('biomet'),
+                                   store.column_names('flow'))
+    T_ch_names = registry.T_ch_names
+    flow_ch_names = registry.flow_ch_names
 
     # a list of all biomet variable names to be stored
-    biomet_var_list = \
-        T_atm_names + RH_atm_names + T_ch_names + ['T_dew_ch'] + \
-        T_leaf_names + T_soil_names + w_soil_names + PAR_names + PAR_ch_names
+    biomet_var_list = registry.biomet_var_list
 
     header = create_output_header('flux', species_list, biomet_var_list)
     # create output dataframe for concentrations, fluxes and biomet variables
@@ -338,7 +318,7 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # helper variables (not saved to files)
     # =========================================================================
     # times for chamber control actions (e.g., opening and closing)
-    # in day of year
+    # in int64 nanoseconds since the epoch
     # - 'ch_o_b': chamber open before closure
     # - 'ch_cls': chamber closing
     # - 'ch_o_a': chamber re-open after closure
@@ -352,7 +332,9 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     ch_o_a = df_chlut['ch_start'].values + df_chlut['ch_o_a'].values
     ch_atm_a = df_chlut['ch_start'].values + df_chlut['ch_atm_a'].values
     ch_end = df_chlut['ch_start'].values + df_chlut['ch_end'].values
-    ch_time = 0.5 * (ch_cls + ch_o_a)
+    ch_time = ch_cls + (ch_o_a - ch_cls) // 2
+    # day of year of `ch_time`, for output only
+    ch_time_doy = (ch_time - year_start) / 86400e9
 
     # flow calculation
     # - 'flow': flow rate in standard liter per minute
@@ -363,40 +345,51 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # insert time variables
     # =========================================================================
     if config['biomet_data_settings']['time_in_UTC']:
-        df_flux['doy_utc'] = ch_time
-        df_flux['doy_local'] = ch_time + site_parameters['time_zone'] / 24.
+        df_flux['doy_utc'] = ch_time_doy
+        df_flux['doy_local'] = \
+            ch_time_doy + site_parameters['time_zone'] / 24.
     else:
-        df_flux['doy_local'] = ch_time
-        df_flux['doy_utc'] = ch_time - site_parameters['time_zone'] / 24.
+        df_flux['doy_local'] = ch_time_doy
+        df_flux['doy_utc'] = ch_time_doy - site_parameters['time_zone'] / 24.
 
     # time variables are the same for fitting diagnostics data frame
     df_diag[['doy_utc', 'doy_local']] = df_flux[['doy_utc', 'doy_local']]
 
     # calculate averages of biomet variables
     # =========================================================================
+    # biomet and flow windows over the full chamber period, no time lag
+    # needed; all windows of the day are located at once
+    stage_averaging = timer.start('averaging')
+    i_biomet_start, i_biomet_end = store.locate('biomet', ch_start, ch_end)
+    i_flow_start, i_flow_end = store.locate('flow', ch_start, ch_end)
+
+    # biomet sensors are averaged as one block of columns
+    # note: dew temperature is calculated from water measurements
+    biomet_avg_list = registry.biomet_avg_list
+    biomet_block = store.block('biomet', biomet_avg_list)
+
     for loop_num in range(n_smpl_per_day):
         # correct leaf area if supplied by external data
         if (data_dir['separate_leaf_data'] and df_leaf is not None and
                 df_chlut.loc[loop_num, 'is_leaf_chamber']):
             df_flux.set_value(
                 loop_num, 'A_ch',
-                np.interp(ch_time[loop_num], doy_leaf,
+                np.interp(ch_time[loop_num], t_leaf,
                           df_leaf[df_chlut.loc[loop_num, 'ch_label']].values))
 
-        # extract indices for averaging biomet variables, no time lag needed
-        # over the full chamber period
-        ind_ch_biomet = np.where(
-            (doy_biomet >= ch_start[loop_num]) &
-            (doy_biomet < ch_end[loop_num]))[0]
-        n_ind_ch_biomet = ind_ch_biomet.size
+        # extract indices for averaging biomet variables
+        ind_ch_biomet = slice(i_biomet_start[loop_num],
+                              i_biomet_end[loop_num])
+        n_ind_ch_biomet = i_biomet_end[loop_num] - i_biomet_start[loop_num]
 
         # variables from biomet data table
         if n_ind_ch_biomet > 0:
             # ambient pressure in Pascal
-            if 'pres' in df_biomet.columns.values:
+            if store.has_column('biomet', 'pres'):
                 df_flux.set_value(
                     loop_num, 'pres',
-                    np.nanmean(df_biomet.loc[ind_ch_biomet, 'pres'].values))
+                    np.nanmean(store.column('biomet', 'pres')[ind_ch_biomet],
+                               dtype=np.float64))
             else:
                 if site_parameters['site_pressure'] is None:
                     # use standard atm pressure if no site pressure is defined
@@ -407,606 +400,152 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
                         loop_num, 'pres', site_parameters['site_pressure'])
 
             # datalogger panel temp (optional)
-            if 'T_log' in df_biomet.columns.values:
+            if store.has_column('biomet', 'T_log'):
                 df_flux.set_value(
                     loop_num, 'T_log',
-                    np.nanmean(df_biomet.loc[ind_ch_biomet, 'T_log'].values))
+                    np.nanmean(store.column('biomet', 'T_log')[ind_ch_biomet],
+                               dtype=np.float64))
 
             # instrument temperature (optional)
-            if 'T_inst' in df_biomet.columns.values:
+            if store.has_column('biomet', 'T_inst'):
                 df_flux.set_value(
                     loop_num, 'T_inst',
-                    np.nanmean(df_biomet.loc[ind_ch_biomet, 'T_inst'].values))
+                    np.nanmean(
+                        store.column('biomet', 'T_inst')[ind_ch_biomet],
+                        dtype=np.float64))
 
             # biomet sensors
-            # note: dew temperature is calculated from water measurements
-            biomet_avg_list = copy.copy(biomet_var_list)
-            biomet_avg_list.remove('T_dew_ch')
             if len(biomet_avg_list) > 0:
                 df_flux.set_value(
                     loop_num, biomet_avg_list,
-                    np.nanmean(df_biomet.loc[ind_ch_biomet,
-                                             biomet_avg_list].values,
-                               axis=0))
+                    np.nanmean(biomet_block[ind_ch_biomet], axis=0))
 
     # calculate averages of flow rates
     # =========================================================================
+    # sensor numbers of the chambers mapped to positions in the name lists
+    sensor_pos = registry.chamber_positions(df_chlut)
+    if np.any(sensor_pos['T_ch'] < 0):
+        raise RuntimeError('Chamber temperature sensors (TC_no) are not ' +
+                           'found in the biomet data.')
+    # chamber temperature of each window, gathered by sensor positions
+    T_ch_window = df_flux[T_ch_names].values[
+        np.arange(n_smpl_per_day), sensor_pos['T_ch']]
+    flow_block = store.block('flow', flow_ch_names)
+
     for loop_num in range(n_smpl_per_day):
-        # get sensor numbers to search in the biomet data table
-        TC_no = df_chlut.loc[loop_num, 'TC_no']
-        PAR_no = df_chlut.loc[loop_num, 'PAR_no']
-        flowmeter_no = df_chlut.loc[loop_num, 'flowmeter_no']
-
-        # extract indices for averaging flow rates, no time lag
-        # over the full chamber period
-        ind_ch_flow = np.where(
-            (doy_flow >= ch_start[loop_num]) &
-            (doy_flow < ch_end[loop_num]))[0]
-        n_ind_ch_flow = ind_ch_flow.size
+        # extract indices for averaging flow rates
+        ind_ch_flow = slice(i_flow_start[loop_num], i_flow_end[loop_num])
 
         # flow rate is only needed for the chamber currently being measured
-        if len(flow_ch_names) > 0:
-            # find the column location to extract the flow rate of the current
-            # chamber
-            flow_loc = [k for k, s in enumerate(flow_ch_names)
-                        if 'ch_%d' % flowmeter_no in s]
-            if len(flow_loc) > 0:
-                # a temporary variable
-                flow_lpm = np.nanmean(
-                    df_flow.loc[ind_ch_flow,
-                                flow_ch_names[flow_loc[0]]].values)
-                # convert standard liter per minute to liter per minute, if
-                # applicable
-                if config['flow_data_settings']['flow_rate_in_STP']:
-                    flow_lpm *= \
-                        (1. + df_flux.loc[loop_num, T_ch_names[TC_no - 1]] /
-                            phys_const['T_0']) * \
-                        phys_const['p_std'] / df_flux.loc[loop_num, 'pres']
-
-                df_flux.set_value(loop_num, 'flow_lpm', flow_lpm)
-                del flow_lpm
+        i_flow_ch = sensor_pos['flow_ch'][loop_num]
+        if i_flow_ch >= 0:
+            # a temporary variable
+            flow_lpm = np.nanmean(flow_block[ind_ch_flow, i_flow_ch])
+            # convert standard liter per minute to liter per minute, if
+            # applicable
+            if config['flow_data_settings']['flow_rate_in_STP']:
+                flow_lpm *= \
+                    (1. + T_ch_window[loop_num] / phys_const['T_0']) * \
+                    phys_const['p_std'] / df_flux.loc[loop_num, 'pres']
+
+            df_flux.set_value(loop_num, 'flow_lpm', flow_lpm)
+            del flow_lpm
 
         # convert volumetric flow to mass flow (mol s^-1)
         flow[loop_num] = df_flux.loc[loop_num, 'flow_lpm'] * 1e-3 / 60. * \
             df_flux.loc[loop_num, 'pres'] / phys_const['R_gas'] / \
-            (df_flux.loc[loop_num, T_ch_names[TC_no - 1]] + phys_const['T_0'])
+            (T_ch_window[loop_num] + phys_const['T_0'])
 
         # convert chamber volume to mol
         V_ch_mol[loop_num] = df_flux.loc[loop_num, 'V_ch'] * \
             df_flux.loc[loop_num, 'pres'] / phys_const['R_gas'] / \
-            (df_flux.loc[loop_num, T_ch_names[TC_no - 1]] + phys_const['T_0'])
+            (T_ch_window[loop_num] + phys_const['T_0'])
 
         # turnover time in seconds, useful in flux calculation
         df_flux.set_value(loop_num, 't_turnover',
                           V_ch_mol[loop_num] / flow[loop_num])
+    timer.stop(stage_averaging)
 
     # calculate fluxes and generate fitting plots
     # =========================================================================
+    # each chamber window is a pure fitting task on the concentration data of
+    # the day; the tasks may run on a pool, and results are in window order
+    fit_day_data = {'t_conc': t_conc, 'conc_arrays': conc_arrays,
+                    'species_list': species_list, 'conc_factor': conc_factor,
+                    'species_settings': species_settings,
+                    'spc_optmz_id': spc_optmz_id,
+                    'n_species_threads': run_options['n_species_threads']}
+    windows = []
     for loop_num in range(n_smpl_per_day):
-        # timelag optimization
-        # --------------------
-        # (still in active development & testing)
-        dt_lmargin = 0.
-        dt_rmargin = 0.
-        t_turnover = df_flux.loc[loop_num, 't_turnover']  # temporary variable
+        # time lag parameters: nominal value, upper and lower limits
         if (df_chlut.loc[loop_num, 'optimize_timelag'] and
                 run_options['timelag_method'] == 'optimized'):
-            # temporary variables
-            timelag_nominal = \
-                df_chlut.loc[loop_num, 'timelag_nominal'] * 86400.
-            timelag_upper_limit = \
-                df_chlut.loc[loop_num, 'timelag_upper_limit'] * 86400.
-            timelag_lower_limit = \
-                df_chlut.loc[loop_num, 'timelag_lower_limit'] * 86400.
-
-            ind_optmz = np.where(
-                (doy_conc > ch_o_b[loop_num]) &
-                (doy_conc < ch_end[loop_num] +
-                    timelag_upper_limit / 86400.))[0]
-            time_optmz = (doy_conc[ind_optmz] -
-                          ch_start[loop_num]) * 86400.
-            conc_optmz = \
-                df_conc.loc[ind_optmz, species_list[spc_optmz_id]].values * \
-                conc_factor[spc_optmz_id]
-
-            dt_open_before = (ch_cls[loop_num] - ch_o_b[loop_num]) * 86400.
-            dt_close = (ch_o_a[loop_num] - ch_cls[loop_num]) * 86400.
-            dt_open_after = (ch_end[loop_num] - ch_o_a[loop_num]) * 86400.
-
-            timelag_optmz_results = optimize_timelag(
-                time_optmz, conc_optmz, t_turnover,
-                dt_open_before, dt_close, dt_open_after,
-                closure_period_only=True,
-                bounds=(timelag_lower_limit, timelag_upper_limit),
-                guess=timelag_nominal)
-            timelag_in_day = timelag_optmz_results[0] / 86400.  # in day
-
-            # save the nominal time lag
-            df_flux.set_value(loop_num, 't_lag_nom', timelag_nominal)
-
-            # save the optimized time lag value and the status code
-            df_flux.set_value(loop_num, ['t_lag_optmz', 'status_tlag'],
-                              timelag_optmz_results)
+            timelag_params = (
+                df_chlut.loc[loop_num, 'timelag_nominal'],
+                df_chlut.loc[loop_num, 'timelag_upper_limit'],
+                df_chlut.loc[loop_num, 'timelag_lower_limit'])
         elif (run_options['timelag_method'] == 'prescribed' and
               df_timelag is not None):
             df_timelag_subset = \
-                df_timelag.loc[df_timelag['ch_no'] == ch_no[loop_num], :]
-
-            # temporary variables
-            timelag_nominal = np.interp(
-                ch_start[loop_num],
-                df_timelag_subset['time_doy'].values,
-                df_timelag_subset['timelag_nom'].values)
-            timelag_upper_limit = np.interp(
-                ch_start[loop_num],
-                df_timelag_subset['time_doy'].values,
-                df_timelag_subset['timelag_uplim'].values)
-            timelag_lower_limit = np.interp(
-                ch_start[loop_num],
-                df_timelag_subset['time_doy'].values,
-                df_timelag_subset['timelag_lolim'].values)
-
-            ind_optmz = np.where(
-                (doy_conc > ch_o_b[loop_num]) &
-                (doy_conc < ch_end[loop_num] +
-                    timelag_upper_limit / 86400.))[0]
-            time_optmz = (doy_conc[ind_optmz] -
-                          ch_start[loop_num]) * 86400.
-            conc_optmz = \
-                df_conc.loc[ind_optmz, species_list[spc_optmz_id]].values * \
-                conc_factor[spc_optmz_id]
-
-            dt_open_before = (ch_cls[loop_num] - ch_o_b[loop_num]) * 86400.
-            dt_close = (ch_o_a[loop_num] - ch_cls[loop_num]) * 86400.
-            dt_open_after = (ch_end[loop_num] - ch_o_a[loop_num]) * 86400.
-
-            timelag_optmz_results = optimize_timelag(
-                time_optmz, conc_optmz, t_turnover,
-                dt_open_before, dt_close, dt_open_after,
-                closure_period_only=True,
-                bounds=(timelag_lower_limit, timelag_upper_limit),
-                guess=timelag_nominal)
-            timelag_in_day = timelag_optmz_results[0] / 86400.  # in day
-
-            # save the nominal time lag
-            df_flux.set_value(loop_num, 't_lag_nom', timelag_nominal)
-
-            # save the optimized time lag value and the status code
-            df_flux.set_value(loop_num, ['t_lag_optmz', 'status_tlag'],
-                              timelag_optmz_results)
+                df_timelag.loc[df_timelag['ch_no'] ==
+                               df_chlut.loc[loop_num, 'ch_no'], :]
+            timelag_params = tuple(
+                np.interp(ch_start[loop_num],
+                          df_timelag_subset['time_ns'].values,
+                          df_timelag_subset[s].values)
+                for s in ['timelag_nom', 'timelag_uplim', 'timelag_lolim'])
         else:
-            timelag_in_day = 0.
-
-        # extracting indices for sampling intervals
-        # 'ind_ch_full' index is only used for plotting
-        ind_ch_full = np.where((doy_conc > ch_o_b[loop_num]) &
-                               (doy_conc < ch_end[loop_num] +
-                                timelag_in_day))[0]
-        ind_atmb = np.where(
-            (doy_conc > ch_start[loop_num] +
-                timelag_in_day + dt_lmargin) &
-            (doy_conc < ch_o_b[loop_num] + timelag_in_day - dt_rmargin))[0]
-        ind_chb = np.where(
-            (doy_conc > ch_o_b[loop_num] + timelag_in_day + dt_lmargin) &
-            (doy_conc < ch_cls[loop_num] + timelag_in_day - dt_rmargin))[0]
-        ind_chc = np.where(
-            (doy_conc > ch_cls[loop_num] + timelag_in_day + dt_lmargin) &
-            (doy_conc < ch_o_a[loop_num] + timelag_in_day - dt_rmargin))[0]
-        # note: after the sampling line is switched, regardless of the
-        # time lag, the analyzer will sample the next line.
-        # This is the reason that a time lag is not added to the terminal time.
-        ind_cha = np.where(
-            (doy_conc > ch_o_a[loop_num] + timelag_in_day + dt_lmargin) &
-            (doy_conc < ch_atm_a[loop_num]))[0]
-        ind_atma = np.where(
-            (doy_conc > ch_atm_a[loop_num] + timelag_in_day + dt_lmargin) &
-            (doy_conc < ch_end[loop_num]))[0]
-
-        n_ind_chc = ind_chc.size
-
-        # check if there are enough data points for calculating fluxes
-        # note that concentration data might not be sampled every second.
-        # if this is the case, the criterion needs to be modified
-        # `flag_calc_flux`: 0 - don't calculate fluxes; 1 - calculate fluxes
-        if n_ind_chc >= 2. * 60. and flow[loop_num] > 0.:
-            # needs at least 2 min good data in the closure period to proceed
-            # flow rate value needs to be positive, otherwise the chamber
-            # cannot be flushed by the inlet air
-            flag_calc_flux = 1
-        else:
-            flag_calc_flux = 0
-
-        # average the concentrations
-        # --------------------------
-        for spc_id, spc in enumerate(species_list):
-            df_flux.set_value(
-                loop_num, '%s_atmb' % spc,
-                np.nanmean(df_conc.loc[ind_atmb, spc].values) *
-                conc_factor[spc_id])
-            df_flux.set_value(
-                loop_num, 'sd_%s_atmb' % spc,
-                np.nanstd(df_conc.loc[ind_atmb, spc].values, ddof=1) *
-                conc_factor[spc_id])
-
-            df_flux.set_value(
-                loop_num, '%s_chb' % spc,
-                np.nanmean(df_conc.loc[ind_chb, spc].values) *
-                conc_factor[spc_id])
-            df_flux.set_value(
-                loop_num, 'sd_%s_chb' % spc,
-                np.nanstd(df_conc.loc[ind_chb, spc].values, ddof=1) *
-                conc_factor[spc_id])
-
-            df_flux.set_value(
-                loop_num, '%s_cha' % spc,
-                np.nanmean(df_conc.loc[ind_cha, spc].values) *
-                conc_factor[spc_id])
-            df_flux.set_value(
-                loop_num, 'sd_%s_cha' % spc,
-                np.nanstd(df_conc.loc[ind_cha, spc].values, ddof=1) *
-                conc_factor[spc_id])
-
-            df_flux.set_value(
-                loop_num, '%s_atma' % spc,
-                np.nanmean(df_conc.loc[ind_atma, spc].values) *
-                conc_factor[spc_id])
-            df_flux.set_value(
-                loop_num, 'sd_%s_atma' % spc,
-                np.nanstd(df_conc.loc[ind_atma, spc].values, ddof=1) *
-                conc_factor[spc_id])
-
-            df_flux.set_value(
-                loop_num, '%s_chc_iqr' % spc,
-                IQR_func(df_conc.loc[ind_chc, spc].values) *
-                conc_factor[spc_id])
-
-        # if the species 'h2o' exist, calculate chamber dew temperature
-        if (df_flux.loc[loop_num, 'h2o_chb'] > 0 and
-            df_flux.loc[loop_num, 'h2o_chb'] *
-                species_settings['h2o']['output_unit'] <= 1.):
-            df_flux.set_value(
-                loop_num, 'T_dew_ch',
-                dew_temp(df_flux.loc[loop_num, 'h2o_chb'] *
-                         species_settings['h2o']['output_unit'] *
-                         df_flux.loc[loop_num, 'pres']))
-
-        # calculate fluxes
-        # ----------------
-        if flag_calc_flux:
-            # fitted conc and baselines; save them for plotting purposes
-            # only need two points to draw a line for each species
-            # - `conc_bl_pts`: before and after closure points that mark the
-            #    zero-flux baseline
-            # - `t_bl_pts`: times for the two points that mark the baseline
-            # - `conc_bl`: fitted baselines
-            # - `conc_fitted_lin`: fitted concentrations during closure,
-            #    from the simple linear method
-            # - `conc_fitted_rlin`: fitted concentrations during closure,
-            #    from the robust linear method
-            # - `conc_fitted_nonlin`: fitted concentrations during closure,
-            #    from the nonlinear method
-            conc_bl_pts = np.zeros((n_species, 2))
-            t_bl_pts = np.zeros(2)
-
-            conc_bl = np.zeros((n_species, n_ind_chc))
-            conc_fitted_lin = np.zeros((n_species, n_ind_chc))
-            conc_fitted_rlin = np.zeros((n_species, n_ind_chc))
-            conc_fitted_nonlin = np.zeros((n_species, n_ind_chc))
-
-            # loop through each species
-            for spc_id, spc in enumerate(species_list):
-                # extract closure segments and convert the DOY to seconds
-                # after 'ch_start' time for fitting plots
-                # - `ch_full_time`: the whole sampling interval
-                # - `atmb_time`: atmospheric line, before closure
-                # - `chb_time`: chamber open, before closure
-                # - `chc_time`: chamber closure
-                # - `cha_time`: chamber open, after closure
-                # - `atma_time`: atmospheric line, after closure
-                ch_full_time = (doy_conc[ind_ch_full] -
-                                ch_start[loop_num]) * 86400.
-                chb_time = (doy_conc[ind_chb] -
-                            ch_start[loop_num]) * 86400.
-                atmb_time = (doy_conc[ind_atmb] -
-                             ch_start[loop_num]) * 86400.
-                chc_time = (doy_conc[ind_chc] -
-                            ch_start[loop_num]) * 86400.
-                cha_time = (doy_conc[ind_cha] -
-                            ch_start[loop_num]) * 86400.
-                atma_time = (doy_conc[ind_atma] -
-                             ch_start[loop_num]) * 86400.
-
-                # conc of current species defined with 'spc_id'
-                chc_conc = df_conc.loc[ind_chc, spc].values * \
-                    conc_factor[spc_id]
-
-                # calculate slopes and intercepts of the zero-flux baselines
-                # baseline end points changed from mean to medians (05/05/2016)
-                # - `t_bl_chb`: median or mean time for chamber open period
-                #   (before closure), in seconds
-                # - `t_bl_cha`: median or mean time for chamber open period
-                #   (after closure), in seconds
-                if (species_settings[spc]['baseline_correction']
-                        in ['mean', 'average']):
-                    bl_calc_func = np.nanmean
-                else:
-                    bl_calc_func = np.nanmedian
-
-                t_bl_chb = bl_calc_func(
-                    doy_conc[ind_chb] - ch_start[loop_num]) * \
-                    86400.
-                t_bl_cha = bl_calc_func(
-                    doy_conc[ind_cha] - ch_start[loop_num]) * \
-                    86400.
-                conc_bl_chb = bl_calc_func(
-                    df_conc.loc[ind_chb, spc].values) * \
-                    conc_factor[spc_id]
-
-                if (species_settings[spc]['baseline_correction']
-                        in ['none', 'None', None]):
-                    conc_bl_cha = conc_bl_chb
-                else:
-                    conc_bl_cha = bl_calc_func(
-                        df_conc.loc[ind_cha, spc].values) * \
-                        conc_factor[spc_id]
-                    # if `conc_bl_cha` is not a finite value, set it equal to
-                    # `conc_bl_chb`. Thus `k_bl` will be zero.
-                    if np.isnan(conc_bl_cha):
-                        conc_bl_cha = conc_bl_chb
-                        t_bl_cha = chc_time[-1]
-
-                k_bl = (conc_bl_cha - conc_bl_chb) / \
-                    (t_bl_cha - t_bl_chb)
-                b_bl = conc_bl_chb - k_bl * t_bl_chb
-
-                # subtract the baseline to correct for instrument drift
-                # (assuming linear drift)
-                conc_bl = k_bl * chc_time + b_bl
-
-                # linear fit
-                # -------------------------------------------------------------
-                # see the supp. info of Sun et al. (2016) JGR-Biogeosci.
-                y_fit = (chc_conc - conc_bl) * flow[loop_num] / \
-                    df_flux.loc[loop_num, 'A_ch']
-                x_fit = np.exp(- (chc_time - chc_time[0] +
-                                  dt_lmargin * 8.64e4) /
-                               df_flux.loc[loop_num, 't_turnover'])
-
-                # boolean index array for finite concentration values
-                ind_conc_fit = np.isfinite(y_fit)
-
-                # number of valid observations
-                df_flux.set_value(loop_num, 'n_obs_%s' % spc,
-                                  np.sum(ind_conc_fit))
-
-                # if no finite concentration values, skip the current step
-                if np.sum(ind_conc_fit) == 0:
-                    continue
-
-                slope, intercept, r_value, p_value, se_slope = \
-                    stats.linregress(x_fit[ind_conc_fit], y_fit[ind_conc_fit])
-
-                # save the fitted conc values
-                conc_fitted_lin[spc_id, :] = (slope * x_fit + intercept) * \
-                    df_flux.loc[loop_num, 'A_ch'] / flow[loop_num] + conc_bl
-
-                # save the linear fit results and diagnostics
-                df_flux.set_value(loop_num, 'f%s_lin' % spc, -slope)
-                df_flux.set_value(loop_num, 'se_f%s_lin' % spc,
-                                  np.abs(se_slope))
-                df_diag.set_value(loop_num, 'k_lin_' + spc, slope)
-                df_diag.set_value(loop_num, 'b_lin_' + spc, intercept)
-                df_diag.set_value(loop_num, 'r_lin_' + spc, r_value)
-                df_diag.set_value(loop_num, 'p_lin_' + spc, p_value)
-                df_diag.set_value(
-                    loop_num, 'rmse_lin_' + spc,
-                    np.sqrt(np.nanmean(
-                        (conc_fitted_lin[spc_id, :] - chc_conc) ** 2)))
-                df_diag.set_value(
-                    loop_num, 'delta_lin_' + spc,
-                    conc_fitted_lin[spc_id, -1] - conc_bl[-1] -
-                    (conc_fitted_lin[spc_id, 0] - conc_bl[0]))
-
-                # clear temporary fitting parameters
-                del slope, intercept, r_value, p_value, se_slope
-
-                # robust linear fit
-                # @TODO: replace Theil-Sen estimator with RANSAC method??
-                # the original algorithm of Theil-Sen method uses numpy.sort()
-                # and is thus time consuming
-                # -------------------------------------------------------------
-                medslope, medintercept, lo_slope, up_slope = \
-                    stats.theilslopes(y_fit, x_fit, alpha=0.95)
-
-                # save the fitted conc values
-                conc_fitted_rlin[spc_id, :] = \
-                    (medslope * x_fit + medintercept) * \
-                    df_flux.loc[loop_num, 'A_ch'] / flow[loop_num] + conc_bl
-
-                # save the robust linear fit results and diagnostics
-                df_flux.set_value(loop_num, 'f%s_rlin' % spc, -medslope)
-                df_flux.set_value(loop_num, 'se_f%s_rlin' % spc,
-                                  np.abs(up_slope - lo_slope) / 3.92)
-                # note: 0.95 C.I. is equivalent to +/- 1.96 sigma
-                df_diag.set_value(loop_num, 'k_rlin_' + spc, medslope)
-                df_diag.set_value(loop_num, 'b_rlin_' + spc, medintercept)
-                df_diag.set_value(loop_num, 'k_lolim_rlin_' + spc, lo_slope)
-                df_diag.set_value(loop_num, 'k_uplim_rlin_' + spc, up_slope)
-                df_diag.set_value(
-                    loop_num, 'rmse_rlin_' + spc,
-                    np.sqrt(np.nanmean(
-                        (conc_fitted_rlin[spc_id, :] - chc_conc) ** 2)))
-                df_diag.set_value(
-                    loop_num, 'delta_rlin_' + spc,
-                    conc_fitted_rlin[spc_id, -1] - conc_bl[-1] -
-                    (conc_fitted_rlin[spc_id, 0] - conc_bl[0]))
-
-                # clear temporary fitted parameters
-                del medslope, medintercept, lo_slope, up_slope
-
-                # nonlinear fit
-                # -------------------------------------------------------------
-                t_fit = (chc_time - chc_time[0] + dt_lmargin * 8.64e4) / \
-                    df_flux.loc[loop_num, 't_turnover']
-                params_nonlin_guess = \
-                    [-df_flux.loc[loop_num, 'f%s_lin' % spc], 0.]
-                params_nonlin = optimize.least_squares(
-                    resid_conc_func, params_nonlin_guess,
-                    bounds=(
-                        [-np.inf, -10. / df_flux.loc[loop_num, 't_turnover']],
-                        [np.inf, 10. / df_flux.loc[loop_num, 't_turnover']]),
-                    loss='soft_l1', f_scale=0.5,
-                    args=(t_fit[ind_conc_fit], y_fit[ind_conc_fit]))
-
-                # save the fitted conc values
-                conc_fitted_nonlin[spc_id, :] = \
-                    conc_func(params_nonlin.x, t_fit) * \
-                    df_flux.loc[loop_num, 'A_ch'] / flow[loop_num] + conc_bl
-
-                # standard errors of estimated parameters
-                # `J^T J` is a Gauss-Newton approximation of the negative of
-                # the Hessian of the cost function.
-                # The variance-covariance matrix of the parameter estimates is
-                # the inverse of the negative of Hessian matrix evaluated
-                # at the parameter estimates.
-                neg_hess = np.dot(params_nonlin.jac.T, params_nonlin.jac)
-                # debug print: check if the hessian is positive definite
-                # print(np.all(np.linalg.eigvals(neg_hess) > 0))
-                try:
-                    inv_neg_hess = np.linalg.inv(neg_hess)
-                except np.linalg.LinAlgError:
-                    try:
-                        inv_neg_hess = np.linalg.pinv(neg_hess)
-                    except np.linalg.LinAlgError:
-                        inv_neg_hess = neg_hess * np.nan
-                # variance-covariance matrix of parameter estimates
-                MSE = np.nansum(params_nonlin.fun ** 2) / (t_fit.size - 2)
-                pcov = inv_neg_hess * MSE
-                # save the nonlinear fit results and diagnostics
-                df_flux.set_value(loop_num, 'f%s_nonlin' % spc,
-                                  params_nonlin.x[0])
-                df_flux.set_value(loop_num, 'se_f%s_nonlin' % spc,
-                                  np.sqrt(pcov[0, 0]))
-                df_diag.set_value(loop_num, 'p0_nonlin_' + spc,
-                                  params_nonlin.x[0])
-                df_diag.set_value(loop_num, 'p1_nonlin_' + spc,
-                                  params_nonlin.x[1])
-                df_diag.set_value(loop_num, 'se_p0_nonlin_' + spc,
-                                  np.sqrt(pcov[0, 0]))
-                df_diag.set_value(loop_num, 'se_p1_nonlin_' + spc,
-                                  np.sqrt(pcov[1, 1]))
-                df_diag.set_value(
-                    loop_num, 'rmse_nonlin_' + spc,
-                    np.sqrt(np.nanmean(
-                        (conc_fitted_nonlin[spc_id, :] - chc_conc) ** 2)))
-                df_diag.set_value(
-                    loop_num, 'delta_nonlin_' + spc,
-                    conc_fitted_nonlin[spc_id, -1] - conc_bl[-1] -
-                    (conc_fitted_nonlin[spc_id, 0] - conc_bl[0]))
-
-                # clear temporary fitted parameters
-                del params_nonlin_guess, params_nonlin, neg_hess, \
-                    inv_neg_hess, MSE, pcov
-
-                # save the baseline conc's
-                # baseline end points changed from mean to medians
-                conc_bl_pts[spc_id, :] = conc_bl_chb, conc_bl_cha
-
-            # used for plotting the baseline
-            t_bl_pts[:] = t_bl_chb, t_bl_cha
-
-            # generate fitting plots
-            # -----------------------------------------------------------------
-            if flag_calc_flux and run_options['save_fitting_plots']:
-                fig, axes = plt.subplots(nrows=n_species, sharex=True,
-                                         figsize=(8, 3 * n_species))
-
-                for i, s in enumerate(species_list):
-                    # color different time segments
-                    axes[i].plot(
-                        ch_full_time,
-                        df_conc[s].values[ind_ch_full] * conc_factor[i], 'k.')
-                    axes[i].plot(
-                        atmb_time,
-                        df_conc[s].values[ind_atmb] * conc_factor[i], '.-',
-                        color='#0571b0')
-                    axes[i].plot(
-                        chb_time,
-                        df_conc[s].values[ind_chb] * conc_factor[i], '.-',
-                        color='#ca0020')
-                    axes[i].plot(
-                        chc_time,
-                        df_conc[s].values[ind_chc] * conc_factor[i], '.-',
-                        color='#33a02c')
-                    axes[i].plot(
-                        cha_time,
-                        df_conc[s].values[ind_cha] * conc_factor[i], '.-',
-                        color='#ca0020')
-                    axes[i].plot(
-                        atma_time,
-                        df_conc[s].values[ind_atma] * conc_factor[i], '.-',
-                        color='#0571b0')
-                    # draw baselines
-                    axes[i].plot(t_bl_pts, conc_bl_pts[i, :],
-                                 'x--', c='gray', linewidth=1.5,
-                                 markeredgewidth=1.25)
-                    # draw timelag lines
-                    axes[i].axvline(x=timelag_in_day * 86400.,
-                                    linestyle='dashed', c='k')
-                    # draw fitted lines
-                    axes[i].plot(chc_time, conc_fitted_lin[i, :], '-',
-                                 c='k', lw=1.5, label='linear')
-                    axes[i].plot(chc_time, conc_fitted_rlin[i, :], '--',
-                                 c='firebrick', lw=2, label='robust linear')
-                    axes[i].plot(chc_time, conc_fitted_nonlin[i, :], '-.',
-                                 c='darkblue', lw=2, label='nonlinear')
-                    # axis settings
-                    axes[i].set_ylabel(species_settings['species_names'][i] +
-                                       ' (%s)' % conc_unit_names[i])
-                    # title setting
-                    # for the top panel, add an additional linebreak before it
-                    axes[i].set_title(
-                        (i == 0) * '\n' +
-                        'flux: %.3f (linear), ' %
-                        df_flux.loc[loop_num, 'f%s_lin' % s] +
-                        '%.3f (robust linear), ' %
-                        df_flux.loc[loop_num, 'f%s_rlin' % s] +
-                        '%.3f (nonlinear)' %
-                        df_flux.loc[loop_num, 'f%s_nonlin' % s])
-
-                # set the common x axis
-                t_min = np.floor(
-                    np.nanmin(np.append(atmb_time, ch_full_time)) /
-                    60. - 0.5) * 60.
-                t_max = np.ceil(np.nanmax(ch_full_time) / 60. + 0.5) * 60.
-                axes[-1].set_xlim([t_min, t_max])
-                axes[-1].set_xticks(np.arange(t_min, t_max + 60., 60.))
-                axes[-1].set_xlabel('Time (s)')
-
-                # figure legend
-                fig.legend(axes[0].lines[-3:],
-                           ['linear', 'robust linear', 'nonlinear'],
-                           loc='upper right', ncol=3, fontsize=12,
-                           handlelength=3,
-                           frameon=False, framealpha=0.5)
-
-                # figure annotation
-                plt.annotate(df_flux.loc[loop_num, 'ch_label'],
-                             xy=(0.025, 0.985), xycoords='figure fraction',
-                             ha='left', va='top', fontsize=12)
-
-                fig.tight_layout()
-
-                run_datetime_str = datetime.datetime.strftime(
-                    datetime.timedelta(ch_start[loop_num]) +
-                    datetime.datetime(year, 1, 1), '%Y%m%d_%H%M')
-
-                plt.savefig(fitting_plots_path +
-                            'chfit_%s.png' % run_datetime_str)
-
-                # important! release the memory after figure is saved
-                fig.clf()
-                plt.close()
+            timelag_params = None
+
+        windows.append({
+            'ch_start': ch_start[loop_num], 'ch_o_b': ch_o_b[loop_num],
+            'ch_cls': ch_cls[loop_num], 'ch_o_a': ch_o_a[loop_num],
+            'ch_atm_a': ch_atm_a[loop_num], 'ch_end': ch_end[loop_num],
+            'flow': flow[loop_num],
+            't_turnover': df_flux.loc[loop_num, 't_turnover'],
+            'A_ch': df_flux.loc[loop_num, 'A_ch'],
+            'pres': df_flux.loc[loop_num, 'pres'],
+            'timelag': timelag_params,
+            'save_curves': (run_options['save_fitting_plots'] or
+                            run_options['save_fitting_curves'])})
+
+    with timer.stage('fitting'):
+        fit_results = get_fit_engine(run_options['fit_engine'])(
+            fit_day_data, windows, n_workers=run_options['n_fit_workers'],
+            executor=run_options['fit_executor'])
+    if run_options['save_fitting_plots']:
+        plot_renderer = get_plot_renderer(
+            n_workers=run_options['n_plot_workers'],
+            max_pending=run_options['max_pending_plots'],
+            plot_style=run_options['plot_style'])
+    # plot inputs of the windows, saved for rendering later
+    day_curves = []
+
+    for loop_num, fit_res in enumerate(fit_results):
+        for key, value in fit_res['flux'].items():
+            df_flux.set_value(loop_num, key, value)
+        for key, value in fit_res['diag'].items():
+            df_diag.set_value(loop_num, key, value)
+
+        # queue the fitting plots, rendered off the flux calculation, and
+        # keep the plot inputs to be saved
+        # ---------------------------------------------------------------------
+        if fit_res['curves'] is not None:
+            with timer.stage('plotting'):
+                fluxes = [[df_flux.loc[loop_num, 'f%s_%s' % (s, method)]
+                           for method in ['lin', 'rlin', 'nonlin']]
+                          for s in species_list]
+                plot_inputs = fitting_plot_inputs(
+                    fit_day_data, windows[loop_num], fit_res, fluxes,
+                    df_flux.loc[loop_num, 'ch_no'],
+                    df_flux.loc[loop_num, 'ch_label'],
+                    species_settings['species_names'], conc_unit_names)
+                if run_options['save_fitting_plots']:
+                    plot_inputs['path'] = fitting_plots_path + \
+                        fitting_plot_filename(ch_start[loop_num])
+                    plot_renderer.submit(plot_inputs)
+                if run_options['save_fitting_curves']:
+                    day_curves.append(plot_inputs)
 
     # End of loops. Save data and plots.
 
@@ -1016,21 +555,48 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     # 1 - if outlier exists in the flux values from three fitting methods
     # 0 - if no outlier exists
     # Note: the flagging system is at its best suggestive, not categorical
-    for spc_id, spc in enumerate(species_list):
-        arr_flag_test = np.hstack((
-            df_flux.loc[:, 'f%s_lin' % spc].values.reshape(-1, 1),
-            df_flux.loc[:, 'f%s_rlin' % spc].values.reshape(-1, 1),
-            df_flux.loc[:, 'f%s_nonlin' % spc].values.reshape(-1, 1)))
-        for k in range(n_smpl_per_day):
-            try:
-                dixon_test_res = dixon_test(arr_flag_test[k, :])
-            except ValueError:
-                df_flux.set_value(k, 'qc_' + spc, 0)
-            else:
-                if dixon_test_res == [None, None]:
+    with timer.stage('qc'):
+        for spc_id, spc in enumerate(species_list):
+            arr_flag_test = np.hstack((
+                df_flux.loc[:, 'f%s_lin' % spc].values.reshape(-1, 1),
+                df_flux.loc[:, 'f%s_rlin' % spc].values.reshape(-1, 1),
+                df_flux.loc[:, 'f%s_nonlin' % spc].values.reshape(-1, 1)))
+            for k in range(n_smpl_per_day):
+                try:
+                    dixon_test_res = dixon_test(arr_flag_test[k, :])
+                except ValueError:
                     df_flux.set_value(k, 'qc_' + spc, 0)
                 else:
-                    df_flux.set_value(k, 'qc_' + spc, 1)
+                    if dixon_test_res == [None, None]:
+                        df_flux.set_value(k, 'qc_' + spc, 0)
+                    else:
+                        df_flux.set_value(k, 'qc_' + spc, 1)
+
+    # write to the columnar output store, replacing the rows of a
+    # reprocessed day
+    # =========================================================================
+    if data_dir['output_store'] is not None:
+        with timer.stage('output'):
+            replace_day(data_dir['output_store'], 'flux', df_flux, ts_start)
+            if run_options['save_fitting_diagnostics']:
+                replace_day(data_dir['output_store'], 'diag', df_diag,
+                            ts_start)
+        print('Output rows saved to the store %s' % data_dir['output_store'])
+
+    # write to the flux database, replacing the rows of a reprocessed day
+    # =========================================================================
+    if data_dir['output_database'] is not None:
+        if config['biomet_data_settings']['time_in_UTC']:
+            ch_time_utc = ch_time
+        else:
+            ch_time_utc = ch_time - int(
+                round(site_parameters['time_zone'] * 3600e9))
+        with timer.stage('output'):
+            write_day(data_dir['output_database'], ts_start, ch_time_utc,
+                      df_flux, df_diag if
+                      run_options['save_fitting_diagnostics'] else None)
+        print('Output rows saved to the database %s' %
+              data_dir['output_database'])
 
     # output to files
     # =========================================================================
@@ -1040,18 +606,21 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     else:
         output_fname = output_dir + 'flux_' + run_date_str + '.csv'
 
-    # rounding off to reduce output file size
+    # rounding off to reduce output file size, while formatting
     # '%.6f' is the accuracy of single-precision floating numbers
     # do not round off day of year variables or chamber descriptors
     qc_cols = ['qc_' + s for s in species_list]
     n_obs_cols = ['n_obs_' + s for s in species_list]
-    df_flux = df_flux.round(
-        {key: 6 for key in df_flux.columns.values
-         if key not in ['doy_utc', 'doy_local', 'ch_no',
-                        'ch_label', 'A_ch', 'V_ch'] + qc_cols + n_obs_cols})
-
-    df_flux.to_csv(output_fname, sep=',', na_rep='NaN', index=False)
-    # no need to have 'row index', therefore, set `index=False`
+    output_decimals = run_options['output_decimals']
+    with timer.stage('output'):
+        output_fname = write_table(
+            df_flux, output_fname,
+            decimals={key: output_decimals
+                      for key in df_flux.columns.values
+                      if key not in ['doy_utc', 'doy_local', 'ch_no',
+                                     'ch_label', 'A_ch', 'V_ch'] +
+                      qc_cols + n_obs_cols},
+            na_rep='NaN', compression=run_options['output_compression'])
 
     print('Raw data on the day %s processed.' % run_date_str)
     print('Data table saved to %s' % output_fname)
@@ -1065,30 +634,52 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
             diag_fname = output_dir + '/diag/' + \
                 'diag_' + run_date_str + '.csv'
 
-        # rounding off to reduce output file size
+        # rounding off to reduce output file size, while formatting
         # '%.6f' is the accuracy of single-precision floating numbers
         # do not round off day of year variables or chamber descriptors
         # also, do not round off p-value
-        df_diag = df_diag.round(
-            {key: 6 for key in df_diag.columns.values
-             if (key not in ['doy_utc', 'doy_local', 'ch_no'] and
-                 'p_' not in key)})
-
-        df_diag.to_csv(diag_fname, sep=',', na_rep='NaN', index=False)
-        # no need to have 'row index', therefore, set `index=False`
+        with timer.stage('output'):
+            diag_fname = write_table(
+                df_diag, diag_fname,
+                decimals={key: output_decimals
+                          for key in df_diag.columns.values
+                          if (key not in ['doy_utc', 'doy_local', 'ch_no'] and
+                              'p_' not in key)},
+                na_rep='NaN', compression=run_options['output_compression'])
 
         print('Curve fitting diagnostics saved to %s' % diag_fname)
 
+    if run_options['save_fitting_curves']:
+        if data_dir['output_filename_prefix'] != '':
+            curves_fname = output_dir + '/curves/' + \
+                data_dir['output_filename_prefix'] + \
+                '_curves_%s.npz' % run_date_str
+        else:
+            curves_fname = output_dir + '/curves/' + \
+                'curves_' + run_date_str + '.npz'
+        with timer.stage('output'):
+            curves_fname = save_fitting_curves(curves_fname, day_curves)
+        if curves_fname is not None:
+            print('Fitting curves saved to %s' % curves_fname)
+
     # generate daily plots
     # =========================================================================
     if run_options['save_daily_plots']:
+        stage_daily_plots = timer.start('plotting')
         dailyplot_fontsize = 9
-        hr_local = (ch_time - np.round(ch_time[0])) * 24.
+        hr_local = (ch_time - day_start) / 3600e9
         if config['biomet_data_settings']['time_in_UTC']:
             tz_str = 'UTC'
         else:
             tz_str = 'UTC+%d' % site_parameters['time_zone']
 
+        # plot the fluxes as written to the output files
+        df_daily = df_flux[
+            [pfx + spc + sfx for spc in species_list
+             for pfx in ['f', 'se_f'] for sfx in ['_lin', '_rlin', '_nonlin']]]
+        if output_decimals is not None:
+            df_daily = df_daily.round(output_decimals)
+
         arr_ch_label = df_flux['ch_label'].values
         unique_ch_label = np.unique(arr_ch_label)
         fig_daily, axes_daily = plt.subplots(
@@ -1099,29 +690,29 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
             for k, lb_ch in enumerate(unique_ch_label):
                 axes_daily[j, k].errorbar(
                     hr_local[arr_ch_label == lb_ch],
-                    df_flux.loc[arr_ch_label == lb_ch, 'f%s_lin' % spc],
+                    df_daily.loc[arr_ch_label == lb_ch, 'f%s_lin' % spc],
                     # flux_lin[arr_ch_label == lb_ch, j],
                     # yerr=se_flux_lin[arr_ch_label == lb_ch, spc_id] * 2.,
-                    yerr=df_flux.loc[arr_ch_label == lb_ch,
-                                     'se_f%s_lin' % spc] * 2.,
+                    yerr=df_daily.loc[arr_ch_label == lb_ch,
+                                      'se_f%s_lin' % spc] * 2.,
                     c='#d62728', fmt='o', markeredgecolor='None', markersize=5,
                     linestyle='-', lw=1.5, capsize=0, label='linear')
                 axes_daily[j, k].errorbar(
                     hr_local[arr_ch_label == lb_ch],
-                    df_flux.loc[arr_ch_label == lb_ch, 'f%s_rlin' % spc],
+                    df_daily.loc[arr_ch_label == lb_ch, 'f%s_rlin' % spc],
                     # flux_rlin[arr_ch_label == lb_ch, j],
                     # yerr=se_flux_rlin[arr_ch_label == lb_ch, spc_id] * 2.,
-                    yerr=df_flux.loc[arr_ch_label == lb_ch,
-                                     'se_f%s_rlin' % spc] * 2.,
+                    yerr=df_daily.loc[arr_ch_label == lb_ch,
+                                      'se_f%s_rlin' % spc] * 2.,
                     c='#1f77b4', fmt='d', markeredgecolor='None', markersize=5,
                     linestyle='--', lw=1.5, capsize=0, label='robust linear')
                 axes_daily[j, k].errorbar(
                     hr_local[arr_ch_label == lb_ch],
-                    df_flux.loc[arr_ch_label == lb_ch, 'f%s_nonlin' % spc],
+                    df_daily.loc[arr_ch_label == lb_ch, 'f%s_nonlin' % spc],
                     # flux_nonlin[arr_ch_label == lb_ch, j],
                     # yerr=se_flux_nonlin[arr_ch_label == lb_ch, spc_id] * 2.,
-                    yerr=df_flux.loc[arr_ch_label == lb_ch,
-                                     'se_f%s_nonlin' % spc] * 2.,
+                    yerr=df_daily.loc[arr_ch_label == lb_ch,
+                                      'se_f%s_nonlin' % spc] * 2.,
                     c='#7f7f7f', fmt='P', markeredgecolor='None', ms=5,
                     linestyle='-.', lw=1.5, capsize=0, label='nonlinear')
                 axes_daily[j, k].tick_params(labelsize=dailyplot_fontsize)
@@ -1160,6 +751,7 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
         # important! release the memory after figure is saved
         fig_daily.clf()
         plt.close()
+        timer.stop(stage_daily_plots)
 
         print('Daily flux summary plots generated.')
 
@@ -1167,7 +759,306 @@ def flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
     return None
 
 
+def slice_conc_archive(conc_archive, ts_start, buffer_len=0):
+    """
+    Slice the concentration archive for a day without copying the data.
+
+    The slice extends past the end of the day by `buffer_len` (in
+    nanoseconds; see `common.max_window_length()`), so that the sampling
+    windows starting near midnight are not truncated.
+    """
+    return conc_archive.slice(
+        ts_start, (ts_start + pd.Timedelta(days=1)).value + buffer_len)
+
+
+def load_day_data(config, biomet_ts_query, ts_start, conc_archive=None):
+    """
+    Load the biomet, concentration, and flow data files of a day.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary parsed from the YAML config file.
+    biomet_ts_query : str
+        Date substring to query the biomet data files of the day.
+    ts_start : pandas.Timestamp
+        Start of the day.
+    conc_archive : chflux.io.archive.MemmapArchive, optional
+        If given, concentration data are not loaded from files.
+
+    Returns
+    -------
+    day_data : dict or None
+        Data tables keyed by 'biomet', 'conc', and 'flow', and the start of
+        the day keyed by 'ts_start'.  Concentration and flow data are aliases
+        of the biomet data if not stored in their own files.  Return `None`
+        if the day should be skipped.
+
+    """
+    conc_ts_query = ts_start.strftime(
+        config['data_dir']['conc_data.date_format'])
+    flow_ts_query = ts_start.strftime(
+        config['data_dir']['flow_data.date_format'])
+    # read biomet data
+    df_biomet = load_tabulated_data('biomet', config, query=biomet_ts_query)
+    # check data size; if no data entry in it, skip
+    if df_biomet is None:
+        print('No biomet data file is found on day %s. Skip.' %
+              biomet_ts_query)
+        return None
+    elif df_biomet.shape[0] == 0:
+        print('No entry in the biomet data on day %s. Skip.' %
+              biomet_ts_query)
+    # check timestamp existence
+    if 'timestamp' not in df_biomet.columns.values:
+        print('No time variable found in the biomet data ' +
+              'on day %s. Skip.' % biomet_ts_query)
+
+    # read concentration data
+    if conc_archive is not None:
+        # sliced from the archive after the day is determined
+        df_conc = None
+    elif config['data_dir']['separate_conc_data']:
+        # if concentration data are in their own files, read from files
+        df_conc = load_tabulated_data('conc', config, query=conc_ts_query)
+        # check data size; if no data entry in it, skip
+        if df_conc is None:
+            print('No concentration data file is found on day %s. ' %
+                  conc_ts_query + 'Skip.')
+            return None
+        elif df_conc.shape[0] == 0:
+            print('No entry in the concentration data on day %s. ' %
+                  conc_ts_query + 'Skip.')
+        # check timestamp existence
+        if 'timestamp' not in df_conc.columns.values:
+            print('No time variable found in the concentration data' +
+                  'on day %s. Skip.' % conc_ts_query)
+    else:
+        # if concentration data are not in their own files
+        # create aliases for biomet data and the parsed time variable
+        df_conc = df_biomet
+
+    # read flow data
+    if config['data_dir']['separate_flow_data']:
+        # if flow data are in their own files, read from files
+        df_flow = load_tabulated_data('flow', config, query=flow_ts_query)
+        # check data size; if no data entry in it, skip
+        if df_flow is None:
+            print('No flow data file is found on day %s. Skip.' %
+                  flow_ts_query)
+        elif df_flow.shape[0] == 0:
+            print('No entry in the flow data on day %s. Skip.' %
+                  flow_ts_query)
+        # check timestamp existence
+        if 'timestamp' not in df_flow.columns.values:
+            print('No time variable found in the flow rate data ' +
+                  'on day %s. Skip.' % flow_ts_query)
+    else:
+        # if flow data are not in their own files, create aliases for
+        # biomet data and the parsed time variable
+        df_flow = df_biomet
+
+    return {'ts_start': ts_start, 'biomet': df_biomet, 'conc': df_conc,
+            'flow': df_flow}
+
+
+def iter_day_data(config, biomet_query_list, biomet_date_series,
+                  conc_archive=None, prefetch_days=0):
+    """
+    Iterate over the data of the days in order.
+
+    With `prefetch_days` > 0, the days are loaded and parsed ahead on a
+    background thread, so that reading the files of the next days overlaps
+    with the flux calculation of the current day.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary parsed from the YAML config file.
+    biomet_query_list : list of str
+        Date substrings to query the biomet data files of the days.
+    biomet_date_series : pandas.DatetimeIndex
+        Start of the days.
+    conc_archive : chflux.io.archive.MemmapArchive, optional
+        If given, concentration data are not loaded from files.
+    prefetch_days : int, optional
+        Number of days to load ahead of the consumer.  Default is 0 to load
+        in the calling thread.
+
+    Yields
+    ------
+    day_data : dict or None
+        Data of a day as returned by `load_day_data()`.
+
+    """
+    if prefetch_days < 1:
+        for query, ts_start in zip(biomet_query_list, biomet_date_series):
+            yield load_day_data(config, query, ts_start, conc_archive)
+        return
+
+    # one loader thread keeps the files read in order
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    futures = collections.deque()
+    try:
+        for query, ts_start in zip(biomet_query_list, biomet_date_series):
+            futures.append(executor.submit(load_day_data, config, query,
+                                           ts_start, conc_archive))
+            if len(futures) > prefetch_days:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        # do not load further days if the consumer stops early
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def slice_day_edge(day_data, t_start, t_end):
+    """
+    Slice the data tables of a day to the time range `[t_start, t_end)`.
+
+    Aliases among the data tables are kept.  Tables without the `time_ns`
+    variable are not sliced and returned as `None`.
+    """
+    if day_data is None:
+        return None
+    edge = {'ts_start': day_data['ts_start']}
+    for name in ['biomet', 'conc', 'flow']:
+        df = day_data[name]
+        if name != 'biomet' and df is day_data['biomet']:
+            edge[name] = edge['biomet']
+        elif df is None or 'time_ns' not in df.columns.values:
+            edge[name] = None
+        else:
+            t = df['time_ns'].values
+            edge[name] = df.loc[(t >= t_start) & (t < t_end), :]
+    return edge
+
+
+def extend_day_data(day_data, prev_tail=None, next_head=None):
+    """
+    Extend the data tables of a day with the tail of the previous day and the
+    head of the next day, so that the sampling windows near midnight see all
+    their data.  Aliases among the data tables are kept.
+
+    Day files often overlap at midnight (e.g., a file that includes the
+    closing midnight record of its day).  Where an edge of a neighboring day
+    is added, the day's own table is first cut at midnight, so that the
+    overlapping records are not counted twice.
+    """
+    extended = {'ts_start': day_data['ts_start']}
+    day_start = day_data['ts_start'].value
+    day_end = (day_data['ts_start'] + pd.Timedelta(days=1)).value
+    for name in ['biomet', 'conc', 'flow']:
+        df = day_data[name]
+        if name != 'biomet' and df is day_data['biomet']:
+            extended[name] = extended['biomet']
+            continue
+        if df is None:
+            extended[name] = None
+            continue
+        head = prev_tail[name] if prev_tail is not None else None
+        tail = next_head[name] if next_head is not None else None
+        if head is not None and head.shape[0] == 0:
+            head = None
+        if tail is not None and tail.shape[0] == 0:
+            tail = None
+        if (head is not None or tail is not None) and \
+                'time_ns' in df.columns.values:
+            t = df['time_ns'].values
+            in_day = np.ones(t.size, dtype=bool)
+            if head is not None:
+                in_day &= t >= day_start
+            if tail is not None:
+                in_day &= t < day_end
+            if not np.all(in_day):
+                df = df.loc[in_day, :]
+        frames = [f for f in [head, df, tail]
+                  if f is not None and f.shape[0] > 0]
+        if len(frames) > 1:
+            extended[name] = pd.concat(frames, ignore_index=True)
+        elif frames:
+            extended[name] = frames[0]
+        else:
+            extended[name] = df
+    return extended
+
+
+# datasets of the run shared by `flux_calc_day()` calls; in worker processes,
+# the biomet, concentration, and flow data are descriptors of shared tables
+_run_data = {}
+
+
+def _init_run_data(run_data):
+    """Set the datasets of the run; also the worker pool initializer."""
+    _run_data.clear()
+    _run_data.update(run_data)
+
+
+def flux_calc_day(ts_start, bounds=None):
+    """
+    Calculate fluxes of a day from the datasets of the run.  `bounds` are the
+    row bounds of the day in the biomet, concentration, and flow data, which
+    are sliced (or mapped, if they are shared tables) to those rows.
+    """
+    df_biomet, df_conc, df_flow = attach_tables(
+        [_run_data['df_biomet'], _run_data['df_conc'], _run_data['df_flow']],
+        bounds)
+    if _run_data['conc_archive'] is not None:
+        df_conc = slice_conc_archive(_run_data['conc_archive'], ts_start,
+                                     _run_data['buffer_len'])
+    flux_calc(df_biomet, df_conc, df_flow,
+              _run_data['df_leaf'], _run_data['df_timelag'], ts_start,
+              _run_data['year_ref'], _run_data['config'],
+              _run_data['chamber_config'])
+
+
+def _worker_timer_snapshot():
+    """
+    Return the stage times of a worker process since its last day, to be
+    merged into the run timer of the main process.
+    """
+    timer = get_run_timer()
+    timer.dump_profiles()
+    return timer.snapshot(reset=True)
+
+
+def flux_calc_day_in_worker(ts_start, bounds=None):
+    """
+    Calculate fluxes of a day in a worker process; see `flux_calc_day()`.
+    Return the stage times of the day.
+    """
+    flux_calc_day(ts_start, bounds)
+    return _worker_timer_snapshot()
+
+
+def flux_calc_shared(df_biomet, df_conc, df_flow, *args):
+    """
+    Calculate fluxes of a day from shared biomet, concentration, and flow
+    tables in a worker process; the other arguments are those of
+    `flux_calc()`.  Return the stage times of the day.
+    """
+    df_biomet, df_conc, df_flow = attach_tables([df_biomet, df_conc, df_flow])
+    flux_calc(df_biomet, df_conc, df_flow, *args)
+    return _worker_timer_snapshot()
+
+
+def _finish_shared_day(day_task, shared):
+    """Wait for a day submitted to the pool and release its tables."""
+    result, tables = day_task
+    try:
+        # re-raise errors from the workers
+        get_run_timer().merge(result.get())
+    finally:
+        for table in tables:
+            if table is not None:
+                shared.release(table)
+
+
 def main():
+    args = parser.parse_args()
+
     # Echo program starting
     # =========================================================================
     print('Starting data processing...')
@@ -1220,6 +1111,32 @@ def main():
         # and parse those options here
     else:
         ts_query = None  # assign None to fall back to the default option
+    data_query = {'biomet': ts_query, 'conc': ts_query, 'flow': ts_query}
+
+    # absolute date range to process; the command line overrides the config
+    date_start = config['run_options']['date_start']
+    date_end = config['run_options']['date_end']
+    if args.date_start is not None:
+        date_start = args.date_start
+    if args.date_end is not None:
+        date_end = args.date_end
+    if config['run_options']['process_recent_period']:
+        date_start, date_end = None, None
+    elif date_start is not None and date_end is not None:
+        # also query the day after the range, because the last sampling
+        # windows may extend past midnight
+        ts_range = pd.date_range(
+            start=pd.Timestamp(date_start).floor('D'),
+            end=pd.Timestamp(date_end).floor('D') + pd.Timedelta(days=1))
+        # query file names by the date format of each data type
+        for data_name in data_query:
+            data_query[data_name] = ts_range.strftime(
+                config['data_dir'][data_name + '_data.date_format']).tolist()
+    if date_start is not None or date_end is not None:
+        print('Processing dates from %s to %s' % (date_start, date_end))
+
+    # one worker pool for the whole run, if parallel processing is enabled
+    n_workers = config['run_options']['n_workers']
 
     # Create or locate directories for output
     # =========================================================================
@@ -1230,6 +1147,14 @@ def main():
     if (config['run_options']['save_fitting_diagnostics'] and
             not os.path.exists(output_dir + '/diag')):
         os.makedirs(output_dir + '/diag')
+    if (config['run_options']['save_fitting_curves'] and
+            not os.path.exists(output_dir + '/curves')):
+        os.makedirs(output_dir + '/curves')
+    # time the stages of the run, and profile the chosen stages
+    profile_stages = config['run_options']['profile_stages']
+    timer = set_run_timer(
+        profile_stages=profile_stages,
+        profile_dir=output_dir + '/profile' if profile_stages else None)
     # save config if enabled
     if config['run_options']['save_config']:
         if not os.path.exists(output_dir + '/config'):
@@ -1247,13 +1172,47 @@ def main():
 
     # Load data files
     # =========================================================================
+    # open the memory-mapped concentration archive, if used
+    if config['data_dir']['conc_archive'] is not None:
+        conc_archive = open_archive(config['data_dir']['conc_archive'])
+        print('Notice: Concentration data are read from the archive %s' %
+              config['data_dir']['conc_archive'])
+    else:
+        conc_archive = None
+
     if config['run_options']['load_data_by_day']:
         # this branch loads data by daily chunks
-        biomet_data_flist = glob.glob(config['data_dir']['biomet_data'])
-        biomet_data_flist = sorted(biomet_data_flist)
+        biomet_data_flist = search_data_files(
+            config['data_dir']['biomet_data'])
         biomet_query_list, biomet_date_series = extract_date_substr(
             biomet_data_flist,
             date_format=config['data_dir']['biomet_data.date_format'])
+        # select the days in the date range
+        date_mask = filter_dates(biomet_date_series, date_start, date_end)
+        if not np.any(date_mask):
+            raise RuntimeError('No biomet data file is found in the range.')
+        n_days = int(np.sum(date_mask))
+        # also load the day after the range, only for the head of its data,
+        # because the last sampling windows may extend past midnight
+        biomet_days = biomet_date_series.floor('D')
+        i_next = np.flatnonzero(
+            biomet_days == biomet_days[date_mask].max() + pd.Timedelta(days=1))
+        if i_next.size > 0:
+            date_mask[i_next[0]] = True
+        biomet_query_list = [q for q, m in zip(biomet_query_list, date_mask)
+                             if m]
+        biomet_date_series = biomet_date_series[date_mask]
+        # day of year numbers in chamber schedules refer to the first year
+        year_ref = biomet_date_series[0].year
+
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers)
+            # results of the days submitted to the pool, with their tables
+            pending = []
+            # day tables are passed to the workers in shared files
+            shared = SharedTables()
+        else:
+            pool = None
 
         # read leaf data (outside of the loop)
         if config['data_dir']['separate_leaf_data']:
@@ -1292,100 +1251,83 @@ def main():
             # if not using external timelag data
             df_timelag = None
 
-        for i in range(len(biomet_query_list)):
-            biomet_ts_query = biomet_query_list[i]
-            conc_ts_query = biomet_date_series[i].strftime(
-                config['data_dir']['conc_data.date_format'])
-            flow_ts_query = biomet_date_series[i].strftime(
-                config['data_dir']['flow_data.date_format'])
-            # read biomet data
-            df_biomet = \
-                load_tabulated_data('biomet', config, query=biomet_ts_query)
-            # check data size; if no data entry in it, skip
-            if df_biomet is None:
-                print('No biomet data file is found on day %s. Skip.' %
-                      biomet_ts_query)
+        # sampling windows near midnight need data from the neighboring
+        # days; keep a carry-over buffer of the previous day's tail and
+        # prefetch the next day's head, both as long as the longest window
+        buffer_len = max_window_length(chamber_config)
+        print('Carry-over buffer between days is %.1f minutes.' %
+              (buffer_len / 60e9))
+        one_day = pd.Timedelta(days=1)
+        prev_tail = None
+        # the next days are loaded in the background during the calculation
+        day_data_iter = iter_day_data(
+            config, biomet_query_list, biomet_date_series, conc_archive,
+            prefetch_days=config['run_options']['prefetch_days'])
+        next_data = next(day_data_iter)
+        # fluxes are not calculated for the day after the range
+        for i in range(n_days):
+            day_data = next_data
+            next_data = next(day_data_iter, None)
+            if day_data is None:
+                prev_tail = None
                 continue
-            elif df_biomet.shape[0] == 0:
-                print('No entry in the biomet data on day %s. Skip.' %
-                      biomet_ts_query)
-            # check timestamp existence
-            if 'timestamp' not in df_biomet.columns.values:
-                print('No time variable found in the biomet data ' +
-                      'on day %s. Skip.' % biomet_ts_query)
-
-            # read concentration data
-            if config['data_dir']['separate_conc_data']:
-                # if concentration data are in their own files, read from files
-                df_conc = \
-                    load_tabulated_data('conc', config, query=conc_ts_query)
-                # check data size; if no data entry in it, skip
-                if df_conc is None:
-                    print('No concentration data file is found on day %s. ' %
-                          conc_ts_query + 'Skip.')
-                    continue
-                elif df_conc.shape[0] == 0:
-                    print('No entry in the concentration data on day %s. ' %
-                          conc_ts_query + 'Skip.')
-                # check timestamp existence
-                if 'timestamp' not in df_conc.columns.values:
-                    print('No time variable found in the concentration data' +
-                          'on day %s. Skip.' % conc_ts_query)
-            else:
-                # if concentration data are not in their own files
-                # create aliases for biomet data and the parsed time variable
-                df_conc = df_biomet
-
-            # read flow data
-            if config['data_dir']['separate_flow_data']:
-                # if flow data are in their own files, read from files
-                df_flow = \
-                    load_tabulated_data('flow', config, query=flow_ts_query)
-                # check data size; if no data entry in it, skip
-                if df_flow is None:
-                    print('No flow data file is found on day %s. Skip.' %
-                          flow_ts_query)
-                elif df_flow.shape[0] == 0:
-                    print('No entry in the flow data on day %s. Skip.' %
-                          flow_ts_query)
-                # check timestamp existence
-                if 'timestamp' not in df_flow.columns.values:
-                    print('No time variable found in the flow rate data ' +
-                          'on day %s. Skip.' % flow_ts_query)
-            else:
-                # if flow data are not in their own files, create aliases for
-                # biomet data and the parsed time variable
-                df_flow = df_biomet
-
-            year_biomet = df_biomet.loc[0, 'timestamp'].year
-            if year_biomet is None:
-                year_biomet = config['biomet_data_settings']['year_ref']
-
-            year_conc = df_conc.loc[0, 'timestamp'].year
-            if year_conc is None:
-                year_conc = config['conc_data_settings']['year_ref']
 
-            if (year_biomet != year_conc and
-                    config['data_dir']['separate_conc_data']):
-                raise RuntimeError('Year numbers do not match between ' +
-                                   'biomet data and concentration data.')
+            ts_start = day_data['ts_start']
+            day_end = (ts_start + one_day).value
+            # buffers are only taken from consecutive days
+            if prev_tail is not None and \
+                    prev_tail['ts_start'] + one_day != ts_start:
+                prev_tail = None
+            next_head = None
+            if next_data is not None and \
+                    next_data['ts_start'] == ts_start + one_day:
+                next_head = slice_day_edge(next_data, day_end,
+                                           day_end + buffer_len)
+            day_extended = extend_day_data(day_data, prev_tail, next_head)
+            prev_tail = slice_day_edge(day_data, day_end - buffer_len,
+                                       day_end)
+            del day_data
+
+            df_biomet = day_extended['biomet']
+            df_conc = day_extended['conc']
+            df_flow = day_extended['flow']
 
             # Calculate fluxes, and output plots and the processed data
             # =================================================================
             print('Calculating fluxes...')
 
-            doy = (biomet_date_series[i] -
-                   pd.Timestamp('%s-01-01' % year_biomet)) / \
-                pd.Timedelta(days=1)
-            year = year_biomet
+            if conc_archive is not None:
+                df_conc = slice_conc_archive(conc_archive, ts_start,
+                                             buffer_len)
 
             # calculate fluxes
-            flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
-                      doy, year, config, chamber_config)
+            flux_calc_args = (df_leaf, df_timelag, ts_start, year_ref,
+                              config, chamber_config)
+            if pool is None:
+                flux_calc(df_biomet, df_conc, df_flow, *flux_calc_args)
+            else:
+                # hold at most `n_workers` days in memory
+                if len(pending) >= n_workers:
+                    _finish_shared_day(pending.pop(0), shared)
+                tables = [shared.share(df)
+                          for df in (df_biomet, df_conc, df_flow)]
+                result = pool.apply_async(flux_calc_shared,
+                                          tables + list(flux_calc_args))
+                pending.append((result, tables))
+
+        if pool is not None:
+            try:
+                for day_task in pending:
+                    _finish_shared_day(day_task, shared)
+                pool.close()
+                pool.join()
+            finally:
+                shared.close()
     else:
         # this branch loads all the data at once
         # read biomet data
-        df_biomet = load_tabulated_data('biomet', config, query=ts_query)
+        df_biomet = load_tabulated_data('biomet', config,
+                                        query=data_query['biomet'])
         # check data size; if no data entry in it, terminate the program
         if df_biomet is None:
             raise RuntimeError('No biomet data file is found.')
@@ -1396,9 +1338,13 @@ def main():
             raise RuntimeError('No time variable found in the biomet data.')
 
         # read concentration data
-        if config['data_dir']['separate_conc_data']:
+        if conc_archive is not None:
+            # concentration data are sliced from the archive by day
+            df_conc = None
+        elif config['data_dir']['separate_conc_data']:
             # if concentration data are in their own files, read from files
-            df_conc = load_tabulated_data('conc', config, query=ts_query)
+            df_conc = load_tabulated_data('conc', config,
+                                          query=data_query['conc'])
             # check data size; if no data entry in it, terminate the program
             if df_conc is None:
                 raise RuntimeError('No concentration data file is found.')
@@ -1418,7 +1364,8 @@ def main():
         # read flow data
         if config['data_dir']['separate_flow_data']:
             # if flow data are in their own files, read from files
-            df_flow = load_tabulated_data('flow', config, query=ts_query)
+            df_flow = load_tabulated_data('flow', config,
+                                          query=data_query['flow'])
             # check data size; if no data entry in it, terminate the program
             if df_flow is None:
                 raise RuntimeError('No flow data file is found.')
@@ -1472,35 +1419,99 @@ def main():
             # if not using external timelag data
             df_timelag = None
 
-        year_biomet = df_biomet.loc[0, 'timestamp'].year
-        if year_biomet is None:
-            year_biomet = config['biomet_data_settings']['year_ref']
-
-        year_conc = df_conc.loc[0, 'timestamp'].year
-        if year_conc is None:
-            year_conc = config['conc_data_settings']['year_ref']
-
-        if (year_biomet != year_conc and
-                config['data_dir']['separate_conc_data']):
-            raise RuntimeError('Year numbers do not match between ' +
-                               'biomet data and concentration data.')
-
         # Calculate fluxes, and output plots and the processed data
         # =====================================================================
         print('Calculating fluxes...')
 
-        doy_start = np.floor(df_biomet['time_doy'].min())  # NaN skipped
-        doy_end = np.ceil(df_biomet['time_doy'].max())  # NaN skipped
-        year = year_biomet
+        # days covered by the biomet data, which may span several years;
+        # NaT values are skipped
+        ts_first = df_biomet['timestamp'].min().floor('D')
+        ts_last = df_biomet['timestamp'].max().ceil('D')
+        day_series = pd.date_range(ts_first, ts_last, freq='D')[:-1]
+        day_series = day_series[filter_dates(day_series, date_start, date_end)]
+        if not len(day_series):
+            raise RuntimeError('No biomet data in the date range.')
+        # day of year numbers in chamber schedules refer to the first year
+        year_ref = day_series[0].year
+
+        # rows of each day, with margins for windows near midnight; the
+        # tables of a day are sliced before the flux calculation, so that
+        # each day only sorts and copies its own rows
+        buffer_len = max_window_length(chamber_config)
+
+        # all days are processed from the same loaded datasets
+        run_data = {'df_biomet': df_biomet, 'df_conc': df_conc,
+                    'df_flow': df_flow, 'df_leaf': df_leaf,
+                    'df_timelag': df_timelag, 'conc_archive': conc_archive,
+                    'buffer_len': buffer_len, 'year_ref': year_ref,
+                    'config': config, 'chamber_config': chamber_config}
+
+        tables = [df_biomet, df_conc, df_flow]
+        day_tasks = []
+        for ts_start in day_series:
+            t_start = ts_start.value - buffer_len
+            t_end = (ts_start + pd.Timedelta(days=1)).value + buffer_len
+            day_tasks.append(
+                (ts_start, [table_bounds(df, t_start, t_end)
+                            for df in tables]))
 
         # calculate fluxes day by day
-        for doy in np.arange(doy_start, doy_end):
-            flux_calc(df_biomet, df_conc, df_flow, df_leaf, df_timelag,
-                      doy, year, config, chamber_config)
+        if n_workers > 1:
+            # the data are written once to shared files, and the workers
+            # receive the descriptors and the row bounds of each day
+            with SharedTables() as shared:
+                for name, df in zip(['df_biomet', 'df_conc', 'df_flow'],
+                                    tables):
+                    run_data[name] = shared.share(df)
+                pool = multiprocessing.Pool(
+                    n_workers, initializer=_init_run_data,
+                    initargs=(run_data,))
+                # `starmap` keeps the day order and re-raises errors from the
+                # workers
+                for snapshot in pool.starmap(flux_calc_day_in_worker,
+                                             day_tasks, chunksize=1):
+                    timer.merge(snapshot)
+                pool.close()
+                pool.join()
+        else:
+            _init_run_data(run_data)
+            for ts_start, bounds in day_tasks:
+                flux_calc_day(ts_start, bounds)
+
+    # stop the process pool for fitting windows, if any
+    close_fit_pool()
+    # wait for the fitting plots still being rendered
+    if config['run_options']['save_fitting_plots']:
+        with timer.stage('plotting'):
+            close_plot_renderer()
+    else:
+        close_plot_renderer()
 
     # Echo program ending
     # =========================================================================
     dt_end = datetime.datetime.now()
+    print('\nTime spent in the processing stages:')
+    print(timer.summary())
+    timer.dump_profiles()
+    if config['run_options']['save_run_report']:
+        report_fname = timer.write_report(
+            output_dir + '/run_report_%s.json' %
+            dt_start.strftime('%Y%m%d_%H%M%S'),
+            started=dt_start.isoformat(), finished=dt_end.isoformat(),
+            elapsed_seconds=(dt_end - dt_start).total_seconds(),
+            config_file=args.config,
+            chamber_config_file=config['run_options'][
+                'chamber_config_filepath'],
+            date_range=[date_start, date_end],
+            n_workers=n_workers,
+            n_fit_workers=config['run_options']['n_fit_workers'],
+            fit_executor=config['run_options']['fit_executor'],
+            fit_engine=config['run_options']['fit_engine'],
+            versions={'python': platform.python_version(),
+                      'numpy': np.__version__, 'pandas': pd.__version__,
+                      'scipy': scipy.__version__,
+                      'matplotlib': mpl.__version__})
+        print('Run report saved to %s' % report_fname)
     print('\n%s' % datetime.datetime.strftime(dt_end, '%Y-%m-%d %X'))
     print('Done. Finished in %.2f seconds.' %
           (dt_end - dt_start).total_seconds())
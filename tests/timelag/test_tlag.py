@@ -4,7 +4,7 @@ Test the timelag optimization function.
 import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../'))
-from common_func import optimize_timelag
+from chflux.common import optimize_timelag
 
 import numpy as np
 from numpy import random